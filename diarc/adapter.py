@@ -12,6 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+
+def reads_topology(method):
+    """ Decorator for adapter methods which hold the read lock of the adapter's
+    topology while they run. See Topology.reading()
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._topology.reading():
+            return method(self, *args, **kwargs)
+    return locked
+
+def writes_topology(method):
+    """ Decorator for adapter methods which hold the write lock of the adapter's
+    topology while they run. See Topology.writing()
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._topology.writing():
+            return method(self, *args, **kwargs)
+    return locked
+
 class Adapter(object):
     """ Interface definations provided by the Adapter for use by the View.
 
@@ -17,12 +17,22 @@ from view import BlockItemAttributes
 from view import BandItemAttributes
 from view import SnapItemAttributes
 from adapter import Adapter
+from adapter import reads_topology
+from compaction import STRIDE, compact, free_key
 from topology import *
 import sys
 import logging
 
 log = logging.getLogger('diarc.base_adapter')
 
+def _is_move(src, lower, upper):
+    """ returns false if the value src already lies between lower and upper,
+    which are None past the first or last value, or is one of them
+    """
+    if src in (lower,upper):
+        return False
+    return not ((lower is None or lower < src) and (upper is None or upper > src))
+
 class BaseAdapter(Adapter):
     """ Basic implementation of the adapter interface.
     This should not have any QT or non-standard topology specific code. """
@@ -73,133 +83,66 @@ class BaseAdapter(Adapter):
     def reorder_blocks(self,srcIdx,lowerIdx,upperIdx):
         """ reorders the index values of blocks and triggers the view to redraw.
         This also requires updating the corresponding block_items.
-        """ 
-        blocks = self._topology.blocks
 
-        lastIdx = None
-        currIdx = srcIdx
-        # If we are moving to the right, lowerIdx is the target index.
-        # Clear the dragged block's index, then shift all effected block
-        # indices left.
-        # NOTE: See issue #12
-        if lowerIdx is not None and lowerIdx > srcIdx:
-            while isinstance(currIdx,int) and currIdx < (upperIdx or lowerIdx+1): # In case upperIdx is None, use lower+1
-                nextIdx = blocks[currIdx].rightBlock.index if blocks[currIdx].rightBlock else None
-                blocks[currIdx].index = lastIdx
-                log.debug("%s -> %s"%(str(currIdx),str(lastIdx)))
-                lastIdx = currIdx
-                currIdx = nextIdx
-            assert lastIdx == lowerIdx, "%r %r"%(lastIdx,upperIdx)
-
-        # If we are moving to the left, upperIdx is the target index.
-        # Clear the dragged blocks index, then shift all effected blocks right
-        elif upperIdx is not None and upperIdx < srcIdx:
-            while isinstance(currIdx,int) and currIdx > lowerIdx:
-                nextIdx = blocks[currIdx].leftBlock.index if blocks[currIdx].leftBlock else None
-                blocks[currIdx].index = lastIdx
-                log.debug("%s -> %s"%(str(currIdx),str(lastIdx)))
-                lastIdx = currIdx
-                currIdx = nextIdx
-            assert lastIdx == upperIdx, "%r %r"%(lastIdx,upperIdx)
-
-        # Otherwise we are just dragging to the side a bit and nothing is 
-        # really moving anywhere. Return immediately to avoid trying to give
-        # the block a new index and unnecessary extra linking actions.
-        else:
+        The moved block is given an unused index between lowerIdx and upperIdx,
+        so no other block changes index unless there is no room left between
+        them, in which case the block indices are compacted to make room.
+        """ 
+        if not _is_move(srcIdx,lowerIdx,upperIdx):
             return False
-        # Finally give the moved object its desired destination. Then make 
-        # the TopologyWidget relink all the objects again.
-        blocks[srcIdx].index = lastIdx
+        with self._topology.writing():
+            index = free_key(self._topology._block_index,lowerIdx,upperIdx,minimum=0)
+            if index is None:
+                remap = compact(self._topology,STRIDE,bands=False,snaps=False).blocks
+                srcIdx,lowerIdx,upperIdx = [remap.get(i,i) for i in [srcIdx,lowerIdx,upperIdx]]
+                index = free_key(self._topology._block_index,lowerIdx,upperIdx,minimum=0)
+            log.debug("%s -> %s"%(str(srcIdx),str(index)))
+            self._topology.blocks[srcIdx].index = index
         self._update_view()
         return True
 
 
     def reorder_bands(self, srcAlt, lowerAlt, upperAlt):
-        """ Reorders the altitude values of bands """
-        bands = self._topology.bands
-
-        lastAlt = None
-        currAlt = srcAlt
-
-        # If we are moving up, lowerAlt is the target altitude. 
-        # Clear the dragged bands's altitude, then shift all effected bands
-        # down. See issue #12
-        if isinstance(lowerAlt,int) and lowerAlt > srcAlt:
-            while isinstance(currAlt,int) and currAlt < (upperAlt or lowerAlt+1):
-                tband = bands[currAlt].topBand
-                nextAlt = tband.altitude if isinstance(tband,Band) else None
-                bands[currAlt].altitude = lastAlt
-                lastAlt = currAlt
-                currAlt = nextAlt
-            # Assertion check
-            assert lastAlt == lowerAlt, "%r %r"%(lastAlt,lowerAlt)
-
-        # If we are moving down, upperAlt is the target altitude.
-        # Clear the dragged bands altitude, then shift all effected bands up.
-        elif isinstance(upperAlt,int) and upperAlt <= srcAlt:
-            while isinstance(currAlt,int) and currAlt > (lowerAlt or upperAlt-1):
-                lband = bands[currAlt].bottomBand
-                nextAlt = lband.altitude if isinstance(lband,Band) else None
-                bands[currAlt].altitude = lastAlt
-                lastAlt = currAlt
-                currAlt = nextAlt
-            # Assertion check
-            assert lastAlt == upperAlt, "%r %r"%(lastAlt,upperAlt)
-
-        else:
+        """ Reorders the altitude values of bands. The moved band is given an
+        unused altitude between lowerAlt and upperAlt, on its own side of the
+        block ribbon, in the same way as reorder_blocks.
+        """
+        if not _is_move(srcAlt,lowerAlt,upperAlt):
             return False
-
-        # Finally, give the moved object its desired destination. Then make
-        # the TopologyWidget relink all the objects again
-        bands[srcAlt].altitude = lastAlt
+        # Bands cannot cross the ribbon
+        bounds = dict(minimum=1) if srcAlt > 0 else dict(maximum=-1)
+        with self._topology.writing():
+            index = self._topology._pos_band_index if srcAlt > 0 else self._topology._neg_band_index
+            altitude = free_key(index,lowerAlt,upperAlt,**bounds)
+            if altitude is None:
+                remap = compact(self._topology,STRIDE,blocks=False,snaps=False).bands
+                srcAlt,lowerAlt,upperAlt = [remap.get(a,a) for a in [srcAlt,lowerAlt,upperAlt]]
+                altitude = free_key(index,lowerAlt,upperAlt,**bounds)
+            self._topology.bands[srcAlt].altitude = altitude
         self._update_view()
         return True
 
     def reorder_snaps(self, blockIdx, container, srcIdx, lowerIdx, upperIdx):
+        """ Reorders the order values of snaps in the same way as reorder_blocks """
         assert(container in ["emitter","collector"])
-        block = self._topology.blocks[blockIdx]
-        snaps = block.emitter if container == "emitter" else block.collector
-        log.debug("%s"%snaps.keys())
         log.debug("move snap %s between %s and %s"%(srcIdx,lowerIdx,upperIdx))
-
-        lastIdx = None
-        currIdx = srcIdx
-        # If we are moving to the right, lowerIdx is the target index.
-        # Clear the dragged snaps's order, then shift all effected snap
-        # indices left.
-        # NOTE: see #12
-        if lowerIdx is not None and lowerIdx > srcIdx:
-            while isinstance(currIdx,int) and currIdx < (upperIdx or lowerIdx+1):
-                nextIdx = snaps[currIdx].rightSnap.order if snaps[currIdx].rightSnap else None
-                snaps[currIdx].order = lastIdx
-                log.debug("%s -> %s"%(str(currIdx),str(lastIdx)))
-                lastIdx = currIdx
-                currIdx = nextIdx
-            # Assertion check. TODO: Remove
-            assert lastIdx == lowerIdx, "%r %r"%(lastIdx,lowerIdx)
-
-        # If we are moving to the left, upperIdx is the target index.
-        # Clear the dragged snaps order, then shift all effected snaps
-        # indices right
-        elif upperIdx is not None and upperIdx < srcIdx:
-            while isinstance(currIdx,int) and currIdx > lowerIdx:
-                nextIdx = snaps[currIdx].leftSnap.order if snaps[currIdx].leftSnap else None
-                snaps[currIdx].order = lastIdx
-                log.debug("%s -> %s"%(str(currIdx),str(lastIdx)))
-                lastIdx = currIdx
-                currIdx = nextIdx
-            # Assertion check. TODO remove
-            assert lastIdx == upperIdx, "%r %r"%(lastIdx,upperIdx)
-
-        # Otherwise we are just dragging to the side a bit and nothing is
-        # really moving anywhere. Return immediately to avoid trying to
-        # give the snap a new order and unnecessary extra linking actions.
-        else:
+        if not _is_move(srcIdx,lowerIdx,upperIdx):
             return False
-
-        # Finally give the moved object its desired destination. Then
-        # make the TopologyWidget relink all the objects again.
-        snaps[srcIdx].order = lastIdx
+        with self._topology.writing():
+            block = self._topology.blocks[blockIdx]
+            index = block._emitter_index if container == "emitter" else block._collector_index
+            order = free_key(index,lowerIdx,upperIdx,minimum=0)
+            if order is None:
+                remap = compact(self._topology,STRIDE,blocks=False,bands=False).snaps
+                def remapped(order):
+                    if order is None:
+                        return None
+                    snapkey = gen_snapkey(blockIdx,container,order)
+                    return parse_snapkey(remap.get(snapkey,snapkey))[2]
+                srcIdx,lowerIdx,upperIdx = [remapped(o) for o in [srcIdx,lowerIdx,upperIdx]]
+                order = free_key(index,lowerIdx,upperIdx,minimum=0)
+            log.debug("%s -> %s"%(str(srcIdx),str(order)))
+            index[srcIdx].order = order
         self._update_view()
         return True
 
@@ -221,17 +164,19 @@ class BaseAdapter(Adapter):
 #         print "target rank value is %d" % target_rank
         # Strip rank information so we just have altitudes ordered by rank
         sibling_alts = [x[0] for x in sibling_alts]
-        last_rank = src_band.rank
-        src_band.rank = None
-        for idx in range(1,len(sibling_alts)):
-            band = bands[sibling_alts[idx]]
-            next_rank = band.rank
-            band.rank = last_rank
-            last_rank = next_rank
-        src_band.rank = target_rank
+        with self._topology.batch():
+            last_rank = src_band.rank
+            src_band.rank = None
+            for idx in range(1,len(sibling_alts)):
+                band = bands[sibling_alts[idx]]
+                next_rank = band.rank
+                band.rank = last_rank
+                last_rank = next_rank
+            src_band.rank = target_rank
 
         self._update_view()
 
+    @reads_topology
     def _update_view(self):
         """ updates the view - compute each items neigbors and then calls linking. """
 
@@ -0,0 +1,471 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Binary topology format.
+
+Loading a topology from xml spends most of its time parsing text. The binary
+format instead holds the topology as tables of integers, which are unpacked
+a whole column at a time and fed to a TopologyBuilder.
+
+A file starts with the 8 byte magic string and a format version, followed
+by sections. Each section starts with a 4 byte tag and the length of the rest
+of the section, so that readers can skip sections they do not know. The
+sections hold arrays, each of which is its length followed by its values as
+little-endian 64 bit integers.
+
+    STRS    offsets of each string in the blob (n+1), blob of utf-8 bytes
+    VERT    block index, name
+    EDGE    positive altitude, positive rank, negative altitude, negative
+            rank, name
+    SRCS    sources of each vertex as offsets into the rest (vertices+1),
+            edge, snap order, offsets into routing keys (sources+1),
+            routing keys
+    SNKS    sinks, in the same way as SRCS
+
+Values which are not set are stored as UNSET. Names and routing keys are
+stored once each in the string table, and referred to by their position in
+it. Vertices and edges are referred to by their position in their tables.
+Vertices are stored in block index order, followed by the vertices whose
+block has no index.
+
+Names and routing keys are loaded into the name and routingKeys attributes of
+the objects, which are NamedVertex, NamedEdge, RoutedSource and RoutedSink
+unless other subclasses (such as those of a RosSystemGraph) are given.
+
+Since every value sits at a known offset, a file can also be opened with
+MappedTopology, which maps it into memory and only creates the objects that
+are asked for, so that counts, extents and a window of blocks are available
+without reading the rest of the file.
+"""
+
+from topology import *
+from builder import TopologyBuilder
+import mmap
+import struct
+
+MAGIC = "DIARCBIN"
+VERSION = 1
+# Stored in place of values that are not set
+UNSET = -2**63
+
+HEADER = struct.Struct("<8sI")
+SECTION = struct.Struct("<4sQ")
+COUNT = struct.Struct("<Q")
+VALUE = struct.Struct("<q")
+
+
+class NamedVertex(Vertex):
+    """ A vertex with the name it was stored with """
+    __slots__ = ('name',)
+
+class NamedEdge(Edge):
+    """ An edge with the name it was stored with """
+    __slots__ = ('name',)
+
+class RoutedSource(Source):
+    """ A source with the routing keys it was stored with """
+    __slots__ = ('routingKeys',)
+
+class RoutedSink(Sink):
+    """ A sink with the routing keys it was stored with """
+    __slots__ = ('routingKeys',)
+
+
+def _pack(values):
+    """ returns a length-prefixed array of 64 bit integers """
+    values = [UNSET if value is None else value for value in values]
+    return COUNT.pack(len(values)) + struct.pack("<%dq"%len(values),*values)
+
+def _pack_blob(data):
+    return COUNT.pack(len(data)) + data
+
+class _StringTable(object):
+    """ Interns strings, giving each distinct string a position """
+    def __init__(self):
+        self._ids = dict()
+        self._strings = list()
+
+    def intern(self,string):
+        if string is None:
+            return None
+        if string not in self._ids:
+            self._ids[string] = len(self._strings)
+            self._strings.append(string)
+        return self._ids[string]
+
+    def pack(self):
+        encoded = [unicode(string).encode("utf-8") for string in self._strings]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1]+len(data))
+        return [_pack(offsets),_pack_blob("".join(encoded))]
+
+def serialize(topology):
+    """ returns the topology in the binary format """
+    from StringIO import StringIO
+    out = StringIO()
+    serializeStream(topology,out)
+    return out.getvalue()
+
+def serializeFile(topology,filename):
+    with open(filename,"wb") as out:
+        serializeStream(topology,out)
+
+def serializeStream(topology,out):
+    """ Writes the topology to a file object in the binary format """
+    strings = _StringTable()
+    # Vertices are written in index order, followed by those without an index
+    vertices = [block.vertex for block in topology._block_index.values()]
+    vertices += [vertex for vertex in topology.vertices if vertex.block.index is None]
+    edges = topology.edges
+    edgeIds = dict([(edge,eid) for eid,edge in enumerate(edges)])
+
+    sections = list()
+    sections.append(("VERT",[_pack([v.block.index for v in vertices]),
+                             _pack([strings.intern(getattr(v,"name",None)) for v in vertices])]))
+    sections.append(("EDGE",[_pack([e.posBand.altitude for e in edges]),
+                             _pack([e.posBand.rank for e in edges]),
+                             _pack([e.negBand.altitude for e in edges]),
+                             _pack([e.negBand.rank for e in edges]),
+                             _pack([strings.intern(getattr(e,"name",None)) for e in edges])]))
+    for tag,connectionsOf in [("SRCS",lambda v: v.sources),("SNKS",lambda v: v.sinks)]:
+        offsets = [0]
+        connections = list()
+        for v in vertices:
+            connections.extend(connectionsOf(v))
+            offsets.append(len(connections))
+        keyOffsets = [0]
+        keys = list()
+        for c in connections:
+            keys.extend([strings.intern(key) for key in getattr(c,"routingKeys",None) or []])
+            keyOffsets.append(len(keys))
+        sections.append((tag,[_pack(offsets),
+                              _pack([edgeIds[c.edge] for c in connections]),
+                              _pack([c.snap.order for c in connections]),
+                              _pack(keyOffsets),
+                              _pack(keys)]))
+    # The string table is only complete once everything else has been packed
+    sections.insert(0,("STRS",strings.pack()))
+
+    out.write(HEADER.pack(MAGIC,VERSION))
+    for tag,arrays in sections:
+        out.write(SECTION.pack(tag,sum([len(array) for array in arrays])))
+        for array in arrays:
+            out.write(array)
+
+
+def _sections(buf):
+    """ Checks the header of a buffer in the binary format, and returns the
+    (offset, length) of each section in it by tag.
+    """
+    if len(buf) < HEADER.size:
+        raise Exception("Not a binary topology")
+    magic,version = HEADER.unpack_from(buf,0)
+    if magic != MAGIC:
+        raise Exception("Not a binary topology")
+    if version != VERSION:
+        raise Exception("Unsupported binary topology version %d"%version)
+    sections = dict()
+    offset = HEADER.size
+    while offset < len(buf):
+        tag,length = SECTION.unpack_from(buf,offset)
+        offset += SECTION.size
+        sections[tag] = (offset,length)
+        offset += length
+    for tag in ["STRS","VERT","EDGE","SRCS","SNKS"]:
+        if tag not in sections:
+            raise Exception("Binary topology is missing its %s section"%tag)
+    return sections
+
+def _arrays(buf,offset,count):
+    """ returns the (offset of the values, length) of count consecutive
+    arrays starting at offset
+    """
+    arrays = list()
+    for i in range(count):
+        length, = COUNT.unpack_from(buf,offset)
+        offset += COUNT.size
+        arrays.append((offset,length))
+        offset += length*8
+    return arrays
+
+def _unpack(buf,array,start=0,stop=None):
+    """ returns the values of an array, or of the range start:stop of it """
+    offset,length = array
+    stop = length if stop is None else stop
+    values = struct.unpack_from("<%dq"%(stop-start),buf,offset+start*8)
+    return [None if value == UNSET else value for value in values]
+
+
+class Tables(object):
+    """ The tables of a topology in the binary format, unpacked into lists """
+    def __init__(self,buf):
+        sections = _sections(buf)
+        offset,length = sections["STRS"][0],sections["STRS"][1]
+        offsets, = _arrays(buf,offset,1)
+        offsets = _unpack(buf,offsets)
+        blob = offset+COUNT.size+len(offsets)*8+COUNT.size
+        blob = buf[blob:blob+offsets[-1]]
+        self.strings = [blob[start:stop].decode("utf-8") for start,stop in zip(offsets[:-1],offsets[1:])]
+
+        def string(sid):
+            return self.strings[sid] if sid is not None else None
+        index,names = _arrays(buf,sections["VERT"][0],2)
+        self.vertex_index = _unpack(buf,index)
+        self.vertex_names = [string(sid) for sid in _unpack(buf,names)]
+        arrays = _arrays(buf,sections["EDGE"][0],5)
+        self.edge_bands = zip(*[_unpack(buf,array) for array in arrays[:4]])
+        self.edge_names = [string(sid) for sid in _unpack(buf,arrays[4])]
+        for tag,name in [("SRCS","sources"),("SNKS","sinks")]:
+            offsets,edges,orders,keyOffsets,keys = [_unpack(buf,array) for array in _arrays(buf,sections[tag][0],5)]
+            connections = list()
+            for v,(start,stop) in enumerate(zip(offsets[:-1],offsets[1:])):
+                for c in range(start,stop):
+                    connections.append((v,edges[c],orders[c]))
+            setattr(self,name,connections)
+            setattr(self,name[:-1]+"_keys",[[string(key) for key in keys[start:stop]]
+                                              for start,stop in zip(keyOffsets[:-1],keyOffsets[1:])])
+
+    def builder(self,vertex=NamedVertex,edge=NamedEdge,source=RoutedSource,sink=RoutedSink):
+        """ returns a TopologyBuilder holding the tables, which creates objects
+        of the given classes. Names and routing keys are only given to classes
+        that have a name or routingKeys attribute. Connections without routing
+        keys are given None.
+        """
+        builder = TopologyBuilder(vertex,edge,source,sink)
+        named = hasattr(vertex,"name")
+        for index,name in zip(self.vertex_index,self.vertex_names):
+            if named:
+                builder.add_vertex(index,name=name)
+            else:
+                builder.add_vertex(index)
+        named = hasattr(edge,"name")
+        for (posAltitude,posRank,negAltitude,negRank),name in zip(self.edge_bands,self.edge_names):
+            if named:
+                builder.add_edge(posAltitude,posRank,negAltitude,negRank,name=name)
+            else:
+                builder.add_edge(posAltitude,posRank,negAltitude,negRank)
+        for cls,add,connections,keys in [(source,builder.add_source,self.sources,self.source_keys),
+                                         (sink,builder.add_sink,self.sinks,self.sink_keys)]:
+            routed = hasattr(cls,"routingKeys")
+            for (v,e,order),routingKeys in zip(connections,keys):
+                if routed:
+                    add(v,e,order,routingKeys=routingKeys or None)
+                else:
+                    add(v,e,order)
+        return builder
+
+def parseFile(filename,topology=None,**classes):
+    with open(filename,"rb") as f:
+        return parseStream(f,topology,**classes)
+
+def parseString(data,topology=None,**classes):
+    """ Loads a topology from a string in the binary format. If topology is
+    given, it must be empty, and is populated instead of creating a new
+    Topology. The vertex, edge, source and sink classes to create may be given
+    as keywords, see Tables.builder()
+    """
+    return Tables(data).builder(**classes).build(topology)
+
+def parseStream(source,topology=None,**classes):
+    """ Loads a topology from a file object in the binary format """
+    return parseString(source.read(),topology,**classes)
+
+
+class MappedTopology(object):
+    """ A file in the binary format, mapped into memory. Opening it only reads
+    the header and the lengths of the tables. Vertices, edges and connections
+    are created in the topology attribute the first time they are asked for,
+    along with the vertices and edges they connect.
+
+        mapped = MappedTopology("topology.bin")
+        blocks = mapped.blocks(100,200)
+
+    Vertices and edges are referred to by their position in the file. The
+    topology only holds the objects created so far, so a band only stretches
+    across the connections of its edge which have been created.
+    """
+    def __init__(self,filename,topology=None):
+        self._file = open(filename,"rb")
+        self._map = None
+        try:
+            self._open(topology)
+        except:
+            # Nothing else holds on to the file or the map if opening fails
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            raise
+
+    def _open(self,topology):
+        """ Maps the file and reads its header and the lengths of its tables """
+        self._map = mmap.mmap(self._file.fileno(),0,access=mmap.ACCESS_READ)
+        sections = _sections(self._map)
+        self._string_offsets, = _arrays(self._map,sections["STRS"][0],1)
+        self._blob = self._string_offsets[0]+self._string_offsets[1]*8+COUNT.size
+        self._vertex_index,self._vertex_names = _arrays(self._map,sections["VERT"][0],2)
+        self._edge_columns = _arrays(self._map,sections["EDGE"][0],5)
+        self._sources = _arrays(self._map,sections["SRCS"][0],5)
+        self._sinks = _arrays(self._map,sections["SNKS"][0],5)
+        self._altitude_extent = None
+        # Vertices with a block index come first, so the indexed ones can be
+        # found by bisection
+        lo,hi = 0,self.vertex_count
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._value(self._vertex_index,mid) is None:
+                hi = mid
+            else:
+                lo = mid+1
+        self._indexed = lo
+        self.topology = topology if topology is not None else Topology()
+        self._vertices = dict()
+        self._edges = dict()
+        self._connected = set()
+
+    def _value(self,array,i):
+        value, = VALUE.unpack_from(self._map,array[0]+i*8)
+        return None if value == UNSET else value
+
+    def close(self):
+        """ Unmaps the file. Objects already created are kept. """
+        self._map.close()
+        self._file.close()
+
+    @property
+    def vertex_count(self):
+        return self._vertex_index[1]
+
+    @property
+    def edge_count(self):
+        return self._edge_columns[0][1]
+
+    @property
+    def source_count(self):
+        return self._sources[1][1]
+
+    @property
+    def sink_count(self):
+        return self._sinks[1][1]
+
+    def block_extent(self):
+        """ returns the lowest and highest block index, or None if no block
+        has an index
+        """
+        if self._indexed == 0:
+            return None
+        return self._value(self._vertex_index,0),self._value(self._vertex_index,self._indexed-1)
+
+    def altitude_extent(self):
+        """ returns the lowest and highest band altitude, or None if no band
+        has an altitude. The altitudes are read the first time this is called.
+        """
+        if self._altitude_extent is None:
+            altitudes = [altitude for array in [self._edge_columns[0],self._edge_columns[2]]
+                         for altitude in _unpack(self._map,array) if altitude is not None]
+            self._altitude_extent = (min(altitudes),max(altitudes)) if altitudes else ()
+        return self._altitude_extent or None
+
+    def block_range(self,lower,upper):
+        """ returns the range of vertices whose block index is at least lower
+        and less than upper
+        """
+        def bisect(index):
+            lo,hi = 0,self._indexed
+            while lo < hi:
+                mid = (lo+hi)//2
+                if self._value(self._vertex_index,mid) < index:
+                    lo = mid+1
+                else:
+                    hi = mid
+            return lo
+        return range(bisect(lower),bisect(upper))
+
+    def string(self,sid):
+        """ returns the string at a position in the string table """
+        if sid is None:
+            return None
+        start = self._value(self._string_offsets,sid)
+        stop = self._value(self._string_offsets,sid+1)
+        return self._map[self._blob+start:self._blob+stop].decode("utf-8")
+
+    def vertex_name(self,v):
+        return self.string(self._value(self._vertex_names,v))
+
+    def edge_name(self,e):
+        return self.string(self._value(self._edge_columns[4],e))
+
+    def vertex(self,v):
+        """ returns the vertex at position v, creating it if needed """
+        if v not in self._vertices:
+            if not 0 <= v < self.vertex_count:
+                raise IndexError("Vertex %d is not in the file"%v)
+            vertex = NamedVertex(self.topology)
+            vertex.name = self.vertex_name(v)
+            vertex.block.index = self._value(self._vertex_index,v)
+            self._vertices[v] = vertex
+        return self._vertices[v]
+
+    def edge(self,e):
+        """ returns the edge at position e, creating it if needed """
+        if e not in self._edges:
+            if not 0 <= e < self.edge_count:
+                raise IndexError("Edge %d is not in the file"%e)
+            edge = NamedEdge(self.topology)
+            edge.name = self.edge_name(e)
+            posAltitude,posRank,negAltitude,negRank = [self._value(array,e) for array in self._edge_columns[:4]]
+            with self.topology.batch():
+                edge.posBand.altitude = posAltitude
+                edge.posBand.rank = posRank
+                edge.negBand.altitude = negAltitude
+                edge.negBand.rank = negRank
+            self._edges[e] = edge
+        return self._edges[e]
+
+    def connections(self,v):
+        """ returns the sources and sinks of the vertex at position v, creating
+        them and the edges they connect to if needed
+        """
+        vertex = self.vertex(v)
+        if v not in self._connected:
+            with self.topology.batch():
+                for cls,arrays in [(RoutedSource,self._sources),(RoutedSink,self._sinks)]:
+                    offsets,edges,orders,keyOffsets,keys = arrays
+                    for c in range(self._value(offsets,v),self._value(offsets,v+1)):
+                        connection = cls(self.topology,vertex,self.edge(self._value(edges,c)))
+                        connection.snap.order = self._value(orders,c)
+                        connection.routingKeys = [self.string(self._value(keys,k)) for k in
+                                                  range(self._value(keyOffsets,c),self._value(keyOffsets,c+1))] or None
+            self._connected.add(v)
+        return vertex.sources+vertex.sinks
+
+    def blocks(self,lower,upper):
+        """ returns the blocks whose index is at least lower and less than
+        upper, in index order, creating their vertices and connections
+        """
+        blocks = list()
+        with self.topology.batch():
+            for v in self.block_range(lower,upper):
+                self.connections(v)
+                blocks.append(self._vertices[v].block)
+        return blocks
+
+    def materialize(self):
+        """ Creates every vertex, edge and connection, and returns the topology """
+        with self.topology.batch():
+            for v in range(self.vertex_count):
+                self.connections(v)
+            for e in range(self.edge_count):
+                self.edge(e)
+        return self.topology
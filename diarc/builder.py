@@ -0,0 +1,312 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Bulk loading of topologies.
+
+Building a large topology one object at a time runs the checks of every
+constructor and setter once per object. A TopologyBuilder instead collects
+complete tables of vertices, edges and connections, checks all of the
+uniqueness constraints in a single hashed pass, and then creates the objects
+and fills in the topology's indexes directly, without checking them again.
+
+    b = TopologyBuilder()
+    v0 = b.add_vertex(index=0)
+    v1 = b.add_vertex(index=1)
+    e0 = b.add_edge(posAltitude=1, posRank=0)
+    b.add_source(v0, e0, order=0)
+    b.add_sink(v1, e0, order=0)
+    t = b.build()
+
+Vertices and edges are referred to by the ids returned when they are added.
+
+Subclasses of Vertex, Edge, Source and Sink may be given to the builder.
+Their constructors are not called, so any extra attributes are passed to
+add_vertex(), add_edge(), etc. as keywords, and the slots they declare which
+are not given are set to None. Subclasses which create objects of their own
+in their constructors (such as a custom Block or Band) cannot be built.
+"""
+
+from topology import *
+import itertools
+
+
+class TopologyBuilder(object):
+    def __init__(self,vertex=Vertex,edge=Edge,source=Source,sink=Sink):
+        # Classes of the objects to create
+        for cls,base in [(vertex,Vertex),(edge,Edge),(source,Source),(sink,Sink)]:
+            if not (isinstance(cls,type) and issubclass(cls,base)):
+                raise Exception("%r is not a subclass of %s"%(cls,base.__name__))
+        self._classes = (vertex,edge,source,sink)
+        # Vertex table - the block index of each vertex
+        self._vertices = list()
+        # Edge table - (posAltitude, posRank, negAltitude, negRank) of each edge
+        self._edges = list()
+        # Connection tables - (vertex id, edge id, order) of each connection
+        self._sources = list()
+        self._sinks = list()
+        # (vertex id, edge id) pairs which already have a source or sink
+        self._source_pairs = set()
+        self._sink_pairs = set()
+        # Extra attributes of the objects that were given any, by position in
+        # their table
+        self._vertex_attributes = dict()
+        self._edge_attributes = dict()
+        self._source_attributes = dict()
+        self._sink_attributes = dict()
+
+    def add_vertex(self,index=None,**attributes):
+        """ Adds a vertex whose block has the given index, returning its id """
+        if attributes:
+            self._vertex_attributes[len(self._vertices)] = attributes
+        self._vertices.append(index)
+        return len(self._vertices)-1
+
+    def add_edge(self,posAltitude=None,posRank=None,negAltitude=None,negRank=None,**attributes):
+        """ Adds an edge whose bands have the given altitudes and ranks,
+        returning its id.
+        """
+        if attributes:
+            self._edge_attributes[len(self._edges)] = attributes
+        self._edges.append((posAltitude,posRank,negAltitude,negRank))
+        return len(self._edges)-1
+
+    def add_source(self,vertex,edge,order=None,**attributes):
+        """ Adds a source from vertex id to edge id, whose snap has the given order """
+        if attributes:
+            self._source_attributes[len(self._sources)] = attributes
+        self._sources.append((vertex,edge,order))
+        self._source_pairs.add((vertex,edge))
+
+    def add_sink(self,vertex,edge,order=None,**attributes):
+        """ Adds a sink from edge id to vertex id, whose snap has the given order """
+        if attributes:
+            self._sink_attributes[len(self._sinks)] = attributes
+        self._sinks.append((vertex,edge,order))
+        self._sink_pairs.add((vertex,edge))
+
+    def has_source(self,vertex,edge):
+        """ returns true if a source from vertex id to edge id has been added """
+        return (vertex,edge) in self._source_pairs
+
+    def has_sink(self,vertex,edge):
+        """ returns true if a sink from edge id to vertex id has been added """
+        return (vertex,edge) in self._sink_pairs
+
+    def validate(self):
+        """ Checks the tables against every constraint that the topology's
+        setters would enforce, raising an exception on the first violation.
+        """
+        def unique(values,message):
+            seen = set()
+            for value in values:
+                if value is None:
+                    continue
+                if value in seen:
+                    raise Exception(message%(value,))
+                seen.add(value)
+
+        unique(self._vertices,"Block with index %r already exists!")
+        for posAltitude,posRank,negAltitude,negRank in self._edges:
+            if posAltitude is not None and posAltitude <= 0:
+                raise Exception("Altitude must be positive")
+            if negAltitude is not None and negAltitude >= 0:
+                raise Exception("Altitude must be negative")
+            for rank in [posRank,negRank]:
+                if rank is not None:
+                    typecheck(rank,int,"rank")
+                    if rank < 0:
+                        raise Exception("Rank must be >= 0, received %d"%rank)
+        unique([e[0] for e in self._edges],"Band with altitude %d already exists!")
+        unique([e[2] for e in self._edges],"Band with altitude %d already exists!")
+        unique([e[1] for e in self._edges],"Positive Band with rank %d already exists!")
+        unique([e[3] for e in self._edges],"Negative Band with rank %d already exists!")
+
+        for name,connections,pairs in [("Source",self._sources,self._source_pairs),
+                                       ("Sink",self._sinks,self._sink_pairs)]:
+            if len(pairs) != len(connections):
+                raise Exception("Duplicate %s!"%name)
+            for vertex,edge,order in connections:
+                if not (0 <= vertex < len(self._vertices)):
+                    raise Exception("%s refers to unknown vertex %r"%(name,vertex))
+                if not (0 <= edge < len(self._edges)):
+                    raise Exception("%s refers to unknown edge %r"%(name,edge))
+            unique([(vertex,order) if order is not None else None for vertex,edge,order in connections],
+                   "Order value %r already exists!")
+
+    def build(self,topology=None):
+        """ Validates the tables and returns a topology containing their
+        objects. If topology is given, it must be empty, and is populated
+        instead of creating a new Topology.
+        """
+        self.validate()
+        t = topology if topology is not None else Topology()
+        if len(t.vertices) > 0 or len(t.edges) > 0:
+            raise Exception("Can only build into an empty topology")
+        if t._batch is not None:
+            raise Exception("Cannot build into a topology while a batch is open")
+        self._populate(t)
+        return t
+
+    def _populate(self,t):
+        """ Creates the objects described by the tables in topology t """
+        # Everything has been checked, so the objects are created without
+        # calling their constructors, and the topology's indexes are filled in
+        # directly, in the same state the constructors and setters would have
+        # left them in.
+        vertexClass,edgeClass,sourceClass,sinkClass = self._classes
+        report = len(t._listeners) > 0
+
+        vertices = list()
+        for vid,index in enumerate(self._vertices):
+            vertex = _new(vertexClass,Vertex,self._vertex_attributes.get(vid))
+            vertex._topology = t
+            block = Block.__new__(Block)
+            block._vertex = vertex
+            block._topology = t
+            block._index = index
+            block._emitters = None
+            block._collectors = None
+            vertex._block = block
+            vertices.append(vertex)
+        t._vertices.extend(vertices)
+        _fill(t._block_index,[(index,vertex._block) for index,vertex in zip(self._vertices,vertices)])
+
+        edges = list()
+        for eid,(posAltitude,posRank,negAltitude,negRank) in enumerate(self._edges):
+            edge = _new(edgeClass,Edge,self._edge_attributes.get(eid))
+            edge._topology = t
+            edge._source_indices = ()
+            edge._sink_indices = ()
+            edge._pBand = _band(edge,True,posAltitude,posRank)
+            edge._nBand = _band(edge,False,negAltitude,negRank)
+            edges.append(edge)
+        t._edges.extend(edges)
+        _fill(t._pos_band_index,[(e._pBand._altitude,e._pBand) for e in edges])
+        _fill(t._neg_band_index,[(e._nBand._altitude,e._nBand) for e in edges])
+        _fill(t._pos_band_ranks,[(e._pBand._rank,e._pBand) for e in edges])
+        _fill(t._neg_band_ranks,[(e._nBand._rank,e._nBand) for e in edges])
+
+        # The adjacency lists are collected first, and only then turned into
+        # dictionaries where they are longer than ADJACENCY_LIST_SIZE, as
+        # Topology._attach() would have done one connection at a time
+        connections = list()
+        for cls,rows,attributes,pairs,vertexIndex,edgeIndex,emitter in \
+                [(sourceClass,self._sources,self._source_attributes,t._source_pairs,
+                  t._vertex_sources,t._edge_sources,True),
+                 (sinkClass,self._sinks,self._sink_attributes,t._sink_pairs,
+                  t._vertex_sinks,t._edge_sinks,False)]:
+            # (order, snap) pairs of each block with ordered snaps
+            orders = dict()
+            for cid,(vid,eid,order) in enumerate(rows):
+                vertex,edge = vertices[vid],edges[eid]
+                connection = _new(cls,Source if emitter else Sink,attributes.get(cid))
+                connection._topology = t
+                connection._vertex = vertex
+                connection._edge = edge
+                snap = Snap.__new__(Snap)
+                snap._connection = connection
+                snap._order = order
+                connection._snap = snap
+                pairs[(vertex,edge)] = connection
+                vertexIndex.setdefault(vertex,list()).append(connection)
+                edgeIndex.setdefault(edge,list()).append(connection)
+                index = vertex._block._index
+                if index is not None:
+                    if emitter:
+                        if not edge._source_indices:
+                            edge._source_indices = list()
+                        edge._source_indices.append(index)
+                    else:
+                        if not edge._sink_indices:
+                            edge._sink_indices = list()
+                        edge._sink_indices.append(index)
+                if order is not None:
+                    orders.setdefault(vertex._block,list()).append((order,snap))
+                connections.append(connection)
+            for adjacency in [vertexIndex,edgeIndex]:
+                for obj,adjacent in adjacency.items():
+                    if len(adjacent) > ADJACENCY_LIST_SIZE:
+                        adjacency[obj] = dict(itertools.izip(adjacent,t._attached))
+            for block,items in orders.items():
+                snaps = SortedIndex()
+                _fill(snaps,items)
+                if emitter:
+                    block._emitters = snaps
+                else:
+                    block._collectors = snaps
+        set.update(t._sources,connections[:len(self._sources)])
+        set.update(t._sinks,connections[len(self._sources):])
+
+        for edge in edges:
+            for indices in [edge._source_indices,edge._sink_indices]:
+                if indices:
+                    indices.sort()
+        for index in [t._pos_band_index,t._neg_band_index]:
+            for band in index.values():
+                band._refresh()
+
+        # Report the same changes the constructors and setters would have
+        if report:
+            for vertex in vertices:
+                t._changed("vertex_added",vertex)
+                if vertex._block._index is not None:
+                    t._changed("index",vertex._block,None,vertex._block._index)
+            for edge in edges:
+                t._changed("edge_added",edge)
+                for band in [edge._pBand,edge._nBand]:
+                    if band._rank is not None:
+                        t._changed("rank",band,None,band._rank)
+                    if band._altitude is not None:
+                        t._changed("altitude",band,None,band._altitude)
+            for connection in connections:
+                t._changed("connection_added",connection,None,(connection._vertex,connection._edge))
+                if connection._snap._order is not None:
+                    t._changed("order",connection._snap,None,connection._snap._order)
+        else:
+            t._version += 1
+
+
+def _new(cls,base,attributes):
+    """ returns an instance of cls without calling its constructor. The slots
+    that subclasses of base declare are set from attributes, or to None.
+    """
+    obj = cls.__new__(cls)
+    for klass in cls.__mro__:
+        if klass is base:
+            break
+        for name in getattr(klass,"__slots__",()):
+            setattr(obj,name,None)
+    if attributes:
+        for name,value in attributes.items():
+            setattr(obj,name,value)
+    return obj
+
+def _band(edge,isPositive,altitude,rank):
+    band = Band.__new__(Band)
+    band._edge = edge
+    band._topology = edge._topology
+    band._isPositive = isPositive
+    band._altitude = altitude
+    band._rank = rank
+    band._used = False
+    return band
+
+def _fill(index,items):
+    """ Fills an empty SortedIndex with (key, object) pairs whose keys are
+    known to be unique, skipping those whose key is None
+    """
+    items = [(key,obj) for key,obj in items if key is not None]
+    items.sort(key=lambda item: item[0])
+    index._keys = [key for key,obj in items]
+    index._objs = dict(items)
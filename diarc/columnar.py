@@ -0,0 +1,685 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Columnar topology store for analysing very large graphs.
+
+A ColumnarTopology holds the same information as a Topology, but stores it as
+NumPy arrays instead of as one Python object per vertex, edge and connection.
+
+    Vertices:       block_index[vertex_id]
+    Edges:          pos_altitude[edge_id], neg_altitude[edge_id],
+                    pos_rank[edge_id], neg_rank[edge_id]
+    Connections:    conn_vertex[conn_id], conn_edge[conn_id],
+                    conn_kind[conn_id] (SOURCE or SINK), conn_order[conn_id]
+
+Values which have not been assigned (None in a Topology) are stored as UNSET.
+
+The graph structure (which vertices, edges and connections exist) is fixed when
+the store is created, but the visual parameters (index, altitude, rank and order)
+may be changed. Neighbor, extent and uniqueness queries are vectorized over the
+arrays. Thin proxy objects (VertexProxy, BlockProxy, ...) provide the read side
+of the Vertex/Edge/Block/Band/Snap API, along with the index, altitude, rank
+and order setters, so code written against a Topology (such as an adapter's
+_update_view) can be pointed at a ColumnarTopology.
+
+Edge extents, used bands and block neighbors are computed for the whole store
+at once, and cached until the store's version changes. The proxy setters
+change the version; code which writes to the arrays directly must call
+changed() afterwards.
+
+NumPy is only needed by this module, and is not required by the rest of diarc.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from snapkey import gen_snapkey
+from util import ReadWriteLock, typecheck
+from collections import OrderedDict
+
+SOURCE = 0
+SINK = 1
+UNSET = -2**63
+
+
+def _value(val):
+    """ Converts an array value into the corresponding topology value """
+    return None if val == UNSET else int(val)
+
+def _store(val):
+    """ Converts a topology value into the corresponding array value """
+    return UNSET if val is None else val
+
+
+class ColumnarTopology(object):
+    """ A topology stored as NumPy arrays. See the module documentation. """
+    def __init__(self, block_index, pos_altitude, neg_altitude, pos_rank, neg_rank,
+                 conn_vertex, conn_edge, conn_kind, conn_order):
+        if numpy is None:
+            raise Exception("ColumnarTopology requires numpy")
+        self.block_index = numpy.array(block_index, dtype=numpy.int64)
+        self.pos_altitude = numpy.array(pos_altitude, dtype=numpy.int64)
+        self.neg_altitude = numpy.array(neg_altitude, dtype=numpy.int64)
+        self.pos_rank = numpy.array(pos_rank, dtype=numpy.int64)
+        self.neg_rank = numpy.array(neg_rank, dtype=numpy.int64)
+        self.conn_vertex = numpy.array(conn_vertex, dtype=numpy.int64)
+        self.conn_edge = numpy.array(conn_edge, dtype=numpy.int64)
+        self.conn_kind = numpy.array(conn_kind, dtype=numpy.int8)
+        self.conn_order = numpy.array(conn_order, dtype=numpy.int64)
+        if not (len(self.pos_altitude) == len(self.neg_altitude) == len(self.pos_rank) == len(self.neg_rank)):
+            raise Exception("Edge columns must all be the same length")
+        if not (len(self.conn_vertex) == len(self.conn_edge) == len(self.conn_kind) == len(self.conn_order)):
+            raise Exception("Connection columns must all be the same length")
+
+        # The structure never changes, so connections can be grouped by vertex
+        # and by edge once. Stable sorts keep connections in creation order.
+        self._by_vertex = numpy.argsort(self.conn_vertex, kind='mergesort')
+        self._vertex_offsets = numpy.searchsorted(self.conn_vertex[self._by_vertex],
+                                                  numpy.arange(len(self.block_index)+1))
+        self._by_edge = numpy.argsort(self.conn_edge, kind='mergesort')
+        self._edge_offsets = numpy.searchsorted(self.conn_edge[self._by_edge],
+                                                numpy.arange(len(self.pos_altitude)+1))
+        self._hide_disconnected_snaps = False
+        # Incremented every time a visual parameter is changed. Whole-store
+        # queries are cached until the version changes.
+        self._version = 0
+        self._cache = dict()
+        self._lock = ReadWriteLock()
+        self.validate()
+
+    @classmethod
+    def from_topology(cls, topology):
+        """ Creates a columnar copy of a Topology """
+        vertex_ids = dict([(v, i) for i, v in enumerate(topology.vertices)])
+        edge_ids = dict([(e, i) for i, e in enumerate(topology.edges)])
+        connections = [(c, SOURCE) for e in topology.edges for c in e.sources]
+        connections += [(c, SINK) for e in topology.edges for c in e.sinks]
+        return cls([_store(v.block.index) for v in topology.vertices],
+                   [_store(e.posBand.altitude) for e in topology.edges],
+                   [_store(e.negBand.altitude) for e in topology.edges],
+                   [_store(e.posBand.rank) for e in topology.edges],
+                   [_store(e.negBand.rank) for e in topology.edges],
+                   [vertex_ids[c.vertex] for c, kind in connections],
+                   [edge_ids[c.edge] for c, kind in connections],
+                   [kind for c, kind in connections],
+                   [_store(c.snap.order) for c, kind in connections])
+
+    def to_topology(self):
+        """ Creates a Topology with the same contents as this store """
+        from topology import Topology, Vertex, Edge, Source, Sink
+        t = Topology()
+        vertices = [Vertex(t) for i in range(len(self.block_index))]
+        edges = [Edge(t) for i in range(len(self.pos_altitude))]
+        for v, index in zip(vertices, self.block_index):
+            v.block.index = _value(index)
+        for i, e in enumerate(edges):
+            e.posBand.altitude = _value(self.pos_altitude[i])
+            e.negBand.altitude = _value(self.neg_altitude[i])
+            e.posBand.rank = _value(self.pos_rank[i])
+            e.negBand.rank = _value(self.neg_rank[i])
+        for i in range(len(self.conn_vertex)):
+            kind = Source if self.conn_kind[i] == SOURCE else Sink
+            c = kind(t, vertices[self.conn_vertex[i]], edges[self.conn_edge[i]])
+            c.snap.order = _value(self.conn_order[i])
+        return t
+
+    def validate(self):
+        """ Checks every uniqueness constraint of the topology at once, raising
+        an exception if any of them are violated.
+        """
+        def duplicated(columns):
+            columns = [numpy.asarray(c) for c in columns]
+            if len(columns[0]) == 0:
+                return False
+            mask = numpy.ones(len(columns[0]), dtype=bool)
+            for c in columns:
+                mask &= (c != UNSET)
+            rows = numpy.rec.fromarrays([c[mask] for c in columns])
+            return len(numpy.unique(rows)) != len(rows)
+        if duplicated([self.block_index]):
+            raise Exception("Duplicate block index!")
+        if numpy.any((self.pos_altitude != UNSET) & (self.pos_altitude <= 0)):
+            raise Exception("Altitude must be positive")
+        if numpy.any((self.neg_altitude != UNSET) & (self.neg_altitude >= 0)):
+            raise Exception("Altitude must be negative")
+        if duplicated([self.pos_altitude]) or duplicated([self.neg_altitude]):
+            raise Exception("Duplicate band altitude!")
+        if numpy.any((self.pos_rank != UNSET) & (self.pos_rank < 0)) or \
+                numpy.any((self.neg_rank != UNSET) & (self.neg_rank < 0)):
+            raise Exception("Rank must be >= 0")
+        if duplicated([self.pos_rank]) or duplicated([self.neg_rank]):
+            raise Exception("Duplicate band rank!")
+        if duplicated([self.conn_vertex, self.conn_edge, self.conn_kind]):
+            raise Exception("Duplicate connection!")
+        if duplicated([self.conn_vertex, self.conn_kind, self.conn_order]):
+            raise Exception("Duplicate snap order!")
+
+    @property
+    def version(self):
+        """ returns a counter that is incremented on every change to the store """
+        return self._version
+
+    def changed(self):
+        """ Marks the store as changed, invalidating cached queries. Only needed
+        after writing to the arrays directly.
+        """
+        self._version += 1
+
+    def _cached(self, name, build):
+        """ Returns the cached result of build(), calling it again if the store
+        has changed since. Cached arrays are made read-only.
+        """
+        version, result = self._cache.get(name, (None, None))
+        if version != self._version:
+            result = build()
+            for array in (result if isinstance(result, tuple) else (result,)):
+                array.setflags(write=False)
+            self._cache[name] = (self._version, result)
+        return result
+
+    def reading(self):
+        """ Returns a context manager holding the store's read lock. See
+        Topology.reading()
+        """
+        return self._lock.reading()
+
+    def writing(self):
+        """ Returns a context manager holding the store's write lock. See
+        Topology.writing()
+        """
+        return self._lock.writing()
+
+    def __get_hide_disconnected_snaps(self):
+        return self._hide_disconnected_snaps
+    def __set_hide_disconnected_snaps(self, state):
+        typecheck(state, bool, "state")
+        self._hide_disconnected_snaps = state
+        self.changed()
+    hide_disconnected_snaps = property(__get_hide_disconnected_snaps, __set_hide_disconnected_snaps)
+
+    # Vectorized queries
+    def vertex_connections(self, vid):
+        """ returns an array of the ids of connections to a vertex """
+        return self._by_vertex[self._vertex_offsets[vid]:self._vertex_offsets[vid+1]]
+
+    def edge_connections(self, eid):
+        """ returns an array of the ids of connections to an edge """
+        return self._by_edge[self._edge_offsets[eid]:self._edge_offsets[eid+1]]
+
+    def block_neighbors(self):
+        """ returns a pair of arrays (left, right) holding the vertex id of the
+        block to the left and right of each vertex, or -1 if there is none.
+        """
+        return self._cached("block_neighbors", self._block_neighbors)
+
+    def _block_neighbors(self):
+        left = numpy.full(len(self.block_index), -1, dtype=numpy.int64)
+        right = numpy.full(len(self.block_index), -1, dtype=numpy.int64)
+        placed = numpy.nonzero(self.block_index != UNSET)[0]
+        placed = placed[numpy.argsort(self.block_index[placed], kind='mergesort')]
+        left[placed[1:]] = placed[:-1]
+        right[placed[:-1]] = placed[1:]
+        return left, right
+
+    def edge_extents(self):
+        """ returns a 4-tuple of arrays (min source index, max source index,
+        min sink index, max sink index) for each edge. Only connections to
+        blocks with an index are considered. Edges without any such source or
+        sink have UNSET extents.
+        """
+        return self._cached("edge_extents", self._edge_extents)
+
+    def _edge_extents(self):
+        num_edges = len(self.pos_altitude)
+        big = numpy.iinfo(numpy.int64).max
+        extents = [numpy.full(num_edges, big, dtype=numpy.int64),
+                   numpy.full(num_edges, UNSET, dtype=numpy.int64),
+                   numpy.full(num_edges, big, dtype=numpy.int64),
+                   numpy.full(num_edges, UNSET, dtype=numpy.int64)]
+        index = self.block_index[self.conn_vertex]
+        for i, kind in enumerate([SOURCE, SINK]):
+            mask = (self.conn_kind == kind) & (index != UNSET)
+            numpy.minimum.at(extents[2*i], self.conn_edge[mask], index[mask])
+            numpy.maximum.at(extents[2*i+1], self.conn_edge[mask], index[mask])
+            extents[2*i][extents[2*i] == big] = UNSET
+        return tuple(extents)
+
+    def bands_used(self):
+        """ returns a pair of boolean arrays (positive, negative) indicating
+        which bands of each edge are being used. See Band.isUsed().
+        """
+        return self._cached("bands_used", self._bands_used)
+
+    def _bands_used(self):
+        min_src, max_src, min_snk, max_snk = self.edge_extents()
+        connected = (min_src != UNSET) & (min_snk != UNSET)
+        pos = connected & (self.pos_altitude != UNSET) & (min_src < max_snk)
+        neg = connected & (self.neg_altitude != UNSET) & (max_src >= min_snk)
+        return pos, neg
+
+    def used_bands(self, positive):
+        """ returns a pair of arrays (altitudes, edge ids) of the used bands on
+        one side of the block ribbon, sorted by altitude
+        """
+        def build():
+            altitudes = self.pos_altitude if positive else self.neg_altitude
+            edges = numpy.nonzero(self.bands_used()[0 if positive else 1])[0]
+            order = numpy.argsort(altitudes[edges], kind='mergesort')
+            return altitudes[edges][order], edges[order]
+        return self._cached("used_bands_pos" if positive else "used_bands_neg", build)
+
+    # Topology API
+    @property
+    def vertices(self):
+        return [VertexProxy(self, i) for i in range(len(self.block_index))]
+
+    @property
+    def edges(self):
+        return [EdgeProxy(self, i) for i in range(len(self.pos_altitude))]
+
+    @property
+    def blocks(self):
+        """ Returns dictionary of all blocks who have a proper index value assigned """
+        placed = numpy.nonzero(self.block_index != UNSET)[0]
+        return dict([(int(self.block_index[i]), BlockProxy(self, i)) for i in placed])
+
+    @property
+    def bands(self):
+        """ Returns dictionary of all bands, by altitude """
+        bands = [(int(self.pos_altitude[i]), BandProxy(self, i, True))
+                 for i in numpy.nonzero(self.pos_altitude != UNSET)[0]]
+        bands += [(int(self.neg_altitude[i]), BandProxy(self, i, False))
+                  for i in numpy.nonzero(self.neg_altitude != UNSET)[0]]
+        return dict(bands)
+
+    @property
+    def snaps(self):
+        """ Returns dictionary of all snaps, by snapkey """
+        snaps = [SnapProxy(self, i) for i in numpy.nonzero(self.conn_order != UNSET)[0]]
+        if self._hide_disconnected_snaps:
+            snaps = [snap for snap in snaps if snap.isLinked()]
+        return dict([(snap.snapkey(), snap) for snap in snaps])
+
+
+class VertexProxy(object):
+    __slots__ = ('_store', '_id')
+    def __init__(self, store, vid):
+        self._store = store
+        self._id = vid
+
+    def __eq__(self, other):
+        return isinstance(other, VertexProxy) and other._store is self._store and other._id == self._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((VertexProxy, self._id))
+
+    def _connections(self, kind):
+        store = self._store
+        conns = store.vertex_connections(self._id)
+        return [ConnectionProxy(store, c) for c in conns[store.conn_kind[conns] == kind]]
+
+    @property
+    def sources(self):
+        return self._connections(SOURCE)
+
+    @property
+    def sinks(self):
+        return self._connections(SINK)
+
+    @property
+    def block(self):
+        return BlockProxy(self._store, self._id)
+
+
+class EdgeProxy(object):
+    __slots__ = ('_store', '_id')
+    def __init__(self, store, eid):
+        self._store = store
+        self._id = eid
+
+    def __eq__(self, other):
+        return isinstance(other, EdgeProxy) and other._store is self._store and other._id == self._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((EdgeProxy, self._id))
+
+    def _connections(self, kind):
+        store = self._store
+        conns = store.edge_connections(self._id)
+        return [ConnectionProxy(store, c) for c in conns[store.conn_kind[conns] == kind]]
+
+    @property
+    def sources(self):
+        return self._connections(SOURCE)
+
+    @property
+    def sinks(self):
+        return self._connections(SINK)
+
+    @property
+    def posBand(self):
+        return BandProxy(self._store, self._id, True)
+
+    @property
+    def negBand(self):
+        return BandProxy(self._store, self._id, False)
+
+
+class ConnectionProxy(object):
+    __slots__ = ('_store', '_id')
+    def __init__(self, store, cid):
+        self._store = store
+        self._id = cid
+
+    def __eq__(self, other):
+        return isinstance(other, ConnectionProxy) and other._store is self._store and other._id == self._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((ConnectionProxy, self._id))
+
+    @property
+    def vertex(self):
+        return VertexProxy(self._store, self._store.conn_vertex[self._id])
+
+    @property
+    def edge(self):
+        return EdgeProxy(self._store, self._store.conn_edge[self._id])
+
+    @property
+    def block(self):
+        return BlockProxy(self._store, self._store.conn_vertex[self._id])
+
+    @property
+    def snap(self):
+        return SnapProxy(self._store, self._id)
+
+
+class BlockProxy(object):
+    __slots__ = ('_store', '_id')
+    def __init__(self, store, vid):
+        self._store = store
+        self._id = vid
+
+    def __eq__(self, other):
+        return isinstance(other, BlockProxy) and other._store is self._store and other._id == self._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((BlockProxy, self._id))
+
+    @property
+    def vertex(self):
+        return VertexProxy(self._store, self._id)
+
+    def _container(self, kind):
+        store = self._store
+        conns = store.vertex_connections(self._id)
+        conns = conns[(store.conn_kind[conns] == kind) & (store.conn_order[conns] != UNSET)]
+        conns = conns[numpy.argsort(store.conn_order[conns], kind='mergesort')]
+        snaps = [(int(store.conn_order[c]), SnapProxy(store, c)) for c in conns]
+        if store.hide_disconnected_snaps:
+            snaps = [(order, snap) for order, snap in snaps if snap.isLinked()]
+        return OrderedDict(snaps)
+
+    @property
+    def emitter(self):
+        return self._container(SOURCE)
+
+    @property
+    def collector(self):
+        return self._container(SINK)
+
+    def _neighbor(self, left):
+        neighbor = self._store.block_neighbors()[0 if left else 1][self._id]
+        return BlockProxy(self._store, neighbor) if neighbor >= 0 else None
+
+    @property
+    def leftBlock(self):
+        return self._neighbor(True)
+
+    @property
+    def rightBlock(self):
+        return self._neighbor(False)
+
+    def __get_index(self):
+        return _value(self._store.block_index[self._id])
+    def __set_index(self, value):
+        store = self._store
+        if value is not None and numpy.any(store.block_index == value) and \
+                store.block_index[self._id] != value:
+            raise Exception("Block with index %r already exists!"%value)
+        store.block_index[self._id] = _store(value)
+        store.changed()
+    index = property(__get_index, __set_index)
+
+
+class BandProxy(object):
+    __slots__ = ('_store', '_id', '_isPositive')
+    def __init__(self, store, eid, isPositive):
+        self._store = store
+        self._id = eid
+        self._isPositive = isPositive
+
+    def __eq__(self, other):
+        return isinstance(other, BandProxy) and other._store is self._store and \
+                other._id == self._id and other._isPositive == self._isPositive
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((BandProxy, self._id, self._isPositive))
+
+    def _altitudes(self):
+        return self._store.pos_altitude if self._isPositive else self._store.neg_altitude
+
+    def _ranks(self):
+        return self._store.pos_rank if self._isPositive else self._store.neg_rank
+
+    @property
+    def edge(self):
+        return EdgeProxy(self._store, self._id)
+
+    @property
+    def isPositive(self):
+        return self._isPositive
+
+    def _reach(self, kind):
+        """ returns the snaps of the given kind that reach this band """
+        store = self._store
+        altitude = self._altitudes()[self._id]
+        if altitude == UNSET:
+            return list()
+        conns = store.edge_connections(self._id)
+        index = store.block_index[store.conn_vertex[conns]]
+        conns, index, kinds = conns[index != UNSET], index[index != UNSET], store.conn_kind[conns][index != UNSET]
+        other = index[kinds != kind]
+        if len(other) == 0:
+            return list()
+        if kind == SOURCE:
+            mask = (index < other.max()) if altitude > 0 else (index >= other.min())
+        else:
+            mask = (index > other.min()) if altitude > 0 else (index <= other.max())
+        return [SnapProxy(store, c) for c in conns[(kinds == kind) & mask]]
+
+    @property
+    def emitters(self):
+        """ returns a list of source snaps that reach this band """
+        return self._reach(SOURCE)
+
+    @property
+    def collectors(self):
+        """ returns list of sink snaps that reach this band """
+        return self._reach(SINK)
+
+    def isUsed(self):
+        pos, neg = self._store.bands_used()
+        return bool((pos if self._isPositive else neg)[self._id])
+
+    def _neighbor(self, above):
+        altitude = self._altitudes()[self._id]
+        if altitude == UNSET:
+            return None
+        altitudes, edges = self._store.used_bands(self._isPositive)
+        if above:
+            i = numpy.searchsorted(altitudes, altitude, side='right')
+        else:
+            i = numpy.searchsorted(altitudes, altitude, side='left')-1
+        if not 0 <= i < len(altitudes):
+            return None
+        return BandProxy(self._store, edges[i], self._isPositive)
+
+    @property
+    def topBand(self):
+        return self._neighbor(True)
+
+    @property
+    def bottomBand(self):
+        return self._neighbor(False)
+
+    def __get_altitude(self):
+        return _value(self._altitudes()[self._id])
+    def __set_altitude(self, value):
+        altitudes = self._altitudes()
+        if value is not None:
+            if self._isPositive and value <= 0:
+                raise Exception("Altitude must be positive")
+            if (not self._isPositive) and value >= 0:
+                raise Exception("Altitude must be negative")
+            if numpy.any(altitudes == value) and altitudes[self._id] != value:
+                raise Exception("Band with altitude %d already exists!"%value)
+        altitudes[self._id] = _store(value)
+        self._store.changed()
+    altitude = property(__get_altitude, __set_altitude)
+
+    def __get_rank(self):
+        return _value(self._ranks()[self._id])
+    def __set_rank(self, value):
+        ranks = self._ranks()
+        if value is not None:
+            if value < 0:
+                raise Exception("Rank must be >= 0, received %d"%value)
+            if numpy.any(ranks == value) and ranks[self._id] != value:
+                raise Exception("%s Band with rank %d already exists!"%("Positive" if self._isPositive else "Negative", value))
+        ranks[self._id] = _store(value)
+        self._store.changed()
+    rank = property(__get_rank, __set_rank)
+
+
+class SnapProxy(object):
+    __slots__ = ('_store', '_id')
+    def __init__(self, store, cid):
+        self._store = store
+        self._id = cid
+
+    def __eq__(self, other):
+        return isinstance(other, SnapProxy) and other._store is self._store and other._id == self._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((SnapProxy, self._id))
+
+    def snapkey(self):
+        """ generates the snapkey for this snap """
+        return gen_snapkey(self.block.index, "collector" if self.isSink() else "emitter", self.order)
+
+    @property
+    def connection(self):
+        return ConnectionProxy(self._store, self._id)
+
+    @property
+    def block(self):
+        return BlockProxy(self._store, self._store.conn_vertex[self._id])
+
+    @property
+    def posBandLink(self):
+        return BandProxy(self._store, self._store.conn_edge[self._id], True)
+
+    @property
+    def negBandLink(self):
+        return None
+
+    @property
+    def bandLinks(self):
+        return [band for band in [self.posBandLink, self.negBandLink] if band is not None]
+
+    def isLinked(self):
+        """ returns true if this snap is linked to at least one band. See Snap.isLinked() """
+        return self.posBandLink is not None or self.negBandLink is not None
+
+    def isUsed(self):
+        """ returns false only if the store hides disconnected snaps and this
+        snap is not linked. See Snap.isUsed()
+        """
+        return self.isLinked() or not self._store.hide_disconnected_snaps
+
+    def isSource(self):
+        return self._store.conn_kind[self._id] == SOURCE
+
+    def isSink(self):
+        return self._store.conn_kind[self._id] == SINK
+
+    def _container_orders(self):
+        """ returns arrays of the (connection ids, orders) of the snaps in the
+        same emitter or collector as this one.
+        """
+        store = self._store
+        conns = store.vertex_connections(store.conn_vertex[self._id])
+        conns = conns[store.conn_kind[conns] == store.conn_kind[self._id]]
+        return conns, store.conn_order[conns]
+
+    def _neighbor(self, left):
+        order = self._store.conn_order[self._id]
+        if order == UNSET:
+            return None
+        conns, orders = self._container_orders()
+        mask = (orders != UNSET) & ((orders < order) if left else (orders > order))
+        if not numpy.any(mask):
+            return None
+        conns, orders = conns[mask], orders[mask]
+        return SnapProxy(self._store, conns[numpy.argmax(orders) if left else numpy.argmin(orders)])
+
+    @property
+    def leftSnap(self):
+        return self._neighbor(True)
+
+    @property
+    def rightSnap(self):
+        return self._neighbor(False)
+
+    def __get_order(self):
+        return _value(self._store.conn_order[self._id])
+    def __set_order(self, value):
+        if value is not None:
+            conns, orders = self._container_orders()
+            if numpy.any(orders == value) and self._store.conn_order[self._id] != value:
+                raise Exception("Order value %d already exists!"%value)
+        self._store.conn_order[self._id] = _store(value)
+        self._store.changed()
+    order = property(__get_order, __set_order)
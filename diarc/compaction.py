@@ -0,0 +1,172 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Compaction of block indices, band altitudes and ranks, and snap orders.
+
+Releasing vertices and edges leaves holes in the index, altitude and order
+values, and new objects are placed after the largest value in use, so over
+time the values only grow apart. Compacting a topology renumbers them
+densely without changing their order:
+
+    block indices       0, 1, 2 ...
+    band altitudes      1, 2, 3 ... and -1, -2, -3 ...
+    band ranks          1, 2, 3 ... on each side
+    snap orders         0, 1, 2 ... in each emitter and collector
+
+    remap = compact(topology)
+
+The returned Remap maps the old values to the new ones, for just the values
+that changed, so that views can move their items to their new keys. It is
+also sent to the topology's listeners as a "compacted" Change record.
+
+Compacting with a stride instead leaves gaps of unused values between the
+objects (and before the first one), so that an object can be moved between
+two others by giving it a single unused value in between, see free_key().
+Once a gap has been used up, compacting again opens it back up.
+"""
+
+from topology import *
+from collections import namedtuple
+
+# The distance between values left by compacting with gaps
+STRIDE = 64
+
+class Remap(namedtuple("Remap","blocks bands snaps")):
+    """ Old to new block indices, band altitudes and snapkeys of a compaction """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return bool(self.blocks or self.bands or self.snaps)
+
+
+def compact(topology,stride=1,blocks=True,bands=True,snaps=True):
+    """ Renumbers the block indices, band altitudes and ranks, and snap
+    orders of the topology densely, preserving their order, in a single
+    batch. Returns the Remap of the values that changed.
+
+    With a stride, block indices and snap orders are renumbered
+    stride-1, 2*stride-1 ... and altitudes +/-stride, +/-2*stride ... instead.
+    Ranks are always dense. Passing false for blocks, bands or snaps leaves
+    the block indices, band altitudes and ranks, or snap orders as they are.
+    """
+    with topology.writing():
+        remap = Remap(dict(),dict(),dict())
+        moves = list()
+        # Each index is already sorted, so each value is visited once
+        for i,(old,block) in enumerate(topology._block_index.items() if blocks else []):
+            new = (i+1)*stride-1
+            if old != new:
+                remap.blocks[old] = new
+                moves.append((block,"index",new))
+        for sign,index in [(1,topology._pos_band_index),(-1,topology._neg_band_index)] if bands else []:
+            items = index.items()
+            if sign < 0:
+                items.reverse()
+            for i,(old,band) in enumerate(items):
+                new = sign*(i+1)*stride
+                if old != new:
+                    remap.bands[old] = new
+                    moves.append((band,"altitude",new))
+        # Ranks are compacted as well, since new bands are often ranked by
+        # their altitude, which would otherwise run into the old ranks
+        for ranks in [topology._pos_band_ranks,topology._neg_band_ranks] if bands else []:
+            for i,(old,band) in enumerate(ranks.items()):
+                if old != i+1:
+                    moves.append((band,"rank",i+1))
+        for vertex in topology._vertices:
+            block = vertex.block
+            for container,index in [("emitter",block._emitter_index),("collector",block._collector_index)]:
+                for i,(old,snap) in enumerate(index.items()):
+                    new = (i+1)*stride-1 if snaps else old
+                    if old != new:
+                        moves.append((snap,"order",new))
+                    # Snapkeys change with either the block index or the order
+                    if block.index is not None and (old != new or block.index in remap.blocks):
+                        snapkey = gen_snapkey(block.index,container,old)
+                        remap.snaps[snapkey] = gen_snapkey(remap.blocks.get(block.index,block.index),container,new)
+
+        with topology.batch():
+            for obj,kind,value in moves:
+                setattr(obj,kind,value)
+        if remap:
+            topology._changed("compacted",topology,None,remap)
+        return remap
+
+
+def free_key(index,lower,upper,minimum=None,maximum=None,stride=STRIDE):
+    """ Returns an unused key of a SortedIndex that is between the keys lower
+    and upper, and at least minimum and at most maximum, or None if there is
+    none. Either lower or upper may be None to find a key below or above all
+    the others. The key is taken from the middle of the widest gap between the
+    keys in use, or is a stride away from the other key if one is None.
+    """
+    if lower is None and upper is None:
+        lower,upper = -stride,stride
+    elif lower is None:
+        lower = upper-2*stride
+    elif upper is None:
+        upper = lower+2*stride
+    if minimum is not None:
+        lower = max(lower,minimum-1)
+    if maximum is not None:
+        upper = min(upper,maximum+1)
+    # Keys in use between lower and upper split the range into several gaps
+    bounds = [lower]
+    key = index.higher(lower)
+    while key is not None and key < upper:
+        bounds.append(key)
+        key = index.higher(key)
+    bounds.append(upper)
+    width,left = max([(right-left,left) for left,right in zip(bounds[:-1],bounds[1:])])
+    if width < 2:
+        return None
+    return left+width//2
+
+
+class CompactionSchedule(object):
+    """ Compacts a topology once enough vertices, edges and connections have
+    been released from it since it was last compacted. Pass stride=STRIDE to
+    keep gaps between the values for moving objects, see compact().
+
+        schedule = CompactionSchedule(topology,releases=100,stride=STRIDE)
+        ...
+        schedule.run()
+    """
+    def __init__(self,topology,releases=100,stride=1):
+        self._topology = typecheck(topology,Topology,"topology")
+        self._releases = releases
+        self._stride = stride
+        self._released = 0
+        self._topology.add_listener(self._count)
+
+    def _count(self,change):
+        if change.kind.endswith("_released"):
+            self._released += 1
+
+    def due(self):
+        """ returns true if the topology should be compacted """
+        return self._released >= self._releases
+
+    def run(self):
+        """ Compacts the topology if it is due, returning the Remap, or None if
+        it was not due.
+        """
+        if not self.due():
+            return None
+        self._released = 0
+        return compact(self._topology,self._stride)
+
+    def close(self):
+        """ Stops counting releases """
+        self._topology.remove_listener(self._count)
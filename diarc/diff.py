@@ -0,0 +1,196 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Structural differences between topologies.
+
+When a system is inspected again, rebuilding its topology from scratch throws
+away every visual parameter the user has changed since. Instead, the fresh
+topology can be diffed against the live one, and only the differences applied
+to the live topology.
+
+    changes = diff(live, fresh)
+    changes.apply()
+
+Objects are matched by key. Vertices and edges which have a name (such as the
+nodes and topics of the ros topology) are keyed by their class and name. Other
+vertices are keyed by their block index and other edges by their band
+altitudes, and vertices and edges without any of these are never matched.
+Connections are keyed by their class and the keys of their vertex and edge.
+Matching builds one dictionary of keys per topology, so taking a diff takes
+time linear in the size of the topologies.
+"""
+
+from topology import *
+
+
+def vertex_key(vertex):
+    """ returns the key a vertex is matched by, or None """
+    name = getattr(vertex,"name",None)
+    if name is not None:
+        return (type(vertex),"name",name)
+    if vertex.block.index is not None:
+        return (type(vertex),"index",vertex.block.index)
+    return None
+
+def edge_key(edge):
+    """ returns the key an edge is matched by, or None """
+    name = getattr(edge,"name",None)
+    if name is not None:
+        return (type(edge),"name",name)
+    altitudes = (edge.posBand.altitude,edge.negBand.altitude)
+    if altitudes != (None,None):
+        return (type(edge),"altitude",altitudes)
+    return None
+
+def connection_key(connection):
+    """ returns the key a connection is matched by, or None """
+    vertex = vertex_key(connection.vertex)
+    edge = edge_key(connection.edge)
+    if vertex is None or edge is None:
+        return None
+    return (type(connection),vertex,edge)
+
+
+def _match(old,new,key):
+    """ Joins two lists of objects on their keys. Returns the list of matched
+    (old, new) pairs, the unmatched old objects, and the unmatched new objects.
+    """
+    def keyed(objects):
+        keys = dict()
+        unkeyed = list()
+        for obj in objects:
+            k = key(obj)
+            if k is None:
+                unkeyed.append(obj)
+            elif k in keys:
+                raise Exception("Duplicate key %r"%(k,))
+            else:
+                keys[k] = obj
+        return keys,unkeyed
+    old_keys,removed = keyed(old)
+    new_keys,added = keyed(new)
+    matched = list()
+    for k,obj in old_keys.iteritems():
+        if k in new_keys:
+            matched.append((obj,new_keys[k]))
+        else:
+            removed.append(obj)
+    added.extend([obj for k,obj in new_keys.iteritems() if k not in old_keys])
+    return matched,removed,added
+
+def _visuals(obj):
+    """ returns the (visual object, kind) pairs holding the visual parameters
+    of a vertex, edge or connection
+    """
+    if isinstance(obj,Vertex):
+        return [(obj.block,"index")]
+    if isinstance(obj,Edge):
+        return [(obj.posBand,"altitude"),(obj.posBand,"rank"),
+                (obj.negBand,"altitude"),(obj.negBand,"rank")]
+    return [(obj.snap,"order")]
+
+def _attributes(obj):
+    """ returns the public attributes subclasses have added to an object """
+    attributes = list()
+    for cls in type(obj).__mro__:
+        for name in getattr(cls,"__slots__",()):
+            if not name.startswith("_") and hasattr(obj,name):
+                attributes.append((name,getattr(obj,name)))
+    return attributes
+
+
+def diff(old,new):
+    """ Returns the Changeset which turns topology old into topology new """
+    typecheck(old,Topology,"old")
+    typecheck(new,Topology,"new")
+    vertices = _match(old.vertices,new.vertices,vertex_key)
+    edges = _match(old.edges,new.edges,edge_key)
+    connections = _match(list(old._sources)+list(old._sinks),
+                         list(new._sources)+list(new._sinks),connection_key)
+    return Changeset(old,new,vertices,edges,connections)
+
+
+class Changeset(object):
+    """ The differences between two topologies, as a list of Change records
+    in the order they are applied in.
+
+    Structural changes come first: connection_released, edge_released and
+    vertex_released records hold the objects of the old topology, and
+    vertex_added, edge_added and connection_added records hold the objects of
+    the new topology to be copied. These are followed by index, altitude, rank
+    and order records for the visual objects of the old topology whose value
+    differs in the new one, and a hide_disconnected_snaps record if that
+    differs too. Visual parameters of added objects are copied along with them.
+    """
+    def __init__(self,old,new,vertices,edges,connections):
+        self._topology = old
+        self._version = old.version
+        # Objects of the new topology, mapped to their match in the old one
+        self._matches = dict()
+        self.changes = list()
+
+        released = list()
+        added = list()
+        moved = list()
+        for name,(matched,removed,unmatched) in [("vertex",vertices),("edge",edges),("connection",connections)]:
+            released.append([Change(name+"_released",obj,None,None) for obj in removed])
+            added.extend([Change(name+"_added",obj,None,None) for obj in unmatched])
+            for old_obj,new_obj in matched:
+                self._matches[new_obj] = old_obj
+                for (old_visual,kind),(new_visual,_) in zip(_visuals(old_obj),_visuals(new_obj)):
+                    value = getattr(new_visual,kind)
+                    if getattr(old_visual,kind) != value:
+                        moved.append(Change(kind,old_visual,getattr(old_visual,kind),value))
+        # Releasing connections first leaves vertices and edges with only the
+        # connections which are kept
+        self.changes.extend(released[2]+released[1]+released[0])
+        self.changes.extend(added)
+        self.changes.extend(moved)
+        if old.hide_disconnected_snaps != new.hide_disconnected_snaps:
+            self.changes.append(Change("hide_disconnected_snaps",old,old.hide_disconnected_snaps,new.hide_disconnected_snaps))
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def apply(self):
+        """ Applies the changes to the old topology in a single batch. The
+        classes of added objects must be constructible from just the topology
+        (or the topology, vertex and edge for connections). A changeset can only
+        be applied to the topology as it was when the diff was taken.
+        """
+        topology = self._topology
+        if topology.version != self._version:
+            raise Exception("Topology has changed since the diff was taken")
+        created = dict(self._matches)
+        with topology.batch():
+            for change in self.changes:
+                kind = change.kind
+                obj = change.obj
+                if kind.endswith("_released"):
+                    obj.release()
+                elif kind.endswith("_added"):
+                    if kind == "connection_added":
+                        copy = type(obj)(topology,created[obj.vertex],created[obj.edge])
+                    else:
+                        copy = type(obj)(topology)
+                    for name,value in _attributes(obj):
+                        setattr(copy,name,value)
+                    for (visual,visual_kind),(source,_) in zip(_visuals(copy),_visuals(obj)):
+                        setattr(visual,visual_kind,getattr(source,visual_kind))
+                    created[obj] = copy
+                else:
+                    setattr(obj,kind,change.new)
@@ -0,0 +1,333 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Automatic arrangement of blocks and bands.
+
+A band is drawn from the leftmost to the rightmost block connected to its
+edge, and the snap links of every block in between which is not connected to
+the edge cross the band on their way to bands stacked further out. For a
+given graph, the number of these crossings grows with the total span of the
+bands, and arranging the blocks so that connected blocks sit close together
+shortens the bands and removes crossings along with them.
+
+    arrange_blocks(topology)
+
+The order is found in two steps. Starting from both the current order and
+a breadth first walk of the graph, the blocks are sorted by the barycenter
+(or median) of the edges they connect to, where the position of an edge is
+the average position of its blocks, a few times over. Of the orders found,
+the one with the fewest crossings (then the shortest span) is kept. It is
+then improved by sifting: each block in turn is moved to the position within
+a window around its own which gives the shortest total span.
+
+Crossings depend on the altitudes of the bands, which are only assigned once
+the blocks are in place, so they are counted as if every edge were drawn as
+a single band and the bands were stacked by span, as assign_altitudes()
+stacks them (see crossings()). Counting crossings means sweeping over every
+band, while the change in span of moving a block by one place only depends
+on the edges of the two blocks exchanged, so sifting minimizes the span, and
+its result is only kept if it has no more crossings than the order it
+started from. Sorting and sifting take time linear in the number of
+connections (times the window, for sifting), so thousands of blocks are
+arranged in seconds.
+
+    assign_altitudes(topology)
+
+Bands are stacked the same way, with the shortest bands closest to the
+block ribbon, so that the snap links reaching the longer bands above them
+cross as few bands as possible. Their altitudes are packed into a dense
+range, so the band stack no longer grows as bands come and go.
+"""
+
+from topology import *
+import bisect
+
+
+def _graph(topology):
+    """ Returns the blocks which have an index, in index order, and the
+    positions of the blocks connected to each edge which connects at least two
+    of them.
+    """
+    blocks = topology.blocks.values()
+    position = dict([(block.vertex,i) for i,block in enumerate(blocks)])
+    edges = list()
+    for edge in topology.edges:
+        vertices = set([c.vertex for c in topology._edge_sources.get(edge,())] +
+                       [c.vertex for c in topology._edge_sinks.get(edge,())])
+        members = [position[v] for v in vertices if v in position]
+        if len(members) > 1:
+            edges.append(members)
+    return blocks,edges
+
+def _span(order,edges):
+    """ returns the total span of the edges when blocks are placed in order """
+    position = [0]*len(order)
+    for i,v in enumerate(order):
+        position[v] = i
+    total = 0
+    for members in edges:
+        positions = [position[v] for v in members]
+        total += max(positions)-min(positions)
+    return total
+
+def _sort(order,edges,vertex_edges,method):
+    """ Returns the order of the blocks sorted by the barycenter or median of
+    the edges they connect to. Blocks without edges keep their position.
+    """
+    position = [0]*len(order)
+    for i,v in enumerate(order):
+        position[v] = i
+    centers = [sum([position[v] for v in members])/float(len(members)) for members in edges]
+    values = list()
+    for v,es in enumerate(vertex_edges):
+        if not es:
+            values.append(position[v])
+        elif method == "median":
+            values.append(sorted([centers[e] for e in es])[len(es)//2])
+        else:
+            values.append(sum([centers[e] for e in es])/len(es))
+    return sorted(order,key=lambda v: (values[v],position[v]))
+
+def _breadth_first(order,edges,vertex_edges):
+    """ Returns the blocks in breadth first order over the edges, starting each
+    connected group of blocks from its leftmost block with the fewest edges.
+    """
+    visited = [False]*len(order)
+    edge_visited = [False]*len(edges)
+    result = list()
+    starts = sorted(order,key=lambda v: len(vertex_edges[v]))
+    for start in starts:
+        if visited[start]:
+            continue
+        visited[start] = True
+        queue = [start]
+        head = 0
+        while head < len(queue):
+            v = queue[head]
+            head += 1
+            for e in vertex_edges[v]:
+                if edge_visited[e]:
+                    continue
+                edge_visited[e] = True
+                for u in edges[e]:
+                    if not visited[u]:
+                        visited[u] = True
+                        queue.append(u)
+        result.extend(queue)
+    return result
+
+def _crossings(order,edges,vertex_edges):
+    """ returns the number of snap links which cross a band when the blocks
+    are placed in order. Each edge is drawn as a single band, and the bands
+    are stacked from the shortest up (the first edge first, among bands of the
+    same span), so a snap link crosses every band below its own which
+    stretches over its block without being connected to it.
+    """
+    position = [0]*len(order)
+    for i,v in enumerate(order):
+        position[v] = i
+    lo = [min([position[v] for v in members]) for members in edges]
+    hi = [max([position[v] for v in members]) for members in edges]
+    # Bands are stacked by (span, edge)
+    key = [(hi[e]-lo[e],e) for e in range(len(edges))]
+    # The bands which stretch over each position, not counting their ends,
+    # are kept sorted by key while sweeping from left to right
+    opening = [list() for v in order]
+    closing = [list() for v in order]
+    for e in range(len(edges)):
+        if hi[e]-lo[e] > 1:
+            opening[lo[e]+1].append(e)
+            closing[hi[e]].append(e)
+    covering = list()
+    total = 0
+    for p,v in enumerate(order):
+        for e in closing[p]:
+            del covering[bisect.bisect_left(covering,key[e])]
+        for e in opening[p]:
+            bisect.insort(covering,key[e])
+        # Bands which stretch over the block, but are connected to it
+        own = [key[e] for e in vertex_edges[v] if lo[e] < p < hi[e]]
+        for f in vertex_edges[v]:
+            total += bisect.bisect_left(covering,key[f]) - len([k for k in own if k < key[f]])
+    return total
+
+def _sift(order,edges,vertex_edges,window,passes):
+    """ Sifts the blocks in place, from those with the most edges down: each
+    block is moved to the position at most window places from its own which
+    gives the shortest total span. Stops after the given number of passes, or
+    once a pass does not shorten the span.
+    """
+    position = [0]*len(order)
+    for i,v in enumerate(order):
+        position[v] = i
+    # The leftmost and rightmost position of each edge
+    lo = [min([position[v] for v in members]) for members in edges]
+    hi = [max([position[v] for v in members]) for members in edges]
+    vertex_edge_sets = [set(es) for es in vertex_edges]
+
+    def exchange(p):
+        """ Exchanges the blocks at p and p+1, returning the change in span """
+        u,v = order[p],order[p+1]
+        # Moving u right lengthens the edges it ends and shortens the edges
+        # it starts, and the other way around for v. Edges connected to
+        # both keep their span.
+        delta = 0
+        for e in vertex_edges[u]:
+            if e not in vertex_edge_sets[v]:
+                if hi[e] == p:
+                    hi[e] = p+1
+                    delta += 1
+                elif lo[e] == p:
+                    lo[e] = p+1
+                    delta -= 1
+        for e in vertex_edges[v]:
+            if e not in vertex_edge_sets[u]:
+                if lo[e] == p+1:
+                    lo[e] = p
+                    delta += 1
+                elif hi[e] == p+1:
+                    hi[e] = p
+                    delta -= 1
+        order[p],order[p+1] = v,u
+        position[u],position[v] = p+1,p
+        return delta
+
+    blocks = sorted(range(len(order)),key=lambda v: -len(vertex_edges[v]))
+    for n in range(passes):
+        improved = False
+        for v in blocks:
+            if not vertex_edges[v]:
+                continue
+            # Move the block right to the end of the window, then left to its
+            # start, keeping track of the best position passed on the way
+            start = p = position[v]
+            change = best_change = 0
+            best = start
+            while p < min(start+window,len(order)-1):
+                change += exchange(p)
+                p += 1
+                if change < best_change:
+                    best,best_change = p,change
+            while p > max(start-window,0):
+                change += exchange(p-1)
+                p -= 1
+                if change < best_change:
+                    best,best_change = p,change
+            while p < best:
+                exchange(p)
+                p += 1
+            if best_change < 0:
+                improved = True
+        if not improved:
+            break
+    return order
+
+def block_order(topology,method="barycenter",iterations=8,passes=4,window=16):
+    """ Returns the blocks which have an index, in the order which arrange_blocks
+    would give them. Method is either "barycenter" or "median". Sifting makes
+    at most the given number of passes, moving each block at most window
+    places at a time.
+    """
+    if method not in ["barycenter","median"]:
+        raise Exception("Unknown method %r"%method)
+    blocks,edges = _graph(topology)
+    vertex_edges = [list() for b in blocks]
+    for e,members in enumerate(edges):
+        for v in members:
+            vertex_edges[v].append(e)
+
+    def cost(order):
+        return (_crossings(order,edges,vertex_edges),_span(order,edges))
+    current = range(len(blocks))
+    best = current
+    best_cost = cost(best)
+    for order in [current,_breadth_first(current,edges,vertex_edges)]:
+        for i in range(iterations+1):
+            if i > 0:
+                order = _sort(order,edges,vertex_edges,method)
+            order_cost = cost(order)
+            if order_cost < best_cost:
+                best,best_cost = order,order_cost
+    sifted = _sift(list(best),edges,vertex_edges,window,passes)
+    if _crossings(sifted,edges,vertex_edges) <= best_cost[0]:
+        best = sifted
+    return [blocks[v] for v in best]
+
+def arrange_blocks(topology,method="barycenter",iterations=8,passes=4,window=16):
+    """ Rearranges the blocks which have an index so as to shorten the bands
+    and reduce crossings, reusing the indices they already have. All of the
+    blocks are moved in a single batch. Returns the blocks in their new order.
+    See block_order() for the parameters.
+    """
+    order = block_order(topology,method,iterations,passes,window)
+    indices = sorted([block.index for block in order])
+    with topology.batch():
+        for index,block in zip(indices,order):
+            block.index = index
+    return order
+
+def _band_span(band):
+    """ returns the number of block positions a used band stretches across """
+    indices = [snap.block.index for snap in band.emitters+band.collectors]
+    indices = [index for index in indices if isinstance(index,int)]
+    return max(indices)-min(indices) if indices else 0
+
+def assign_altitudes(topology):
+    """ Reassigns the altitudes of the bands which have one, on each side of
+    the block ribbon, to the dense range 1, 2, 3... (or -1, -2, -3...). Used
+    bands come first, ordered by their span so that bands nested inside a
+    longer band sit below it and the snap links reaching the longer band cross
+    fewer bands. Unused bands follow in their current order. Each band's rank
+    is set to the magnitude of its altitude, and bands without an altitude
+    are ranked above them. Everything is changed in a single batch. Returns
+    the positive and negative bands, from the block ribbon outwards.
+    """
+    sides = list()
+    for sign,bands in [(1,topology._pos_band_index),(-1,topology._neg_band_index)]:
+        bands = [band for altitude,band in sorted(bands.items(),key=lambda item: abs(item[0]))]
+        used = [band for band in bands if band.isUsed()]
+        unused = [band for band in bands if not band.isUsed()]
+        # Sorting is stable, so bands of the same span keep their current order
+        order = sorted(used,key=_band_span) + unused
+        ranks = topology._pos_band_ranks if sign > 0 else topology._neg_band_ranks
+        unplaced = [band for rank,band in ranks.items() if band.altitude is None]
+        sides.append((sign,order,unplaced))
+
+    with topology.batch():
+        for sign,order,unplaced in sides:
+            for i,band in enumerate(order):
+                band.altitude = sign*(i+1)
+                band.rank = i+1
+            for i,band in enumerate(unplaced):
+                band.rank = len(order)+i+1
+    return sides[0][1],sides[1][1]
+
+def total_span(topology):
+    """ Returns the sum over all edges of the number of block positions
+    between their leftmost and rightmost connected block.
+    """
+    blocks,edges = _graph(topology)
+    return _span(range(len(blocks)),edges)
+
+def crossings(topology):
+    """ Returns the number of snap links which cross a band, when every edge
+    is drawn as a single band and the bands are stacked by span (see
+    assign_altitudes), given the current order of the blocks.
+    """
+    blocks,edges = _graph(topology)
+    vertex_edges = [list() for b in blocks]
+    for e,members in enumerate(edges):
+        for v in members:
+            vertex_edges[v].append(e)
+    return _crossings(range(len(blocks)),edges,vertex_edges)
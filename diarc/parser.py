@@ -12,21 +12,91 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import xml.etree.ElementTree as ET
-import xml.dom.minidom
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+from StringIO import StringIO
 from topology import *
+from builder import TopologyBuilder
 """ v5 topology parser and serializer """
 
 def parseFile(filename):
-    return parseTree(ET.parse(filename))
+    return parseStream(filename)
     
 def parseString(data):
-    return parseTree(ET.fromstring(data))
+    return parseStream(StringIO(data))
+
+def parseStream(source):
+    """ Parses a topology from a filename or file object one element at a
+    time, discarding each vertex and edge element once it has been read, so
+    that large files can be loaded without holding their whole tree.
+    """
+    builder = TopologyBuilder()
+    # Keep track of edges for reference later
+    edgeList = dict()
+    # Vertices come before the edges they connect to, so their connections
+    # are kept as (vertex, edge id, order) rows until the edges are known
+    sinks = list()
+    sources = list()
+    # The <vertices> or <edges> element being read
+    parent = None
+    root = None
+    def optional(element,name):
+        """ returns the int value of an attribute, or None if it is left out """
+        value = element.attrib.get(name)
+        return int(value.strip()) if value is not None else None
+
+    for event,element in iterparse(source,events=("start","end")):
+        if event == "start":
+            if root is None:
+                root = element
+                if root.tag != "topology" or root.attrib.get("version") != "diarc:v5":
+                    raise Exception("Not a diarc:v5 topology")
+            if element.tag in ["vertices","edges"]:
+                parent = element
+            continue
+
+        if element.tag == "vertex":
+            v = builder.add_vertex(optional(element,"index"))
+            for sink in element.find("collector").findall("sink"):
+                sinks.append((v,int(sink.attrib["edge"].strip()),optional(sink,"order")))
+            for source in element.find("emitter").findall("source"):
+                sources.append((v,int(source.attrib["edge"].strip()),optional(source,"order")))
+        elif element.tag == "edge":
+            eid = int(element.attrib['id'].strip())
+            bands = dict()
+            for band in element.findall("band"):
+                altitude = int(band.attrib["altitude"].strip())
+                rank = optional(band,"rank")
+                if altitude > 0:
+                    bands["posAltitude"] = altitude
+                    bands["posRank"] = rank
+                else:
+                    bands["negAltitude"] = altitude
+                    bands["negRank"] = rank
+            edgeList[eid] = builder.add_edge(**bands)
+        else:
+            continue
+        # Everything before this element has been read as well
+        element.clear()
+        if parent is not None:
+            parent.clear()
+
+    for v,edgeid,order in sinks:
+        e = edgeList[edgeid]
+        if not builder.has_sink(v,e):
+            builder.add_sink(v,e,order)
+    for v,edgeid,order in sources:
+        e = edgeList[edgeid]
+        if not builder.has_source(v,e):
+            builder.add_source(v,e,order)
+    return builder.build()
 
 def parseTree(tree):
     # Get XML Tree root and initialize topology
     root = tree.getroot()
-    t = Topology()
+    builder = TopologyBuilder()
  
     # Populate Edges
     edges = root.find("edges").findall("edge")
@@ -37,16 +107,18 @@ def parseTree(tree):
     edgeList = dict()
 
     for edge in edges:
-        e = Edge(t)
         eid = int(edge.attrib['id'].strip())
-        edgeList[eid] = e
+        bands = dict()
         for band in edge.findall("band"):
             altitude = int(band.attrib["altitude"].strip())
             rank = int(band.attrib["rank"].strip())
-            matches = filter(lambda x: x.rank==rank,t.bands.values())
-            b = e.posBand if altitude > 0 else e.negBand
-            b.altitude = altitude
-            b.rank = rank
+            if altitude > 0:
+                bands["posAltitude"] = altitude
+                bands["posRank"] = rank
+            else:
+                bands["negAltitude"] = altitude
+                bands["negRank"] = rank
+        edgeList[eid] = builder.add_edge(**bands)
 
    
     # Populate Vertices
@@ -54,67 +126,78 @@ def parseTree(tree):
 #     print "Num Vertices Detected: %d"%len(vertices)
     for vertex in vertices:
         index = int(vertex.attrib['index'].strip())
-        v = Vertex(t)
+        v = builder.add_vertex(index)
 #         print "Creating Vertex with index=",index,v
-        v.block.index = index
 
         # Make edge connections to this vertex
         for sink in vertex.find("collector").findall("sink"):
             order = int(sink.attrib["order"].strip())
             edgeid = int(sink.attrib["edge"].strip())
             e = edgeList[edgeid]
-            if v in [s.vertex for s in e.sinks]:
+            if builder.has_sink(v,e):
                 pass
 #                 print "Existing Vertex found!"
             else:
-                tmp = Sink(t,v,e)
-                tmp.snap.order = order
+                builder.add_sink(v,e,order)
 #                 print "Creating sink with order=",order,"altitude=",altitude,tmp
 
         for source in vertex.find("emitter").findall("source"):
             order = int(source.attrib["order"].strip())
             edgeid = int(source.attrib["edge"].strip())
             e = edgeList[edgeid]
-            if v in [src.vertex for src in e.sources]:
+            if builder.has_source(v,e):
                 pass
 #                 print "Existing Vertex found"
             else:
-                tmp = Source(t,v,e)
-                tmp.snap.order = order
+                builder.add_source(v,e,order)
 #                 print "Creating source with order=",order,"altitude=",altitude,tmp
-    return t
+    return builder.build()
 
 def serialize(topology):
     """ Generate xml from topology """
-    xmlRoot = ET.Element('topology')
-    xmlVertices = ET.SubElement(xmlRoot,'vertices')
-    xmlEdges = ET.SubElement(xmlRoot,'edges')
-
-    nextEdgeId = 0
-    revEdgeList = dict()
-
-    # Serialize Edges
+    out = StringIO()
+    serializeStream(topology,out)
+    return out.getvalue()
+
+def serializeFile(topology,filename):
+    with open(filename,"w") as out:
+        serializeStream(topology,out)
+
+def serializeStream(topology,out):
+    """ Writes the topology to a file object as v5 xml, one vertex or edge at
+    a time. Attributes whose value is not set are left out, and bands without
+    an altitude are not written.
+    """
+    def attributes(*pairs):
+        return "".join([" %s='%d'"%(name,value) for name,value in pairs if value is not None])
+
+    edgeIds = dict([(edge,eid) for eid,edge in enumerate(topology.edges)])
+    # Blocks are written in index order, followed by those without an index
+    vertices = [block.vertex for block in topology._block_index.values()]
+    vertices += [vertex for vertex in topology.vertices if vertex.block.index is None]
+
+    out.write("<topology version='diarc:v5'>\n")
+    out.write("    <vertices>\n")
+    for vertex in vertices:
+        lines = ["        <vertex%s>"%attributes(("index",vertex.block.index))]
+        for container,connections,tag in [("collector",vertex.sinks,"sink"),("emitter",vertex.sources,"source")]:
+            lines.append("            <%s>"%container)
+            for connection in sorted(connections,key=lambda c: c.snap.order):
+                lines.append("                <%s%s />"%(tag,attributes(("order",connection.snap.order),("edge",edgeIds[connection.edge]))))
+            lines.append("            </%s>"%container)
+        lines.append("        </vertex>\n")
+        out.write("\n".join(lines))
+    out.write("    </vertices>\n")
+    out.write("    <edges>\n")
     for edge in topology.edges:
-        xmlEdge = ET.SubElement(xmlEdges,'edge')
-        eid = nextEdgeId
-        nextEdgeId+=1
-        xmlEdge.attrib["id"] = eid
+        lines = ["        <edge id='%d'>"%edgeIds[edge]]
         for band in [edge.posBand,edge.negBand]:
-            b = ET.SubElement(xmlEdge,'band')
-            b.attrib["altitude"] = str(band.altitude)
-            b.attrib["rank"] = str(band.rank)
-            revEdgeList[band.altitude] = eid
-
-    # Serialize Vertices
-    for vertex in topology.vertices:
-        xmlVertex = ET.SubElement(xmlVertices,'vertex')
-#         for source in vertex.sources:
-# 
-# 
-# 
-#         for sink in vertex.sinks:
-
-    return xmlify(xmlRoot)
+            if band.altitude is not None:
+                lines.append("            <band%s />"%attributes(("altitude",band.altitude),("rank",band.rank)))
+        lines.append("        </edge>\n")
+        out.write("\n".join(lines))
+    out.write("    </edges>\n")
+    out.write("</topology>\n")
 
 
 
@@ -131,17 +214,3 @@ def find_element_by_attribute(root,elementname,attribname,attribval):
         except:
             raise Exception("Element %s has not attribute %s"%(elementname,attribname))
     raise Exception("Could not find %s with %s=%s"%(elementname,attribname,attribval))
-
-
-def xmlify(root):
-    # Split continuous string by newlines
-    content = xml.dom.minidom.parseString(ET.tostring(root)).toprettyxml().split("\n")
-    # Remove right hand whitespace
-    content = [str(l).rstrip() for l in content]
-    # Filter Blank lines
-    content = filter(lambda x: not x == "",content)
-    # Repack as a single string
-    content = "\n".join(content)
-    return content
-
-
@@ -0,0 +1,227 @@
+# Copyright 2014 Open Source Robotics Foundation, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Frozen views of a topology.
+
+A Snapshot is taken in constant time, and does not copy the topology. It
+shares the topology's objects, and listens to the topology's change records.
+The first time an object is changed after the snapshot was taken, the
+snapshot saves the value that object had before the change. Objects added
+later are hidden from it, and released objects are kept by it. Each change
+therefore costs the snapshot a constant amount of work and memory, and
+reading a snapshot returns the topology as it was when it was taken.
+
+    snapshot = topology.snapshot()
+    ...
+    for index,block in snapshot.blocks.items():
+        for connection in snapshot.sources(snapshot.vertex(block)):
+            ...
+
+Values are read through the snapshot (snapshot.index(block) rather than
+block.index) since the objects themselves always hold their current values.
+Snapshots cannot be taken while a batch is open, and a snapshot read while a
+batch is open sees the changes made in the batch so far. Reading a snapshot
+holds the topology's read lock (see Topology.reading()), so snapshots may be
+read while other threads write to the topology.
+"""
+
+from topology import *
+import functools
+import weakref
+
+
+def _reading(method):
+    """ Decorator for snapshot accessors which hold the read lock of the
+    topology while they run
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        if self._topology is None:
+            raise Exception("Cannot read a closed snapshot")
+        with self._topology.reading():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class Snapshot(object):
+    def __init__(self,topology):
+        self._topology = typecheck(topology,Topology,"topology")
+        if topology._batch is not None:
+            raise Exception("Cannot take a snapshot while a batch is open")
+        self._version = topology.version
+        # Objects added to the topology after the snapshot was taken
+        self._added = set()
+        # Objects released from the topology after the snapshot was taken,
+        # mapped to the 'old' value of their release record
+        self._released = dict()
+        # Released connections, listed under their vertex and their edge
+        self._released_connections = dict()
+        # Values from before the first change to an object, by (object, kind)
+        self._old = dict()
+
+        # The topology only holds a weak reference to the snapshot, so that
+        # snapshots which are dropped without being closed stop listening
+        ref = weakref.ref(self)
+        def listener(change):
+            snapshot = ref()
+            if snapshot is None:
+                topology.remove_listener(listener)
+            else:
+                snapshot._record(change)
+        self._listener = listener
+        topology.add_listener(listener)
+
+    def close(self):
+        """ Stops following the topology. The snapshot can no longer be read. """
+        if self._listener is not None:
+            self._topology.remove_listener(self._listener)
+            self._listener = None
+            self._topology = None
+
+    def _record(self,change):
+        kind = change.kind
+        if kind.endswith("_added"):
+            self._added.add(change.obj)
+        elif kind.endswith("_released"):
+            if change.obj in self._added:
+                self._added.remove(change.obj)
+            else:
+                self._released[change.obj] = change.old
+                if kind == "connection_released":
+                    vertex,edge,snap = change.old
+                    self._released_connections.setdefault(vertex,list()).append(change.obj)
+                    self._released_connections.setdefault(edge,list()).append(change.obj)
+        else:
+            key = (change.obj,kind)
+            if key not in self._old:
+                self._old[key] = change.old
+
+    def _value(self,obj,kind,current):
+        return self._old.get((obj,kind),current)
+
+    @property
+    def version(self):
+        """ returns the version of the topology the snapshot was taken at """
+        return self._version
+
+    @property
+    @_reading
+    def hide_disconnected_snaps(self):
+        return self._value(self._topology,"hide_disconnected_snaps",self._topology.hide_disconnected_snaps)
+
+    # Logical objects
+    @property
+    @_reading
+    def vertices(self):
+        """ returns an unordered list of the vertices in the snapshot """
+        return [v for v in self._topology._vertices if v not in self._added] + \
+               [v for v in self._released if isinstance(v,Vertex)]
+
+    @property
+    @_reading
+    def edges(self):
+        """ returns an unordered list of the edges in the snapshot """
+        return [e for e in self._topology._edges if e not in self._added] + \
+               [e for e in self._released if isinstance(e,Edge)]
+
+    def _connections(self,obj,current,kind):
+        connections = [c for c in self._topology._adjacent(current,obj) if c not in self._added]
+        return connections + [c for c in self._released_connections.get(obj,()) if isinstance(c,kind)]
+
+    @_reading
+    def sources(self,obj):
+        """ returns the source connections of a vertex or edge """
+        t = self._topology
+        return self._connections(obj,t._vertex_sources if isinstance(obj,Vertex) else t._edge_sources,Source)
+
+    @_reading
+    def sinks(self,obj):
+        """ returns the sink connections of a vertex or edge """
+        t = self._topology
+        return self._connections(obj,t._vertex_sinks if isinstance(obj,Vertex) else t._edge_sinks,Sink)
+
+    @_reading
+    def endpoints(self,connection):
+        """ returns the (vertex, edge) of a connection """
+        if connection in self._released:
+            return self._released[connection][:2]
+        return (connection.vertex,connection.edge)
+
+    # Graphical objects
+    @_reading
+    def block(self,vertex):
+        return self._released[vertex] if vertex in self._released else vertex.block
+
+    @_reading
+    def vertex(self,block):
+        return block._vertex or [v for v,b in self._released.items() if b is block][0]
+
+    @_reading
+    def posBand(self,edge):
+        return self._released[edge][0] if edge in self._released else edge.posBand
+
+    @_reading
+    def negBand(self,edge):
+        return self._released[edge][1] if edge in self._released else edge.negBand
+
+    @_reading
+    def snap(self,connection):
+        return self._released[connection][2] if connection in self._released else connection.snap
+
+    @_reading
+    def index(self,block):
+        return self._value(block,"index",block._index)
+
+    @_reading
+    def altitude(self,band):
+        return self._value(band,"altitude",band._altitude)
+
+    @_reading
+    def rank(self,band):
+        return self._value(band,"rank",band._rank)
+
+    @_reading
+    def order(self,snap):
+        return self._value(snap,"order",snap._order)
+
+    @property
+    @_reading
+    def blocks(self):
+        """ Returns dictionary of all blocks which had an index, by index """
+        blocks = [self.block(v) for v in self.vertices]
+        return dict([(self.index(b),b) for b in blocks if isinstance(self.index(b),int)])
+
+    @property
+    @_reading
+    def bands(self):
+        """ Returns dictionary of all bands which had an altitude, by altitude """
+        bands = [band for e in self.edges for band in [self.posBand(e),self.negBand(e)]]
+        return dict([(self.altitude(b),b) for b in bands if isinstance(self.altitude(b),int)])
+
+    @property
+    @_reading
+    def snaps(self):
+        """ Returns dictionary of all snaps which had an order, by snapkey. Unlike
+        Topology.snaps, this includes snaps regardless of hide_disconnected_snaps.
+        """
+        snaps = dict()
+        for v in self.vertices:
+            index = self.index(self.block(v))
+            for container,connections in [("emitter",self.sources(v)),("collector",self.sinks(v))]:
+                for c in connections:
+                    snap = self.snap(c)
+                    order = self.order(snap)
+                    if isinstance(order,int):
+                        snaps[gen_snapkey(index,container,order)] = snap
+        return snaps
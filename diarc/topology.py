@@ -54,65 +54,358 @@
 
 from util import *
 from snapkey import *
+from collections import OrderedDict
+from collections import namedtuple
+from contextlib import contextmanager
+import bisect
+import itertools
 import types
 import logging
 
+# The order index of every emitter and collector which has no ordered snaps,
+# see Block._snap_index()
+_NO_SNAPS = SortedIndex()
+
+# The number of connections a vertex or edge keeps in a list, rather than a
+# dictionary, see Topology._attach()
+ADJACENCY_LIST_SIZE = 8
+
 class Topology(object):
     def __init__(self):
-        self._vertices = TypedList(Vertex)
-        self._edges = TypedList(Edge)
-        self._sources = TypedList(Source)
-        self._sinks = TypedList(Sink)
+        # Vertices and edges keep the order they were added in, and sources
+        # and sinks are unordered. All are kept in sets so that they can be
+        # removed in constant time.
+        self._vertices = TypedOrderedSet(Vertex)
+        self._edges = TypedOrderedSet(Edge)
+        self._sources = TypedSet(Source)
+        self._sinks = TypedSet(Sink)
+
+        # Adjacency indexes. Connections are listed under the vertex and the
+        # edge they attach to, so that Vertex.sources, Edge.sinks, etc. are 
+        # proportional to the degree of the object rather than the size of 
+        # the topology. Each vertex or edge with connections has a short list
+        # of them, which becomes a dictionary mapping its connections to the
+        # order they were added in once it grows past ADJACENCY_LIST_SIZE, so
+        # that a connection is removed in constant time without every vertex
+        # and edge paying for a dictionary. These are maintained by the Source
+        # and Sink objects, see _attach() and _adjacent().
+        self._vertex_sources = dict()
+        self._vertex_sinks = dict()
+        self._edge_sources = dict()
+        self._edge_sinks = dict()
+        self._attached = itertools.count()
+
+        # Connections by (vertex, edge) pair, used to reject duplicate sources
+        # and sinks without searching. Maintained by the Source and Sink objects.
+        self._source_pairs = dict()
+        self._sink_pairs = dict()
+
+        # Blocks that have been assigned an index, sorted by index. This is 
+        # maintained by Block.index
+        self._block_index = SortedIndex()
+
+        # Bands that have been assigned an altitude, sorted by altitude, with
+        # positive and negative bands kept apart. The bands for which isUsed()
+        # is true are also kept in their own indexes, so that topBand and 
+        # bottomBand can find the next used band without testing the others.
+        # These are maintained by Band.altitude and Band._refresh()
+        self._pos_band_index = SortedIndex()
+        self._neg_band_index = SortedIndex()
+        self._pos_used_band_index = SortedIndex()
+        self._neg_used_band_index = SortedIndex()
+
+        # Ranks taken by positive and negative bands. Maintained by Band.rank
+        self._pos_band_ranks = SortedIndex()
+        self._neg_band_ranks = SortedIndex()
 
         # Visual Settings
         self._hide_disconnected_snaps = False
 
+        # Incremented every time the topology is changed. The blocks, bands
+        # and snaps mappings are cached until the version changes.
+        self._version = 0
+        self._cache = dict()
+
+        # While a batch is open, a journal of (object, raw setter, old value)
+        # entries for every change made to a visual parameter. None otherwise.
+        self._batch = None
+
+        # Callables which are passed a Change record for every change made to
+        # the topology, and the records held back until the open batch ends.
+        self._listeners = list()
+        self._pending_changes = list()
+
+        # Guards the topology when it is shared between threads. Nothing takes
+        # this lock by itself except batch(); see reading() and writing().
+        self._lock = ReadWriteLock()
+
+    @property
+    def version(self):
+        """ returns a counter that is incremented on every change to the topology """
+        return self._version
+
+    def snapshot(self):
+        """ returns a read-only Snapshot of the topology as it is now. Taking a
+        snapshot does not copy the topology. See diarc.snapshot.
+        """
+        from snapshot import Snapshot
+        return Snapshot(self)
+
+    def add_listener(self,listener):
+        """ Registers a callable to be passed a Change record every time the
+        topology is changed. Changes made inside a batch are delivered when 
+        the batch ends, and changes that are rolled back are not delivered.
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self,listener):
+        self._listeners.remove(listener)
+
+    def _changed(self,kind,obj,old=None,new=None):
+        """ Marks the topology as changed, invalidating cached mappings, and 
+        reports the change to the listeners.
+        """
+        self._version += 1
+        if not self._listeners:
+            return
+        change = Change(kind,obj,old,new)
+        if self._batch is not None:
+            self._pending_changes.append(change)
+        else:
+            for listener in list(self._listeners):
+                listener(change)
+
+    def _deliver_changes(self,changes):
+        """ Passes changes that were held back during a batch to the listeners """
+        for change in changes:
+            for listener in list(self._listeners):
+                listener(change)
+
+    def reading(self):
+        """ Returns a context manager that holds the topology's read lock. Any
+        number of threads may read the topology at once, but not while another
+        thread is writing to it.
+
+            with topology.reading():
+                blocks = topology.blocks
+        """
+        return self._lock.reading()
+
+    def writing(self):
+        """ Returns a context manager that holds the topology's write lock,
+        keeping out all other readers and writers. The writing thread may
+        read, write and open batches while it holds the lock.
+        """
+        return self._lock.writing()
+
+    @contextmanager
+    def batch(self):
+        """ Groups a sequence of changes to block indices, band altitudes and
+        ranks, and snap orders. Inside the batch these values may temporarily
+        collide with each other, and are only checked for uniqueness when the
+        batch ends. If a check fails, or an exception escapes the batch, every
+        change to these values is undone and the exception is raised. Objects
+        created or released inside the batch stay created or released.
+
+            with topology.batch():
+                a.index, b.index = b.index, a.index
+
+        Nested batches are part of the outermost batch. A batch holds the
+        topology's write lock until it ends.
+        """
+        with self.writing():
+            if self._batch is not None:
+                yield
+                return
+            self._batch = list()
+            changes = list()
+            try:
+                yield
+                for obj,setter,old in self._batch:
+                    if not obj._isReleased():
+                        obj._check_unique()
+            except:
+                self._rollback()
+                # Only the structural changes survive a rollback
+                changes = [c for c in self._pending_changes if c.kind not in Change.VALUES]
+                raise
+            else:
+                changes = self._pending_changes
+            finally:
+                self._batch = None
+                self._pending_changes = list()
+                # Errors raised by listeners replace the original exception
+                self._deliver_changes(changes)
+
+    def _journal(self,obj,setter,old):
+        """ Records a change to obj while a batch is open, so that it can be
+        undone by calling the raw setter with the old value.
+        """
+        if self._batch is not None:
+            self._batch.append((obj,setter,old))
+
+    def _rollback(self):
+        """ Undoes the changes recorded in the batch journal, newest first """
+        for obj,setter,old in reversed(self._batch):
+            if not obj._isReleased():
+                getattr(obj,setter)(old)
+
+    def _attach(self,index,obj,connection):
+        """ Lists a connection under a vertex or edge in an adjacency index """
+        connections = index.get(obj)
+        if connections is None:
+            index[obj] = [connection]
+        elif isinstance(connections,list):
+            if len(connections) < ADJACENCY_LIST_SIZE:
+                connections.append(connection)
+            else:
+                connections = index[obj] = dict([(c,next(self._attached)) for c in connections])
+                connections[connection] = next(self._attached)
+        else:
+            connections[connection] = next(self._attached)
+
+    def _detach(self,index,obj,connection):
+        """ Removes a connection from under a vertex or edge in an adjacency index """
+        connections = index[obj]
+        if isinstance(connections,list):
+            connections.remove(connection)
+        else:
+            del connections[connection]
+        if not connections:
+            del index[obj]
+
+    def _adjacent(self,index,obj):
+        """ returns the connections listed under a vertex or edge in an
+        adjacency index, in the order they were added
+        """
+        connections = index.get(obj)
+        if connections is None:
+            return list()
+        if isinstance(connections,list):
+            return list(connections)
+        return sorted(connections,key=connections.__getitem__)
+
+    def _cached(self,name,build):
+        """ Returns the cached read-only mapping for name, calling build() to 
+        regenerate its items if the topology has changed since it was made.
+        """
+        version,mapping = self._cache.get(name,(None,None))
+        if version != self._version:
+            mapping = FrozenDict(build())
+            self._cache[name] = (self._version,mapping)
+        return mapping
+
     @property
     def vertices(self):
         """ returns an unordered list of vertex objects in the topology """
-        return self._vertices
+        return list(self._vertices)
 
     @property 
     def edges(self):
         """ returns an unordered list of edge objects in the topology """
-        return self._edges
+        return list(self._edges)
 
     @property
     def blocks(self):
-        """ Returns dictionary of all blocks who have a proper index value assigned """
-        return dict(filter(lambda x: isinstance(x[0],int),[(v.block.index,v.block) for v in self._vertices]))
+        """ Returns dictionary of all blocks who have a proper index value assigned.
+        The dictionary iterates in index order. It is read-only, and is cached 
+        until the topology changes.
+        """
+        return self._cached("blocks", lambda: [(index,block) for index,block in self._block_index.items() if isinstance(index,int)])
 
     @property
     def bands(self):
         """ Returns dictionary of all bands, by altitude. Bands which have not
         been assigned altitudes are not reported. All bands that have an altitude
         (regardless of if they are being used (indicated by isUsed) are reported. 
+        The dictionary iterates in altitude order. It is read-only, and is cached
+        until the topology changes.
         """
-        allBands = [band for edge in self._edges for band in [edge.posBand,edge.negBand]]
-        if None is [band.altitude for band in allBands]:
-            logging.warning("WARNING: There are bands lacking altitude information! Not all bands are represented")
-        return dict([(band.altitude,band) for band in filter(lambda x: isinstance(x.altitude,int),allBands)])
+        allBands = lambda: self._neg_band_index.items() + self._pos_band_index.items()
+        return self._cached("bands", lambda: [(altitude,band) for altitude,band in allBands() if isinstance(altitude,int)])
 
     @property
     def snaps(self):
         """ Returns dictionary of all snaps, by snapkey. Snaps which have not been
         assigned an order are not reported. All snaps that have an order regardless
-        of if they are being used (indicated by isUsed) are reported. 
+        of if they are being used (indicated by isUsed) are reported. The 
+        dictionary is read-only, and is cached until the topology changes.
         """
+        return self._cached("snaps", self._snap_items)
+
+    def _snap_items(self):
         containers =  [container for block in [[v.block.emitter, v.block.collector] for v in self._vertices] for container in block]
-        snaps = [(snap.snapkey(),snap) for snaps in [container.values() for container in containers] for snap in snaps]
-        return dict(snaps)
+        return [(snap.snapkey(),snap) for snaps in [container.values() for container in containers] for snap in snaps]
 
     def __get_hide_disconnected_snaps(self):
         return self._hide_disconnected_snaps
     def __set_hide_disconnected_snaps(self, state):
         typecheck(state, bool, "state")
+        old = self._hide_disconnected_snaps
         self._hide_disconnected_snaps = state
+        self._changed("hide_disconnected_snaps",self,old,state)
     hide_disconnected_snaps = property(__get_hide_disconnected_snaps, __set_hide_disconnected_snaps)
 
 
 
 
+class Change(namedtuple("Change","kind obj old new")):
+    """ A record of a single change to a topology, passed to the topology's
+    listeners. kind is one of
+
+        "vertex_added", "vertex_released"   obj is the Vertex
+        "edge_added", "edge_released"       obj is the Edge
+        "connection_added",                 obj is the Source or Sink
+        "connection_released"
+        "index"                             obj is the Block
+        "altitude", "rank"                  obj is the Band
+        "order"                             obj is the Snap
+        "hide_disconnected_snaps"           obj is the Topology
+        "compacted"                         obj is the Topology
+
+    For value changes, old and new are the values before and after the 
+    change. A released vertex has its Block, and a released edge its
+    (positive, negative) Bands, as old. Connections have their (vertex, edge)
+    as new when added, and their (vertex, edge, snap) as old when released.
+    A compaction has its Remap (see diarc.compaction) as new, and follows the
+    records of the values it changed.
+    Released blocks, bands and snaps keep the last index, altitude, rank or
+    order they were given.
+
+    Records are made when a change is complete, but subclasses of Vertex, Edge,
+    Source and Sink may still be initializing when their "added" record is sent.
+    """
+    __slots__ = ()
+    VALUES = frozenset(["index","altitude","rank","order"])
+
+class ChangeLog(object):
+    """ Collects the changes made to a topology until they are drained.
+
+        log = ChangeLog(topology)
+        ...
+        for change in log.drain():
+            ...
+    """
+    def __init__(self,topology):
+        self._topology = typecheck(topology,Topology,"topology")
+        self._changes = list()
+        self._listener = self._changes.append
+        self._topology.add_listener(self._listener)
+
+    def drain(self):
+        """ returns the changes made since the last call, oldest first """
+        changes = self._changes[:]
+        del self._changes[:]
+        return changes
+
+    def dirty(self):
+        """ returns the set of objects changed since the last call to drain() """
+        return set([change.obj for change in self._changes])
+
+    def close(self):
+        """ Stops collecting changes """
+        self._topology.remove_listener(self._listener)
+
 class Vertex(object):
     """ A Vertex in a directional graph. 
     A vertex can connect to multiple edges as either an input (source) or output
@@ -121,11 +414,13 @@ class Vertex(object):
     Sources - outgoing connections to Edges
     Sinks - incomming connections from Edges
     """
+    __slots__ = ('_topology','_block')
     def __init__(self,topology):
         self._topology = typecheck(topology,Topology,"topology")
-        self._topology._vertices.append(self)
+        self._topology._vertices.add(self)
         # Visual Component
         self._block = Block(self)
+        self._topology._changed("vertex_added",self)
 
     def release(self):
         logging.debug("releasing vertex %r"%self)
@@ -139,13 +434,15 @@ class Vertex(object):
 
         # Release connections to and from the vertex
         logging.debug("... destroying connections")
-        for connection in  self._topology._sources + self._topology._sinks:
-            if connection.vertex == self:
-                connection.release()
+        t = self._topology
+        for connection in t._adjacent(t._vertex_sources,self) + t._adjacent(t._vertex_sinks,self):
+            connection.release()
         logging.debug("... releasing associated block")
         # Release the block object associated with this vertex 
+        block = self._block
         self._block._release()
         self._block = None
+        self._topology._changed("vertex_released",self,block,None)
         logging.debug("... destroying reference to topology")
         self._topology = None
 
@@ -154,14 +451,14 @@ class Vertex(object):
         """ Returns an unordered list of outgoing connections (Source objects)
         from this vertex.
         """
-        return filter(lambda x: x.vertex == self, self._topology._sources)
+        return self._topology._adjacent(self._topology._vertex_sources,self)
 
     @property
     def sinks(self):
         """ Returns an unordered list of outgoing connections (Sink objects)
         from this vertex.
         """
-        return filter(lambda x: x.vertex == self, self._topology._sinks)
+        return self._topology._adjacent(self._topology._vertex_sinks,self)
 
     @property
     def block(self):
@@ -178,23 +475,31 @@ class Edge(object):
     Sources - inputs from vertices
     Sinks - outputs to vertices
     """
+    __slots__ = ('_topology','_pBand','_nBand','_source_indices','_sink_indices')
     def __init__(self,topology):
         self._topology = typecheck(topology,Topology,"topology")
-        self._topology._edges.append(self)
+        self._topology._edges.add(self)
+        # Sorted block indices of the sources and sinks of this edge, used to
+        # find the extents of the edge without visiting every connection. An
+        # empty tuple stands in for an empty list until an index is added.
+        self._source_indices = ()
+        self._sink_indices = ()
         # Visual Component
         self._pBand = Band(self,True)
         self._nBand = Band(self,False)
+        self._topology._changed("edge_added",self)
 
     def release(self):
         """ Removes this edge from the topology """
         logging.debug("releasing edge %r"%self)
         # Release connections to and from this edge
         logging.debug("... destroying connections")
-        for connection in self._topology._sources + self._topology._sinks:
-            if connection.edge == self:
-                connection.release()
+        t = self._topology
+        for connection in t._adjacent(t._edge_sources,self) + t._adjacent(t._edge_sinks,self):
+            connection.release()
         # Release each of your bands
         logging.debug("... releasing associated bands")
+        bands = (self._pBand,self._nBand)
         self._pBand._release()
         self._nBand._release()
         # Remove references to your bands
@@ -203,23 +508,59 @@ class Edge(object):
         logging.debug("... removing from topology")
         # Release youself from the topology
         self._topology._edges.remove(self)
+        self._topology._changed("edge_released",self,bands,None)
         # Remove reference to the topology
         self._topology = None
 
     @property
     def sources(self):
         """ returns list of all source connections to this edge """
-        return filter(lambda x: x.edge == self, self._topology._sources)
+        return self._topology._adjacent(self._topology._edge_sources,self)
 
     @property
     def sinks(self):
         """ returns list of all sink connections from this edge """
-        return filter(lambda x: x.edge == self, self._topology._sinks)
+        return self._topology._adjacent(self._topology._edge_sinks,self)
 
     @property
     def posBand(self):
         return self._pBand
 
+    def _add_extent(self,connection,index):
+        """ Records the block index of a source or sink of this edge. Blocks
+        without an integer index do not contribute to the extents of the edge.
+        """
+        if not isinstance(index,int):
+            return
+        if isinstance(connection,Source):
+            if not self._source_indices:
+                self._source_indices = list()
+            bisect.insort(self._source_indices,index)
+        else:
+            if not self._sink_indices:
+                self._sink_indices = list()
+            bisect.insort(self._sink_indices,index)
+
+    def _remove_extent(self,connection,index):
+        """ Forgets the block index of a source or sink of this edge """
+        if not isinstance(index,int):
+            return
+        indices = self._source_indices if isinstance(connection,Source) else self._sink_indices
+        del indices[bisect.bisect_left(indices,index)]
+        if not indices:
+            if isinstance(connection,Source):
+                self._source_indices = ()
+            else:
+                self._sink_indices = ()
+
+    def _refresh_bands(self):
+        """ Recompute if each of the bands of this edge are being used. This 
+        must be called whenever a connection to this edge is added or removed,
+        or when the block index of a connected vertex changes.
+        """
+        self._pBand._refresh()
+        self._nBand._refresh()
+
     @property
     def negBand(self):
         return self._nBand
@@ -230,6 +571,7 @@ class Connection(object):
     class directly, Source or Sink objects should be used.
     
     """
+    __slots__ = ('_topology','_vertex','_edge','_snap')
     def __init__(self,topology,vertex,edge):
         self._topology = typecheck(topology,Topology,"topology")
         self._vertex = typecheck(vertex,Vertex,"vertex")
@@ -273,41 +615,74 @@ class Source(Connection):
     """ A logical connection from a Vertex to an Edge. Graphically represented 
     by a Snap object.
     """
+    __slots__ = ()
     def __init__(self,topology,vertex,edge):
         super(Source,self).__init__(topology,vertex,edge)
         # Check to make sure there is not already a source going from this vertex to this edge
-        for source in vertex.sources + edge.sources:
-            if vertex == source.vertex and edge == source.edge:
-                raise Exception("Duplicate Source!")
-        self._topology._sources.append(self)
+        if (vertex,edge) in self._topology._source_pairs:
+            raise Exception("Duplicate Source!")
+        self._topology._sources.add(self)
+        self._topology._source_pairs[(vertex,edge)] = self
+        self._topology._attach(self._topology._vertex_sources,vertex,self)
+        self._topology._attach(self._topology._edge_sources,edge,self)
+        edge._add_extent(self,vertex.block.index)
+        edge._refresh_bands()
+        self._topology._changed("connection_added",self,None,(vertex,edge))
 
     def release(self):
         logging.debug("Releasing Source %r"%self)
+        # Remove yourself from the adjacency indexes while the vertex and edge
+        # references are still available
+        edge = self._edge
+        vertex = self._vertex
+        del self._topology._source_pairs[(self._vertex,edge)]
+        self._topology._detach(self._topology._vertex_sources,vertex,self)
+        self._topology._detach(self._topology._edge_sources,edge,self)
+        edge._remove_extent(self,self._vertex.block.index)
+        snap = self._snap
         super(Source,self).release()
+        edge._refresh_bands()
         # Remove yourself from the topology
         logging.debug("... removing from topology")
         self._topology._sources.remove(self)
+        self._topology._changed("connection_released",self,(vertex,edge,snap),None)
         self._topology = None
 
 class Sink(Connection):
     """ A logical connection from an Edge to a Vertex. Graphically represented
     by a Snap object. 
     """
+    __slots__ = ()
     def __init__(self,topology,vertex,edge):
         super(Sink,self).__init__(topology,vertex,edge)
         # Check to make sure there is not already a sink going from this edge to this vertex
-        for sink in vertex.sinks + edge.sinks:
-            if vertex == sink.vertex and edge == sink.edge:
-                if vertex.location == sink.vertex.location:
-                    raise Exception("Duplicate Sink!")
-        self._topology._sinks.append(self)
+        if (vertex,edge) in self._topology._sink_pairs:
+            raise Exception("Duplicate Sink!")
+        self._topology._sinks.add(self)
+        self._topology._sink_pairs[(vertex,edge)] = self
+        self._topology._attach(self._topology._vertex_sinks,vertex,self)
+        self._topology._attach(self._topology._edge_sinks,edge,self)
+        edge._add_extent(self,vertex.block.index)
+        edge._refresh_bands()
+        self._topology._changed("connection_added",self,None,(vertex,edge))
 
     def release(self):
         logging.debug("Releasing Sink %r"%self)
+        # Remove yourself from the adjacency indexes while the vertex and edge
+        # references are still available
+        edge = self._edge
+        vertex = self._vertex
+        del self._topology._sink_pairs[(self._vertex,edge)]
+        self._topology._detach(self._topology._vertex_sinks,vertex,self)
+        self._topology._detach(self._topology._edge_sinks,edge,self)
+        edge._remove_extent(self,self._vertex.block.index)
+        snap = self._snap
         super(Sink,self).release()
+        edge._refresh_bands()
         # Remove youself from the topology
         logging.debug("... removing from topology")
         self._topology._sinks.remove(self)
+        self._topology._changed("connection_released",self,(vertex,edge,snap),None)
         self._topology = None
 
 
@@ -318,11 +693,17 @@ class Block(object):
             Lower values to the left, higher to the right. Indices do not 
             necessarily need to be consecutive.
     """
+    __slots__ = ('_vertex','_topology','_index','_emitters','_collectors')
     def __init__(self,vertex):
         self._vertex = typecheck(vertex,Vertex,"vertex")
         self._topology = vertex._topology
         # Visual Properties
         self._index = None
+        # Snaps in the emitter and collector that have been assigned an order,
+        # sorted by order, or None while there are none. These are maintained
+        # by Snap.order, see _snap_index()
+        self._emitters = None
+        self._collectors = None
         # blocks to left and right
 #         self._leftBlock = None
 #         self._rightBlock = None
@@ -343,6 +724,9 @@ class Block(object):
         # Remove cached references to left and right blocks
 #         self._leftBlock = None
 #         self._rightBlock = None
+        # Give up our index so that it no longer appears in the topology
+        if self._index is not None:
+            self._topology._block_index.remove(self._index,self)
         logging.debug("... remove reference to vertex")
         # We don't need to call release() on the vertex, it should already be
         # called, we just need to remove the reference
@@ -364,11 +748,12 @@ class Block(object):
         Only snaps which have been assigned an order value are represented, since
         the order is used as the dictionary key. If hide_disconnected_snaps is 
         set in the topology, only return snaps where isLinked() is true. 
+        The dictionary iterates in order.
         """
-        snaps = [(s.snap.order, s.snap) for s in self._vertex.sources if isinstance(s.snap.order, int)]
+        snaps = [(order, snap) for order,snap in self._emitter_index.items() if isinstance(order, int)]
         if self._topology.hide_disconnected_snaps:
             snaps = [tup for tup in snaps if tup[1].isLinked()]
-        return dict(snaps)
+        return OrderedDict(snaps)
 #         return dict(filter(lambda x: isinstance(x[0],int), [(s.snap.order, s.snap) for s in self._vertex.sources]))
 
     @property
@@ -377,44 +762,33 @@ class Block(object):
         Only snaps which have been assigned an order value are represented, since
         the order is used as the dictionary key. If hide_disconnected_snaps is 
         set in the topology, only return snaps where isLinked() is true. 
+        The dictionary iterates in order.
         """
-        snaps = [(s.snap.order, s.snap) for s in self._vertex.sinks if isinstance(s.snap.order, int)]
+        snaps = [(order, snap) for order,snap in self._collector_index.items() if isinstance(order, int)]
         if self._topology.hide_disconnected_snaps:
             snaps = [tup for tup in snaps if tup[1].isLinked()]
-        return dict(snaps)
+        return OrderedDict(snaps)
 #         return dict(filter(lambda x: isinstance(x[0],int),[(s.snap.order,s.snap) for s in self._vertex.sinks]))
 
     @property
     def leftBlock(self):
-#         """ Returns the block to the left, determined by block wich has the next
-#         lowest index value. This value is cached when the index is set.  
-#         """
-#         return self._leftBlock
+        """ Returns the block to the left, determined by block wich has the next
+        lowest index value. This is looked up in the topology's sorted index.
+        """
         if not isinstance(self._index,int):
             return None
-        blocks = self._topology.blocks
-        if len(blocks) == 0:
-            return None
-        if self._index > min(blocks.keys()):
-            return blocks[max([b for b in blocks.keys() if b < self._index])]
-        # Else
-        return None
+        index = self._topology._block_index.lower(self._index)
+        return self._topology._block_index[index] if index is not None else None
 
     @property
     def rightBlock(self):
-#         """ returns the block to the right, determined by block which has the next
-#         highest index value. This  value is cached when the index is set. 
-#         """
-#         return self._rightBlock
+        """ returns the block to the right, determined by block which has the next
+        highest index value. This is looked up in the topology's sorted index.
+        """
         if not isinstance(self._index,int):
             return None
-        blocks = self._topology.blocks
-        if len(blocks) == 0:
-            return None
-        if self._index < max(blocks.keys()):
-            return blocks[min([b for b in blocks.keys() if b > self._index])]
-        # Else:
-        return None
+        index = self._topology._block_index.higher(self._index)
+        return self._topology._block_index[index] if index is not None else None
 
 
 
@@ -465,16 +839,71 @@ class Block(object):
         """ Check to see if a block with the same index already exists """
         if self._index == value:
             return
-        if isinstance(value,types.NoneType):
-            self._index = value
-#             self._updateNeighbors()
-            return
-        allVertices = self._topology._vertices
-        allBlocks = [v.block for v in allVertices]
-        if value in [b.index for b in allBlocks]:
+        if self._topology._batch is None and (not isinstance(value,types.NoneType)) and value in self._topology._block_index:
             raise Exception("Block with index %r already exists!"%value)
+        self._topology._journal(self,"_set_index",self._index)
+        self._set_index(value)
+
+    def _set_index(self,value):
+        """ Moves this block to its new position in the topology's sorted index """
+        index = self._topology._block_index
+        if self._index is not None:
+            index.remove(self._index,self)
+        if value is not None:
+            index.insert(value,self,self._topology._batch is not None)
+        t = self._topology
+        for connection in t._adjacent(t._vertex_sources,self._vertex) + t._adjacent(t._vertex_sinks,self._vertex):
+            connection.edge._remove_extent(connection,self._index)
+            connection.edge._add_extent(connection,value)
+        old = self._index
         self._index = value
 #         self._updateNeighbors()
+        self._refresh_bands()
+        self._topology._changed("index",self,old,value)
+
+    def _snap_index(self,emitter,create=False):
+        """ returns the order index of the emitter (or collector) of this block.
+        An index is only created once one of its snaps is given an order, and
+        create is true, and is dropped again by _prune_snap_index() once it is
+        empty, so that blocks without ordered snaps do not hold empty indexes.
+        Until then, a shared empty index is returned, which must not be changed.
+        """
+        index = self._emitters if emitter else self._collectors
+        if index is None:
+            if not create:
+                return _NO_SNAPS
+            index = SortedIndex()
+            if emitter:
+                self._emitters = index
+            else:
+                self._collectors = index
+        return index
+
+    def _prune_snap_index(self,emitter):
+        """ Drops the order index of the emitter (or collector) if it is empty """
+        if emitter and self._emitters is not None and len(self._emitters) == 0:
+            self._emitters = None
+        elif not emitter and self._collectors is not None and len(self._collectors) == 0:
+            self._collectors = None
+
+    _emitter_index = property(lambda self: self._snap_index(True))
+    _collector_index = property(lambda self: self._snap_index(False))
+
+    def _check_unique(self):
+        """ Raises an exception if another block shares this block's index """
+        if self._index is not None and self._topology._block_index.count(self._index) > 1:
+            raise Exception("Block with index %r already exists!"%self._index)
+
+    def _isReleased(self):
+        return self._vertex is None
+
+    def _refresh_bands(self):
+        """ Changing the index of this block can change which bands are used
+        by the edges connected to it.
+        """
+        t = self._topology
+        for connection in t._adjacent(t._vertex_sources,self._vertex) + t._adjacent(t._vertex_sinks,self._vertex):
+            connection.edge._refresh_bands()
 
     index = property(__get_index,__set_index)
 
@@ -485,6 +914,7 @@ class Band(object):
     Rank - the Z drawing order (higher values closer to user)
     Altitude - the distance above or below the Block ribbon
     """
+    __slots__ = ('_edge','_topology','_isPositive','_altitude','_rank','_used')
     def __init__(self,edge,isPositive):
         self._edge = typecheck(edge,Edge,"edge")
         self._topology = edge._topology
@@ -492,10 +922,20 @@ class Band(object):
         self._isPositive = isPositive
         self._altitude = None
         self._rank = None
+        # If this band is listed in the topology's index of used bands
+        self._used = False
 
     def _release(self):
         """ Release all dependent references this object holds """
         logging.debug("removing band %r"%self)
+        # Give up our altitude so that it no longer appears in the topology
+        if self._used:
+            self._used_index().remove(self._altitude,self)
+            self._used = False
+        if self._altitude is not None:
+            self._band_index().remove(self._altitude,self)
+        if self._rank is not None:
+            self._band_ranks().remove(self._rank,self)
         logging.debug("... removing edge reference")
         self._edge = None
         logging.debug("... removing reference to topology")
@@ -507,36 +947,34 @@ class Band(object):
         """ returns a list of source snaps that reach this band """
         # We compare the position of each source against the position of the furthest
         # away sink (depending on pos/neg altitude).
-        sinkBlockIndices = [s.block.index for s in self.edge.sinks]
-        sinkBlockIndices = filter(lambda x: isinstance(x,int), sinkBlockIndices)
+        sinkBlockIndices = self._edge._sink_indices
         if len(sinkBlockIndices) < 1:
             return list()
         sources = list()
         # Find Sources if this is a  Positive Bands
         if self._altitude and self._altitude > 0:
-            maxSinkIndex = max(sinkBlockIndices)
+            maxSinkIndex = sinkBlockIndices[-1]
             sources = filter(lambda src: src.block.index < maxSinkIndex, self.edge.sources)
         # Find Sources if this is a  Negative Bands
         elif self._altitude and self._altitude < 0:
-            minSinkIndex = min(sinkBlockIndices)
+            minSinkIndex = sinkBlockIndices[0]
             sources = filter(lambda src: src.block.index >= minSinkIndex, self.edge.sources)
         return [s.snap for s in sources]
 
     @property
     def collectors(self):
         """ returns list of sink snaps that reach this band """
-        sourceBlockIndices = [s.block.index for s in self.edge.sources]
-        sourceBlockIndices = filter(lambda x: isinstance(x,int), sourceBlockIndices)
+        sourceBlockIndices = self._edge._source_indices
         if len(sourceBlockIndices) < 1:
             return list()
         sinks = list()
         # Find Sinks if this is a  Positive Bands
         if self._altitude and self._altitude > 0:
-            minSourceIndex = min(sourceBlockIndices)
+            minSourceIndex = sourceBlockIndices[0]
             sinks = filter(lambda sink: sink.block.index > minSourceIndex, self.edge.sinks)
         # Find Sinks if this is a  Negative Bands
         elif self._altitude and self._altitude < 0:
-            maxSourceIndex = max(sourceBlockIndices)
+            maxSourceIndex = sourceBlockIndices[-1]
             sinks = filter(lambda sink: sink.block.index <= maxSourceIndex, self.edge.sinks)
         return [s.snap for s in sinks]
 
@@ -545,21 +983,55 @@ class Band(object):
         its edge, else false. This is determined by checking if any sources
         reach this band.
         """
-        # This should be equivalent to checking if any sinks reach this band,
-        # but this has not been tested or proven. 
-#         sinkBlockIndices = [s.block.index for s in self.edge.sinks if isinstance(s.block.index,int)]
-#         sourceBlockIndices = [s.block.index for s in self.edge.sources if isinstance(s.block.index,int)]
-        sinkBlockIndices = [s.block.index for s in self.collectors]
-        sourceBlockIndices = [s.block.index for s in self.emitters]
-        if len(sinkBlockIndices) == 0 or len(sourceBlockIndices) == 0:
+        # A positive band is used when some source is to the left of some sink,
+        # and a negative band when some sink is at or to the left of some source.
+        # Both only need the extents of the edge, which it keeps sorted.
+        sourceBlockIndices = self._edge._source_indices
+        sinkBlockIndices = self._edge._sink_indices
+        if not self._altitude or len(sinkBlockIndices) == 0 or len(sourceBlockIndices) == 0:
             return False
-        # If positive and there is a sink to the left of any source
-        if self._isPositive and max(sinkBlockIndices) > min(sourceBlockIndices):
-            return True
-        elif (not self._isPositive) and min(sinkBlockIndices) <= max(sourceBlockIndices):
-            return True
+        if self._altitude > 0:
+            return sourceBlockIndices[0] < sinkBlockIndices[-1]
         else:
-            return False
+            return sourceBlockIndices[-1] >= sinkBlockIndices[0]
+
+    def _check_unique(self):
+        """ Raises an exception if another band on the same side shares this
+        band's altitude or rank
+        """
+        if self._altitude is not None and self._band_index().count(self._altitude) > 1:
+            raise Exception("Band with altitude %d already exists!"%self._altitude)
+        if self._rank is not None and self._band_ranks().count(self._rank) > 1:
+            raise Exception("%s Band with rank %d already exists!"%("Positive" if self._isPositive else "Negative",self._rank))
+
+    def _isReleased(self):
+        return self._edge is None
+
+    def _band_index(self):
+        """ returns the topology's index of bands on the same side as this one """
+        return self._topology._pos_band_index if self._isPositive else self._topology._neg_band_index
+
+    def _band_ranks(self):
+        """ returns the topology's registry of ranks on the same side as this band """
+        return self._topology._pos_band_ranks if self._isPositive else self._topology._neg_band_ranks
+
+    def _used_index(self):
+        """ returns the topology's index of used bands on the same side as this one """
+        return self._topology._pos_used_band_index if self._isPositive else self._topology._neg_used_band_index
+
+    def _refresh(self):
+        """ Recompute isUsed() and add or remove this band from the topology's
+        index of used bands accordingly. Bands without an altitude are never
+        listed.
+        """
+        used = self._altitude is not None and self.isUsed()
+        if used == self._used:
+            return
+        if used:
+            self._used_index().insert(self._altitude,self,self._topology._batch is not None)
+        else:
+            self._used_index().remove(self._altitude,self)
+        self._used = used
 
     @property
     def isPositive(self):
@@ -573,14 +1045,9 @@ class Band(object):
         """
         if not isinstance(self._altitude,int):
             return None
-        bands = self._topology.bands
-        available = [altitude for altitude in bands.keys() if altitude > self._altitude]
-        if self._isPositive:
-            # TODO: we probably dont need band._isPositive if altitude > self._altitude
-            available = [altitude for altitude in available if bands[altitude]._isPositive and bands[altitude].isUsed()]
-        else: 
-            available = [altitude for altitude in available if (not bands[altitude]._isPositive) and bands[altitude].isUsed()]
-        return bands[min(available)] if len(available) > 0 else None
+        used = self._used_index()
+        altitude = used.higher(self._altitude)
+        return used[altitude] if altitude is not None else None
 
 #         posMax = max([band.altitude for band in bands.values() if band.isUsed()])
 #         negVals = [altitude for altitude in bands.keys() if altitude < 0]
@@ -597,13 +1064,9 @@ class Band(object):
         """
         if not isinstance(self._altitude,int):
             return None
-        bands = self._topology.bands
-        available = [altitude for altitude in bands.keys() if altitude < self._altitude]
-        if self._isPositive:
-            available = [altitude for altitude in available if bands[altitude]._isPositive and bands[altitude].isUsed()]
-        else:
-            available = [altitude for altitude in available if (not bands[altitude]._isPositive) and bands[altitude].isUsed()]
-        return bands[max(available)] if len(available) > 0 else None
+        used = self._used_index()
+        altitude = used.lower(self._altitude)
+        return used[altitude] if altitude is not None else None
 
 #         posVals = [altitude for altitude in bands.keys() if altitude > 0]
 #         posMin = min(posVals) if len(posVals) > 0 else 0
@@ -620,16 +1083,28 @@ class Band(object):
         if self._rank == val: return
         # Allow "unsetting" rank
         if val is None:
-            self._rank = val
+            self._topology._journal(self,"_set_rank",self._rank)
+            self._set_rank(val)
             return
         typecheck(val,int,"val")
         if val < 0:
             raise Exception("Rank must be >= 0, received %d"%val)
         # Make sure the rank is unique among all bands of the same altitude
-        allBands = [edge.posBand if self.isPositive else edge.negBand for edge in self._topology._edges]
-        if val in [b._rank for b in allBands]:
+        if self._topology._batch is None and val in self._band_ranks():
             raise Exception("%s Band with rank %d already exists!"%("Positive" if self._isPositive else "Negative",val))
+        self._topology._journal(self,"_set_rank",self._rank)
+        self._set_rank(val)
+
+    def _set_rank(self,val):
+        """ Moves this band to its new rank in the topology's registry """
+        ranks = self._band_ranks()
+        if self._rank is not None:
+            ranks.remove(self._rank,self)
+        if val is not None:
+            ranks.insert(val,self,self._topology._batch is not None)
+        old = self._rank
         self._rank = val
+        self._topology._changed("rank",self,old,val)
     
     def __get_altitude(self):
         return self._altitude
@@ -638,18 +1113,33 @@ class Band(object):
             return
         # Always allow "unsetting" value
         if value is None:
-            self._altitude = value
+            self._topology._journal(self,"_set_altitude",self._altitude)
+            self._set_altitude(value)
             return
         if self._isPositive and value <= 0:
             raise Exception("Altitude must be positive")
         if (not self._isPositive) and value >= 0:
             raise Exception("Altitude must be negative")
-        # Make sure the altitude is unique among all bands 
-        allEdges = self._topology._edges
-        allBands = filter(lambda x: isinstance(x,Band),[band for edge in allEdges for band in [edge.posBand,edge.negBand]])
-        if value in [b.altitude for b in allBands]:
+        # Make sure the altitude is unique among all bands. Since the sign is 
+        # checked above, only bands on the same side can conflict.
+        if self._topology._batch is None and value in self._band_index():
             raise Exception("Band with altitude %d already exists!"%value)
+        self._topology._journal(self,"_set_altitude",self._altitude)
+        self._set_altitude(value)
+
+    def _set_altitude(self,value):
+        """ Moves this band to its new altitude in the topology's indexes """
+        if self._used:
+            self._used_index().remove(self._altitude,self)
+            self._used = False
+        if self._altitude is not None:
+            self._band_index().remove(self._altitude,self)
+        if value is not None:
+            self._band_index().insert(value,self,self._topology._batch is not None)
+        old = self._altitude
         self._altitude = value
+        self._refresh()
+        self._topology._changed("altitude",self,old,value)
 
     edge = property(__get_edge)
     rank = property(__get_rank,__set_rank)
@@ -662,6 +1152,7 @@ class Snap(object):
     Visual Layout Paramters
     Order - 0-indexed order in which to draw snaps within an Emitter or Collector 
     """
+    __slots__ = ('_connection','_order')
     def __init__(self,connection):
         self._connection = typecheck(connection,Connection,"connection")
         self._order = None
@@ -673,6 +1164,10 @@ class Snap(object):
     def _release(self):
         """ This should only be called by a Connection.release() """
         logging.debug("releasing snap %r"%self)
+        # Give up our order so that it no longer appears in the emitter or collector
+        if self._order is not None:
+            self._container_index().remove(self._order,self)
+            self.block._prune_snap_index(self.isSource())
         # the connection should 
         logging.debug("... removing reference to connection")
         self._connection = None
@@ -710,6 +1205,14 @@ class Snap(object):
     def isSink(self):
         return isinstance(self._connection,Sink)
 
+    def _container_index(self,create=False):
+        """ returns the order index of the emitter or collector holding this snap """
+        return self.block._snap_index(self.isSource(),create)
+
+    def _isShown(self):
+        """ returns true if this snap appears in its emitter or collector """
+        return self.isLinked() or not self._connection._topology.hide_disconnected_snaps
+
     def isLinked(self):
         """ returns true if this snap is connected to at least one sink, else false. """
         return True if self.posBandLink or self.negBandLink else False
@@ -728,22 +1231,26 @@ class Snap(object):
         """ Returns the snap directly to the left of this snap within either an 
         emitter or collector. Returns None if this is leftmost snap. 
         """
-        snaps = self.block.emitter if self.isSource() else self.block.collector
-        if isinstance(self._order,int) and self._order > min(snaps.keys()):
-            return snaps[max([s for s in snaps.keys() if s < self._order])]
-        else:
+        if not isinstance(self._order,int):
             return None
+        index = self._container_index()
+        order = index.lower(self._order)
+        while order is not None and not (isinstance(order,int) and index[order]._isShown()):
+            order = index.lower(order)
+        return index[order] if order is not None else None
 
     @property
     def rightSnap(self):
         """ Returns the snap directly to the right of this snap within either 
         an emitter or collector. Returns None if this is rightmost snap.
         """
-        snaps = self.block.emitter if self.isSource() else self.block.collector
-        if isinstance(self._order,int) and self._order < max(snaps.keys()):
-            return snaps[min([s for s in snaps.keys() if s > self._order])]
-        else:
+        if not isinstance(self._order,int):
             return None
+        index = self._container_index()
+        order = index.higher(self._order)
+        while order is not None and not (isinstance(order,int) and index[order]._isShown()):
+            order = index.higher(order)
+        return index[order] if order is not None else None
 
     def __get_order(self):
         return self._order
@@ -751,21 +1258,40 @@ class Snap(object):
         """ Check to see if a snap with the same order already exists """
         if self._order == value:
             return
+        topology = self._connection._topology
         # Always allow "unsetting values"
         if value is None:
-            self._order = value
+            topology._journal(self,"_set_order",self._order)
+            self._set_order(value)
             return
-        snaps = list()
         # Check to see if the order value exists in this emitter or collector
-        if isinstance(self._connection,Source):
-            snaps = [e.snap for e in self._connection.vertex.sources]
-        if isinstance(self._connection,Sink):
-            snaps = [e.snap for e in self._connection.vertex.sinks]
-        orders = filter(lambda x: not isinstance(x,types.NoneType),[s.order for s in snaps])
-        if value in orders:
+        if topology._batch is None and value in self._container_index():
             raise Exception("Order value %d already exists!"%value)
         # Update value
+        topology._journal(self,"_set_order",self._order)
+        self._set_order(value)
+
+    def _set_order(self,value):
+        """ Moves this snap to its new order in the emitter or collector index """
+        index = self._container_index(create=True)
+        if self._order is not None:
+            index.remove(self._order,self)
+        if value is not None:
+            index.insert(value,self,self._connection._topology._batch is not None)
+        self.block._prune_snap_index(self.isSource())
+        old = self._order
         self._order = value
+        self._connection._topology._changed("order",self,old,value)
+
+    def _check_unique(self):
+        """ Raises an exception if another snap in the same emitter or
+        collector shares this snap's order
+        """
+        if self._order is not None and self._container_index().count(self._order) > 1:
+            raise Exception("Order value %d already exists!"%self._order)
+
+    def _isReleased(self):
+        return self._connection is None
 
     order = property(__get_order,__set_order)
  
@@ -13,6 +13,10 @@
 # limitations under the License.
 
 import types
+import bisect
+import thread
+import threading
+from contextlib import contextmanager
 
 class TypedDict(dict):
     def __init__(self,_keyType,_objType):
@@ -49,7 +53,269 @@ class TypedList(list):
         typecheck(val,self._type,"val")
         super(TypedList,self).__setitem__(key,val)
 
+class FrozenDict(dict):
+    """ A dictionary which cannot be modified once it has been created. Keys
+    are iterated in the order they were given.
+    """
+    def __init__(self,items):
+        items = list(items)
+        super(FrozenDict,self).__init__(items)
+        self._keys = [key for key,val in items]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [dict.__getitem__(self,key) for key in self._keys]
+
+    def items(self):
+        return [(key,dict.__getitem__(self,key)) for key in self._keys]
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def _readonly(self,*args,**kwargs):
+        raise TypeError("FrozenDict cannot be modified")
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+
+class TypedSet(set):
+    def __init__(self,_type):
+        super(TypedSet,self).__init__()
+        typecheck(_type,type,"_type")
+        self._type = _type
+
+    def add(self,val):
+        typecheck(val,self._type,"val")
+        super(TypedSet,self).add(val)
+
+
+class TypedOrderedSet(object):
+    """ A set which iterates in the order values were added. Values are added
+    and removed in constant time: a removed value leaves a hole in the list
+    of values, which is closed up once half of the list is holes.
+    """
+    __slots__ = ('_type','_items','_positions')
+    def __init__(self,_type):
+        typecheck(_type,type,"_type")
+        self._type = _type
+        self._items = list()
+        self._positions = dict()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self,val):
+        return val in self._positions
+
+    def __iter__(self):
+        return (val for val in self._items if val is not None)
+
+    def add(self,val):
+        typecheck(val,self._type,"val")
+        if val not in self._positions:
+            self._positions[val] = len(self._items)
+            self._items.append(val)
+
+    def extend(self,vals):
+        """ adds values which are known to be of the right type and not in
+        the set yet, without checking them
+        """
+        start = len(self._items)
+        self._items.extend(vals)
+        self._positions.update(zip(vals,xrange(start,len(self._items))))
+
+    def remove(self,val):
+        self._items[self._positions.pop(val)] = None
+        if len(self._items) > 2*len(self._positions):
+            self._items = [v for v in self._items if v is not None]
+            self._positions = dict(zip(self._items,xrange(len(self._items))))
+
+
+class SortedIndex(object):
+    """ Maps unique keys to objects while keeping the keys in sorted order.
+    Neighboring keys are found using a binary search, and ordered iteration
+    does not require sorting.
+
+    Keys may temporarily be shared by several objects when inserted with 
+    duplicate=True (see Topology.batch()). Lookups then return the object 
+    that was inserted first.
+    """
+    __slots__ = ('_keys','_objs','_extra')
+    def __init__(self):
+        self._keys = list()
+        self._objs = dict()
+        # Additional objects for keys that are shared by more than one object,
+        # or None while there are none
+        self._extra = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._objs
+
+    def __getitem__(self, key):
+        return self._objs[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        """ returns a sorted list of keys """
+        return list(self._keys)
+
+    def values(self):
+        """ returns a list of objects, sorted by key """
+        return [self._objs[key] for key in self._keys]
+
+    def items(self):
+        """ returns a list of (key, object) tuples, sorted by key """
+        return [(key, self._objs[key]) for key in self._keys]
+
+    def insert(self, key, obj, duplicate=False):
+        if key in self._objs:
+            if not duplicate:
+                raise KeyError("Key %r already exists!"%key)
+            if self._extra is None:
+                self._extra = dict()
+            self._extra.setdefault(key, list()).append(obj)
+            return
+        bisect.insort(self._keys, key)
+        self._objs[key] = obj
+
+    def remove(self, key, obj=None):
+        """ removes key, or just obj if key is shared by several objects """
+        extra = self._extra.get(key) if self._extra is not None else None
+        if extra:
+            if obj is not None and obj is not self._objs[key]:
+                extra.remove(obj)
+            else:
+                self._objs[key] = extra.pop(0)
+            if not extra:
+                del self._extra[key]
+                if not self._extra:
+                    self._extra = None
+            return
+        del self._objs[key]
+        del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def count(self, key):
+        """ returns the number of objects that have key """
+        if key not in self._objs:
+            return 0
+        return 1 + (len(self._extra.get(key, ())) if self._extra is not None else 0)
+
+    def lower(self, key):
+        """ returns the largest key less than key, or None """
+        pos = bisect.bisect_left(self._keys, key)
+        return self._keys[pos-1] if pos > 0 else None
+
+    def higher(self, key):
+        """ returns the smallest key greater than key, or None """
+        pos = bisect.bisect_right(self._keys, key)
+        return self._keys[pos] if pos < len(self._keys) else None
+
+    def min(self):
+        return self._keys[0] if self._keys else None
+
+    def max(self):
+        return self._keys[-1] if self._keys else None
+
+
+def nextFreeOrder(index):
+    """ returns the key after the largest key of a SortedIndex, or 0 if it is
+    empty, such as the next available snap order in an emitter or collector
+    """
+    return index.max()+1 if len(index) > 0 else 0
+
  
+class ReadWriteLock(object):
+    """ Lets any number of threads read at the same time, or one thread write.
+    Threads waiting to write keep new readers out, so that writers are not
+    starved. Both locks are reentrant, and the writing thread may also read,
+    but a thread that is only reading cannot start writing.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # Number of read locks held by each thread
+        self._readers = dict()
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = thread.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers > 0:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = thread.get_ident()
+        with self._cond:
+            self._readers[me] -= 1
+            if self._readers[me] == 0:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = thread.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writes += 1
+                return
+            if me in self._readers:
+                raise Exception("Cannot write while holding a read lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or len(self._readers) > 0:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writes -= 1
+            if self._writes == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
 def typecheck(obj,objtype,varname=None):
     """ Checks the type of obj against class objtype, optionally pass in a varname for debug purposes.  """
     var = varname or ""
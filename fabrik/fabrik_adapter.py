@@ -17,6 +17,8 @@ from diarc.view import BlockItemAttributes
 from diarc.view import BandItemAttributes
 from diarc.view import SnapItemAttributes
 from diarc.base_adapter import BaseAdapter
+from diarc.adapter import reads_topology
+from diarc.adapter import writes_topology
 from fabrik_topology import *
 import sys
 import logging
@@ -42,6 +44,7 @@ class FabrikAdapter(BaseAdapter):
 
         self._color_mapper = ColorMapper()
 
+    @reads_topology
     def get_block_item_attributes(self, block_index):
         """ Default method for providing some stock settings for blocks """
         block = self._topology.blocks[block_index]
@@ -67,6 +70,7 @@ class FabrikAdapter(BaseAdapter):
         attrs.spacerwidth = 20
         return attrs
 
+    @reads_topology
     def get_band_item_attributes(self, band_altitude):
         """ Default method for providing some stock settings for bands """
         band = self._topology.bands[band_altitude]
@@ -78,6 +82,7 @@ class FabrikAdapter(BaseAdapter):
         attrs.width = 15
         return attrs
 
+    @reads_topology
     def get_snap_item_attributes(self, snapkey):
         """ Default method for providing some stock settings for snaps """
         snap = self._topology.snaps[snapkey]
@@ -97,6 +102,7 @@ class FabrikAdapter(BaseAdapter):
         attrs.width = 20
         return attrs
 
+    @reads_topology
     def get_hook_item_attributes(self, hooklabel):
         """Default method for providing some stock settings for hooks"""
         hook = self._topology.hooks[hooklabel]
@@ -106,6 +112,7 @@ class FabrikAdapter(BaseAdapter):
         attrs.label = str(hook._routing_keys)
         return attrs
 
+    @reads_topology
     def get_flow_item_attributes(self, flowlabel):
         """Default method for providing some stock settings for flows"""
         flow = self._topology.flows[flowlabel]
@@ -162,6 +169,7 @@ class FabrikAdapter(BaseAdapter):
         blocks[srcIdx].index = lastIdx
         return True
 
+    @writes_topology
     def flow_arrangement_enforcer(self):
         """Forces an acceptable order of blocks to permit drawing of flows"""
         blocks = self._topology.blocks
@@ -206,10 +214,15 @@ class FabrikAdapter(BaseAdapter):
         blocks = self._topology.blocks
 
     def reorder_blocks(self,srcIdx,lowerIdx,upperIdx):
-        if self.reorder_blocks_no_update(srcIdx, lowerIdx, upperIdx):
-            self.flow_arrangement_enforcer()
+        # Moving the block and restoring the flow arrangement are one change
+        with self._topology.batch():
+            moved = self.reorder_blocks_no_update(srcIdx, lowerIdx, upperIdx)
+            if moved:
+                self.flow_arrangement_enforcer()
+        if moved:
             self._update_view()
 
+    @reads_topology
     def _update_view(self):
         """ updates the view - compute each items neigbors and then calls linking. """
 
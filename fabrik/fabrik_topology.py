@@ -33,6 +33,7 @@
 #
 
 from diarc.topology import *
+from diarc.util import nextFreeOrder
 import logging
 import hooklabel
 import flowlabel
@@ -84,15 +85,16 @@ class FabrikGraph(Topology):
 
     def nextFreeNodeIndex(self):
         """ returns the next available node index """
-        return max(self.blocks.keys())+1 if len(self.blocks) > 0 else 0
+        return self._block_index.max()+1 if len(self._block_index) > 0 else 0
 
     def nextFreeAltitude(self):
         '''returns the next available band altitude'''
-        altitudes = [band.altitude for band in self.bands.values()] + [0]
-        return max(altitudes)+1
+        altitude = self._pos_band_index.max() if len(self._pos_band_index) > 0 else 0
+        return altitude+1
 
 class FabrikBlock(Block):
     '''A subclass of the Block: a visual representation of a Vertex '''
+    __slots__ = ('_node',)
     def __init__(self, vertex):
         super(FabrikBlock, self).__init__(vertex)
         self._node = vertex
@@ -138,6 +140,7 @@ class FabrikBlock(Block):
     
 class Node(Vertex):
     '''Subclass of Vertex, in which we track more Fabrik-related things'''
+    __slots__ = ('name', 'location', 'nodeType')
     def __init__(self, fg):
         typecheck(fg, FabrikGraph, "fg")
         super(Node, self).__init__(fg)
@@ -176,6 +179,7 @@ class Node(Vertex):
 
 class Queue(Node):
     '''A node representation of a RabbitMQ queue, in the Fabrik system'''
+    __slots__ = ()
     def __init__(self, fg, name=None):
         typecheck(fg, FabrikGraph, "fg")
         super(Queue, self).__init__(fg)
@@ -185,6 +189,7 @@ class Queue(Node):
 
 class ServiceBuddy(Node):
     '''A node representation of a Fabrik service buddy'''
+    __slots__ = ()
     def __init__(self, fg, name=None):
         typecheck(fg, FabrikGraph, "fg")
         super(ServiceBuddy, self).__init__(fg)
@@ -194,6 +199,7 @@ class ServiceBuddy(Node):
 
 class Wormhole(Node):
     '''A node representation of a connection to another vhost in the Fabrik system'''
+    __slots__ = ()
     def __init__(self, fg, name=None):
         typecheck(fg, FabrikGraph, "fg")
         super(Wormhole, self).__init__(fg)
@@ -203,6 +209,7 @@ class Wormhole(Node):
 
 class Latch(Node):
     '''A node placeholder for a transfer; see Transfer'''
+    __slots__ = ()
     def __init__(self, fg, name=None):
         typecheck(fg, FabrikGraph, "fg")
         super(Latch, self).__init__(fg)
@@ -212,6 +219,7 @@ class Latch(Node):
 
 class FabrikEdge(Edge):
     '''A Fabrik subclass of an Edge, in which we track useful things'''
+    __slots__ = ()
     def __init__(self, topology):
         super(FabrikEdge, self).__init__(topology)
 
@@ -222,6 +230,7 @@ class FabrikEdge(Edge):
 
 class Exchange(FabrikEdge):
     '''It's unclear why I didn't just collapse this and FabrikEdge. Oops.'''
+    __slots__ = ('name',)
     def __init__(self, fg, name=None):
         typecheck(fg, FabrikGraph, "fg")
         super(Exchange, self).__init__(fg)
@@ -258,6 +267,7 @@ class Exchange(FabrikEdge):
 
 class FabrikBand(Band):
     '''A Fabrik variant of a Band, the visual representation of an Exchange'''
+    __slots__ = ()
     def __init__(self, edge, isPositive):
         super(FabrikBand, self).__init__(edge, isPositive)
 
@@ -294,14 +304,14 @@ class FabrikBand(Band):
             return list()
 
 class Producer(Source):
+    __slots__ = ('bandwidth', 'routingKeys')
     def __init__(self, fg, node, exchange, routingKeys=None):
         typecheck(fg, FabrikGraph, "fg")
         typecheck(node, Node, "node")
         typecheck(exchange, Exchange, "exchange")
         super(Producer, self).__init__(fg, node, exchange)
-        # Dumb placement
-        self.snap.order = max(filter(lambda x: isinstance(x, int),
-                                     [prod.snap.order for prod in node.producers] + [-1]))+1
+        # Dumb placement - just get the next free order
+        self.snap.order = nextFreeOrder(node.block._emitter_index)
 
         self.bandwidth = None
         self.routingKeys = routingKeys
@@ -322,15 +332,15 @@ class Producer(Source):
         return self.vertex
 
 class Consumer(Sink):
+    __slots__ = ('bandwidth', 'routingKeys')
     def __init__(self, fg, node, exchange, routingKeys=None):
         typecheck(fg, FabrikGraph, "fg")
         typecheck(node, Node, "node")
         typecheck(exchange, Exchange, "topic")
         super(Consumer, self).__init__(fg, node, exchange)
 
-        # Dumb placement
-        self.snap.order = max(filter(lambda x: isinstance(x, int),
-                                     [con.snap.order for con in node.consumers] + [-1]))+1
+        # Dumb placement - just get the next free order
+        self.snap.order = nextFreeOrder(node.block._collector_index)
 
         self.bandwidth = None
         self.routingKeys = routingKeys
@@ -353,6 +363,7 @@ class Consumer(Sink):
 class Feed(object):
     """An object that represents messages flowing from a node to another node;
     Seen, for example, from a queue to a serivce buddy"""
+    __slots__ = ('_topology', '_origin', '_dest', '_flow', '_routingKeys')
     def __init__(self, fg, node_origin, node_dest, routingKeys=None):
         self._topology = typecheck(fg, FabrikGraph, "fg")
         self._origin = typecheck(node_origin, Node, "origin")
@@ -385,6 +396,7 @@ class Feed(object):
 
 class Transfer(object):
     """An object that represents messages flowing from one exchange to another"""
+    __slots__ = ('_topology', '_origin', '_dest', '_hook', '_hook_label', '_routingKeys', '_latch')
     def __init__(self, fg, exchange_origin, exchange_dest, routingKeys=None):
         self._topology = typecheck(fg, FabrikGraph, "fg")
         self._origin = typecheck(exchange_origin, Exchange, "origin")
@@ -423,6 +435,7 @@ class Transfer(object):
 
 class Hook(object):
     """Visual representation of a transfer"""
+    __slots__ = ('_transfer', '_order', '_routing_keys')
     def __init__(self, transfer, routing_keys=None):
         self._transfer = typecheck(transfer, Transfer, "transfer")
         self._order = None
@@ -454,6 +467,7 @@ class Hook(object):
 
 class Flow(object):
     """Visual representation of a feed"""
+    __slots__ = ('_feed', '_order', '_routing_keys')
     def __init__(self, feed, routing_keys=None):
         self._feed = typecheck(feed, Feed, "feed")
         self._order = None
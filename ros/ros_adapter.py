@@ -14,9 +14,12 @@
 
 import rosgraph
 import rosnode
+import socket
 QUIET_NAMES = ['/rosout','/tf']
 
 from diarc.base_adapter import *
+from diarc.adapter import reads_topology
+from diarc.compaction import CompactionSchedule, STRIDE
 from ros_topology import *
 from diarc.view import BlockItemAttributes
 from diarc.view import BandItemAttributes
@@ -33,7 +36,11 @@ class RosAdapter(BaseAdapter):
         super(RosAdapter,self).__init__(RosSystemGraph(),view)
         self._topology.hide_disconnected_snaps = True
         self._master = rosgraph.Master('/RosSystemGraph')
+        # Nodes and topics come and go, so close up the holes they leave now
+        # and then, keeping gaps so that dragging an item still moves only it
+        self._compaction = CompactionSchedule(self._topology,stride=STRIDE)
 
+    @reads_topology
     def get_block_item_attributes(self, block_index):
         """ Overloads the BaseAdapters stock implementation of this method """
         block = self._topology.blocks[block_index]
@@ -47,6 +54,7 @@ class RosAdapter(BaseAdapter):
         attrs.draw_debug = True
         return attrs
 
+    @reads_topology
     def get_band_item_attributes(self, band_altitude):
         """ Overloads the BaseAdapters stock implementation of this method """
         band = self._topology.bands[band_altitude]
@@ -73,8 +81,33 @@ class RosAdapter(BaseAdapter):
 
     def update_model(self):
         """ query the ros master for information about the state of the system """
+        # The master is queried without holding the topology's lock, so that
+        # the view can keep reading the topology while waiting for it.
         # Query master and compile a list of all published topics and their types
         allCurrentTopics = self._master.getPublishedTopics('/')
+        # Compile a list of node names
+        allCurrentNodes = rosnode.get_node_names()
+        # Look up the location of each node we do not know about yet
+        with self._topology.reading():
+            newNodes = [name for name in allCurrentNodes if name not in self._topology.nodes]
+        locations = dict()
+        for name in newNodes:
+            try:
+                locations[name] = self._master.lookupNode(name)
+            except socket.error:
+                raise Exception("Unable to communicate with master!")
+        # Check for added or removed connections
+        systemState = self._master.getSystemState()
+
+        with self._topology.writing():
+            self._apply_state(allCurrentTopics, allCurrentNodes, locations, systemState)
+            self._compaction.run()
+            self._update_view()
+
+    def _apply_state(self, allCurrentTopics, allCurrentNodes, locations, systemState):
+        """ brings the topology in line with the state queried from the master.
+        The caller must hold the topology's write lock.
+        """
         allCurrentTopicNames = [x[0] for x in allCurrentTopics]
         # Get all the topics we currently know about
         rsgTopics = self._topology.topics
@@ -90,8 +123,6 @@ class RosAdapter(BaseAdapter):
             if topicName not in rsgTopics: # and topicName not in QUIET_NAMES:
                 topic = Topic(self._topology,topicName,topicType)
 
-        # Compile a list of node names
-        allCurrentNodes = rosnode.get_node_names()
         # Get all nodes we currently know about
         rsgNodes = self._topology.nodes
 
@@ -101,17 +132,14 @@ class RosAdapter(BaseAdapter):
                 print "Removing Node",node.name, "not found in ",allCurrentNodes
                 node.release()
 
-        # Add any nodes not currently in the Ros System Graph
+        # Add any nodes not currently in the Ros System Graph. A node that was
+        # removed by another thread after its location was looked up is added
+        # by the next update instead.
         for name in allCurrentNodes:
-            if name not in rsgNodes: # and name not in QUIET_NAMES:
+            if name not in rsgNodes and name in locations: # and name not in QUIET_NAMES:
                 node = Node(self._topology,name)
-                try:
-                    node.location = self._master.lookupNode(name)
-                except socket.error:
-                    raise Exception("Unable to communicate with master!")
+                node.location = locations[name]
 
-        # Check for added or removed connections
-        systemState = self._master.getSystemState()
         # Process publishers
         for topicName, publishersList in systemState[0]:
             if topicName in QUIET_NAMES: 
@@ -123,7 +151,7 @@ class RosAdapter(BaseAdapter):
                     publisher.release()
             # Add publishers taht are not yet in the RosSystemGraph
             for nodeName in publishersList:
-                if nodeName not in [pub.node.name for pub in rsgPublishers]:
+                if nodeName not in [pub.node.name for pub in rsgPublishers] and nodeName in self._topology.nodes:
                     publisher = Publisher(self._topology,self._topology.nodes[nodeName],self._topology.topics[topicName])
 
         # Process subscribers
@@ -141,11 +169,9 @@ class RosAdapter(BaseAdapter):
                     subscriber.release()
             # Add subscriber taht are not yet in the RosSystemGraph
             for nodeName in subscribersList:
-                if nodeName not in [sub.node.name for sub in rsgSubscribers]:
+                if nodeName not in [sub.node.name for sub in rsgSubscribers] and nodeName in self._topology.nodes:
                     subscriber = Subscriber(self._topology,self._topology.nodes[nodeName],self._topology.topics[topicName])
 
-        self._update_view()
-
 
 
 
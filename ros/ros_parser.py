@@ -15,6 +15,8 @@
 import xml.etree.ElementTree as ET
 import xml.dom.minidom
 from ros_topology import *
+from diarc.builder import TopologyBuilder
+import itertools
 # [db] dan@danbrooks.net
 #
 # Parses ros:v2 xml syntax and generates a RosSystemGraph object
@@ -34,15 +36,25 @@ def parseFile(filename):
 def parseTree(tree):
     root = tree.getroot()
     
-    ros = RosSystemGraph()
+    # The objects are placed the same way their constructors would place them:
+    # nodes and topics at the next free index and altitudes, and connections
+    # at the next free order of their node's emitter or collector.
+    builder = TopologyBuilder(Node,Topic,Publisher,Subscriber)
+    topics = dict()
+    altitudes = itertools.count(1)
+    orders = dict()
+    def nextOrder(node,container):
+        order = orders.get((node,container),0)
+        orders[(node,container)] = order+1
+        return order
 
-    for xmlNode in root.findall("node"):
+    for index,xmlNode in enumerate(root.findall("node")):
         # Create new node
-        node = Node(ros)
-        node.name = xmlNode.attrib["name"].strip()
-        node.location = xmlNode.attrib["location"].strip()
-        node.pid = xmlNode.attrib["pid"].strip()
-        print "Adding Node",node.name
+        nodeName = xmlNode.attrib["name"].strip()
+        node = builder.add_vertex(index,name=nodeName,
+                                  location=xmlNode.attrib["location"].strip(),
+                                  pid=xmlNode.attrib["pid"].strip())
+        print "Adding Node",nodeName
 
         # Setup Publishers and Subscribers
         # Before we can create a connection, we need to add the topic
@@ -52,21 +64,21 @@ def parseTree(tree):
             msgType = xmlTopic.attrib["type"]
             # Grab existing topic if available 
             topic = None
-            if (name,msgType) not in ros.topics.keys():
+            if (name,msgType) not in topics:
                 print "Adding Topic ",name,msgType
-                topic = Topic(ros)
-                topic.name = name
-                topic.msgType = msgType
+                altitude = next(altitudes)
+                topic = builder.add_edge(altitude,altitude,-altitude,altitude,name=name,msgType=msgType)
+                topics[(name,msgType)] = topic
             else:
-                topic = ros.topics[(name,msgType)]
+                topic = topics[(name,msgType)]
                 
+            attributes = dict(bandwidth=int(xmlTopic.attrib["bw"].strip()),
+                              freq=int(xmlTopic.attrib["freq"].strip()))
             if xmlTopic.tag == "publishes":
-                print "Adding publisher",node.name,topic.name
-                conn = Publisher(ros,node,topic)
+                print "Adding publisher",nodeName,name
+                builder.add_source(node,topic,nextOrder(node,"emitter"),**attributes)
             if xmlTopic.tag == "subscribes":
-                print "Adding subscriber",node.name,topic.name
-                conn = Subscriber(ros,node,topic)
-            conn.bandwidth = int(xmlTopic.attrib["bw"].strip())
-            conn.freq = int(xmlTopic.attrib["freq"].strip())
+                print "Adding subscriber",nodeName,name
+                builder.add_sink(node,topic,nextOrder(node,"collector"),**attributes)
 
-    return ros
+    return builder.build(RosSystemGraph())
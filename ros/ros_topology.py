@@ -25,6 +25,7 @@
 #   Source = Publisher
 #
 from diarc.topology import *
+from diarc.util import nextFreeOrder
 
 class RosSystemGraph(Topology):
     def __init__(self):
@@ -40,17 +41,19 @@ class RosSystemGraph(Topology):
 
     def nextFreeNodeIndex(self):
         """ returns the next available node index """
-        return max(self.blocks.keys())+1 if len(self.blocks)>0 else 0
+        return self._block_index.max()+1 if len(self._block_index) > 0 else 0
     
     def nextFreeAltitudes(self):
         """ returns a 2-tuple of (posAltitude,negAltitude) of the avaliable altitudes """
-        altitudes = [band.altitude for band in self.bands.values()] + [0]
-        return (max(altitudes)+1,min(altitudes)-1)
+        posAltitude = self._pos_band_index.max() if len(self._pos_band_index) > 0 else 0
+        negAltitude = self._neg_band_index.min() if len(self._neg_band_index) > 0 else 0
+        return (posAltitude+1,negAltitude-1)
 
 
 
 
 class Node(Vertex):
+    __slots__ = ('name','location','pid')
     def __init__(self,rsg,name=None):
         typecheck(rsg,RosSystemGraph,"rsg")
         super(Node,self).__init__(rsg)
@@ -77,6 +80,7 @@ class Node(Vertex):
 
 
 class Topic(Edge):
+    __slots__ = ('name','msgType')
     def __init__(self,rsg,name=None,msgType=None):
         typecheck(rsg,RosSystemGraph,"rsg")
         super(Topic,self).__init__(rsg)
@@ -103,13 +107,14 @@ class Topic(Edge):
 
 
 class Publisher(Source):
+    __slots__ = ('bandwidth','msgType','freq')
     def __init__(self,rsg,node,topic):
         typecheck(rsg,RosSystemGraph,"rsg")
         typecheck(node,Node,"node")
         typecheck(topic,Topic,"topic")
         super(Publisher,self).__init__(rsg,node,topic)
-        # Dumb placement
-        self.snap.order = max(filter(lambda x: isinstance(x,int), [pub.snap.order for pub in node.publishers] + [-1]))+1
+        # Dumb placement - just get the next free order
+        self.snap.order = nextFreeOrder(node.block._emitter_index)
 
         self.bandwidth = None
         self.msgType = None
@@ -125,14 +130,15 @@ class Publisher(Source):
         return self.vertex
 
 class Subscriber(Sink):
+    __slots__ = ('bandwidth','msgType','freq')
     def __init__(self,rsg,node,topic):
         typecheck(rsg,RosSystemGraph,"rsg")
         typecheck(node,Node,"node")
         typecheck(topic,Topic,"topic")
         super(Subscriber,self).__init__(rsg,node,topic)
 
-        # Dumb placement
-        self.snap.order = max(filter(lambda x: isinstance(x,int), [sub.snap.order for sub in node.subscribers] + [-1]))+1
+        # Dumb placement - just get the next free order
+        self.snap.order = nextFreeOrder(node.block._collector_index)
 
         self.bandwidth = None
         self.msgType = None
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# Compares loading a topology from xml and from the binary format.
+#
+# Usage (from the repository root):
+#   PYTHONPATH=diarc python tests/benchmark.py [num_vertices] [num_edges]
+#
+# A random topology is written in both formats to a temporary directory, then
+# each file is loaded with parseFile. The size of each file and the time taken
+# to write and load it are reported, followed by the time taken to map the
+# binary file and create a window of 100 blocks from it.
+import gc
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import parser
+import binary
+from builder import TopologyBuilder
+
+def build(numVertices, numEdges):
+    rnd = random.Random(0)
+    builder = TopologyBuilder()
+    for index in range(numVertices):
+        builder.add_vertex(index)
+    orders = [0]*numVertices
+    for altitude in range(numEdges):
+        e = builder.add_edge(altitude+1, altitude+1, -(altitude+1), altitude+1)
+        for v in rnd.sample(range(numVertices), 2):
+            builder.add_source(v, e, orders[v])
+            orders[v] += 1
+        for v in rnd.sample(range(numVertices), 2):
+            builder.add_sink(v, e, orders[v])
+            orders[v] += 1
+    return builder.build()
+
+def timed(function, *args):
+    # As in timeit, collections triggered by the large topologies already in
+    # memory are kept out of the measurement
+    gc.disable()
+    try:
+        start = time.time()
+        result = function(*args)
+        return result, time.time()-start
+    finally:
+        gc.enable()
+
+def report(t):
+    directory = tempfile.mkdtemp()
+    try:
+        print "%-8s %12s %10s %10s" % ("format", "bytes", "write s", "load s")
+        for name, module in [("xml", parser), ("binary", binary)]:
+            filename = os.path.join(directory, "topology."+name)
+            dummy, write = timed(module.serializeFile, t, filename)
+            loaded, load = timed(module.parseFile, filename)
+            assert(len(loaded.vertices) == len(t.vertices))
+            print "%-8s %12d %10.3f %10.3f" % (name, os.path.getsize(filename), write, load)
+        mapped, opened = timed(binary.MappedTopology, filename)
+        lowest, highest = mapped.block_extent() or (0, 0)
+        middle = (lowest+highest)//2
+        blocks, window = timed(mapped.blocks, middle, middle+100)
+        mapped.close()
+        print "mapped: open %.3f s, window of %d blocks %.3f s" % (opened, len(blocks), window)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    numVertices = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    numEdges = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    report(build(numVertices, numEdges))
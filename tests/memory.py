@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# Reports the memory used by each type of topology object.
+#
+# Usage (from the repository root):
+#   PYTHONPATH=diarc python tests/memory.py [num_vertices] [num_edges]
+#
+# The size of an object is its own size plus the size of its instance
+# dictionary, if it has one, and of the containers it owns: the adjacency
+# dictionaries of a Vertex or Edge, the extent lists of an Edge and the order
+# indexes of a Block. The vertex and edge sets and the indexes shared by the whole topology are reported
+# as the Topology, and the growth of the process's peak resident memory while
+# building the topology is reported last.
+import sys
+import random
+import resource
+from topology import *
+
+def owned(obj):
+    """ returns the containers owned by a topology object """
+    containers = list()
+    if isinstance(obj, SortedIndex):
+        containers = [obj._keys, obj._objs, obj._extra]
+    elif isinstance(obj, TypedOrderedSet):
+        containers = [obj._items, obj._positions]
+    elif isinstance(obj, Vertex):
+        t = obj._topology
+        containers = [t._vertex_sources.get(obj), t._vertex_sinks.get(obj)]
+    elif isinstance(obj, Edge):
+        t = obj._topology
+        containers = [t._edge_sources.get(obj), t._edge_sinks.get(obj),
+                      obj._source_indices, obj._sink_indices]
+    elif isinstance(obj, Block):
+        containers = [obj._emitters, obj._collectors]
+    elif isinstance(obj, Topology):
+        containers = [value for value in obj.__dict__.values()
+                      if isinstance(value, (list, dict, set, SortedIndex, TypedOrderedSet))]
+    # Empty tuples and None are shared, and cost the object nothing
+    return [c for c in containers if c is not None and c != ()]
+
+def sizeof(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    for container in owned(obj):
+        size += sizeof(container)
+    return size
+
+def peak():
+    """ returns the peak resident memory of the process in bytes """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def build(numVertices, numEdges):
+    rnd = random.Random(0)
+    t = Topology()
+    vertices = [Vertex(t) for i in range(numVertices)]
+    for index, v in enumerate(vertices):
+        v.block.index = index
+    edges = [Edge(t) for i in range(numEdges)]
+    for altitude, e in enumerate(edges):
+        e.posBand.altitude = altitude+1
+        e.negBand.altitude = -(altitude+1)
+    for e in edges:
+        for v in rnd.sample(vertices, 2):
+            Source(t, v, e).snap.order = len(v.sources)
+        for v in rnd.sample(vertices, 2):
+            Sink(t, v, e).snap.order = len(v.sinks)
+    return t
+
+def report(t):
+    objects = dict()
+    for v in t.vertices:
+        objects.setdefault('Vertex', list()).append(v)
+        objects.setdefault('Block', list()).append(v.block)
+    for e in t.edges:
+        objects.setdefault('Edge', list()).append(e)
+        objects.setdefault('Band', list()).extend([e.posBand, e.negBand])
+        for c in e.sources + e.sinks:
+            objects.setdefault(c.__class__.__name__, list()).append(c)
+            objects.setdefault('Snap', list()).append(c.snap)
+    total = 0
+    print "%-8s %8s %12s %12s" % ("type", "count", "bytes/obj", "total bytes")
+    for name in sorted(objects):
+        sizes = [sizeof(obj) for obj in objects[name]]
+        total += sum(sizes)
+        print "%-8s %8d %12.1f %12d" % (name, len(sizes), float(sum(sizes))/len(sizes), sum(sizes))
+    topology = sizeof(t)
+    total += topology
+    print "%-8s %8d %12.1f %12d" % ("Topology", 1, topology, topology)
+    print "%-8s %8s %12s %12d" % ("total", "", "", total)
+
+if __name__ == "__main__":
+    numVertices = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    numEdges = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    before = peak()
+    t = build(numVertices, numEdges)
+    growth = peak()-before
+    report(t)
+    print "%-8s %8s %12s %12d" % ("rss", "", "", growth)
@@ -55,6 +55,1047 @@ class Test_BlockNeighbors(unittest.TestCase):
         assert(v3.block.rightBlock is None)
 
 
+class Test_BlockRelease(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        v2 = topology.Vertex(t)
+        v0.block.index = 0
+        v1.block.index = 5
+        v2.block.index = 9
+        assert(t.blocks.keys() == [0,5,9])
+
+        v1.release()
+        assert(t.blocks.keys() == [0,9])
+        assert(v0.block.rightBlock == v2.block)
+        assert(v2.block.leftBlock == v0.block)
+
+        # The index of a released block can be reused
+        v3 = topology.Vertex(t)
+        v3.block.index = 5
+        assert(v0.block.rightBlock == v3.block)
+        v3.block.index = None
+        assert(t.blocks.keys() == [0,9])
+
+    def test_order(self):
+        """ Vertices and edges stay in the order they were added as others are
+        released, including once the holes they leave are closed up """
+        import topology
+        t = topology.Topology()
+        vertices = [topology.Vertex(t) for i in range(10)]
+        edges = [topology.Edge(t) for i in range(10)]
+        for i in [7,0,3,8,1,9]:
+            vertices[i].release()
+            edges[i].release()
+        vertices.append(topology.Vertex(t))
+        assert(t.vertices == [vertices[i] for i in [2,4,5,6,10]])
+        assert(t.edges == [edges[i] for i in [2,4,5,6]])
+        assert(len(t._vertices) == 5 and vertices[0] not in t._vertices)
+
+
+class Test_BandNeighbors(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        v0.block.index = 0
+        v1.block.index = 1
+        edges = [topology.Edge(t) for i in range(3)]
+        for alt,edge in enumerate(edges):
+            edge.posBand.altitude = alt+1
+            edge.negBand.altitude = -(alt+1)
+            topology.Source(t,v0,edge)
+            topology.Sink(t,v1,edge)
+        e0, e1, e2 = edges
+
+        # Sources are all left of the sinks, so only positive bands are used
+        assert(e1.posBand.topBand == e2.posBand)
+        assert(e1.posBand.bottomBand == e0.posBand)
+        assert(e0.posBand.bottomBand is None)
+        assert(e1.negBand.isUsed() is False)
+
+        # Unused bands are skipped over
+        e1.sinks[0].release()
+        assert(e1.posBand.isUsed() is False)
+        assert(e0.posBand.topBand == e2.posBand)
+        assert(e2.posBand.bottomBand == e0.posBand)
+
+        # Swapping the blocks moves the connections onto the negative bands
+        v0.block.index = 2
+        assert(e0.posBand.topBand is None)
+        assert(e2.negBand.topBand == e0.negBand)
+        assert(e0.negBand.bottomBand == e2.negBand)
+
+
+class Test_SnapNeighbors(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v0.block.index = 0
+        sources = [topology.Source(t,v0,topology.Edge(t)) for i in range(4)]
+        for order,src in zip([3,0,7,5],sources):
+            src.snap.order = order
+        s3, s0, s7, s5 = [src.snap for src in sources]
+
+        assert(v0.block.emitter.keys() == [0,3,5,7])
+        assert(s0.leftSnap is None)
+        assert(s0.rightSnap == s3)
+        assert(s5.leftSnap == s3)
+        assert(s5.rightSnap == s7)
+        assert(s7.rightSnap is None)
+
+        s3.order = None
+        assert(s5.leftSnap == s0)
+        sources[2].release()
+        assert(s5.rightSnap is None)
+        assert(v0.block.emitter.keys() == [0,5])
+
+        # Order indexes only exist while they hold a snap
+        assert(v0.block._emitters is not None and v0.block._collectors is None)
+        assert(len(v0.block._collector_index) == 0)
+        sources[1].release()
+        s5.order = None
+        assert(v0.block._emitters is None and v0.block.emitter.keys() == [])
+
+
+class Test_Uniqueness(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        e1 = topology.Edge(t)
+        src0 = topology.Source(t,v0,e0)
+        src1 = topology.Source(t,v0,e1)
+
+        v0.block.index = 0
+        self.assertRaises(Exception, setattr, v1.block, "index", 0)
+        e0.posBand.altitude = 1
+        self.assertRaises(Exception, setattr, e1.posBand, "altitude", 1)
+        e0.posBand.rank = 0
+        self.assertRaises(Exception, setattr, e1.posBand, "rank", 0)
+        # Ranks are only unique among bands on the same side
+        e1.negBand.rank = 0
+        src0.snap.order = 0
+        self.assertRaises(Exception, setattr, src1.snap, "order", 0)
+
+        # Released values become available again
+        v0.release()
+        e0.release()
+        v1.block.index = 0
+        e1.posBand.altitude = 1
+        e1.posBand.rank = 0
+
+
+class Test_CachedViews(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v0.block.index = 0
+        blocks = t.blocks
+        version = t.version
+        assert(t.blocks is blocks)
+        self.assertRaises(TypeError, blocks.__setitem__, 1, v0.block)
+
+        v1 = topology.Vertex(t)
+        v1.block.index = 1
+        assert(t.version > version)
+        assert(blocks.keys() == [0])
+        assert(t.blocks.keys() == [0,1])
+
+
+
+class Test_Adjacency(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        e1 = topology.Edge(t)
+        src0 = topology.Source(t,v0,e0)
+        src1 = topology.Source(t,v0,e1)
+        snk0 = topology.Sink(t,v1,e0)
+        snk1 = topology.Sink(t,v1,e1)
+
+        assert(v0.sources == [src0,src1])
+        assert(v0.sinks == [])
+        assert(v1.sinks == [snk0,snk1])
+        assert(e0.sources == [src0])
+        assert(e0.sinks == [snk0])
+
+        src1.release()
+        assert(v0.sources == [src0])
+        assert(e1.sources == [])
+        assert(e1.sinks == [snk1])
+
+        e0.release()
+        assert(v0.sources == [])
+        assert(v1.sinks == [snk1])
+        assert(len(t._sources) == 0)
+        assert(len(t._sinks) == 1)
+
+        v1.release()
+        assert(e1.sinks == [])
+        assert(len(t._sinks) == 0)
+        # Vertices and edges without connections are not listed at all
+        assert(len(t._vertex_sinks) == 0 and len(t._edge_sinks) == 0)
+        assert(v0 not in t._vertex_sources and v0.sources == [])
+
+
+class Test_EdgeExtents(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        e0.posBand.altitude = 1
+        e0.negBand.altitude = -1
+        src = topology.Source(t,v0,e0)
+        snk = topology.Sink(t,v1,e0)
+        # Blocks without an index do not count
+        assert(not e0.posBand.isUsed())
+        assert(not e0.negBand.isUsed())
+        v0.block.index = 0
+        v1.block.index = 1
+        assert(e0._source_indices == [0] and e0._sink_indices == [1])
+        assert(e0.posBand.isUsed())
+        assert(not e0.negBand.isUsed())
+        assert(e0.posBand.emitters == [src.snap])
+        assert(e0.posBand.collectors == [snk.snap])
+        v0.block.index = 2
+        assert(e0._source_indices == [2])
+        assert(not e0.posBand.isUsed())
+        assert(e0.negBand.isUsed())
+        snk.release()
+        assert(e0._sink_indices == ())
+        assert(not e0.negBand.isUsed())
+
+
+class Test_Builder(unittest.TestCase):
+    def test(self):
+        import builder
+        b = builder.TopologyBuilder()
+        v0 = b.add_vertex(1)
+        v1 = b.add_vertex(0)
+        e0 = b.add_edge(posAltitude=1,posRank=0,negAltitude=-1,negRank=0)
+        b.add_source(v0,e0,0)
+        b.add_sink(v1,e0,0)
+        assert(b.has_source(v0,e0) and not b.has_sink(v0,e0))
+        t = b.build()
+        assert(t.blocks.keys() == [0,1])
+        assert(t.bands.keys() == [-1,1])
+        assert(t.vertices[0].sources[0].snap.order == 0)
+        assert(t.edges[0].negBand.isUsed())
+        assert(not t.edges[0].posBand.isUsed())
+
+        b.add_edge(posAltitude=1)
+        self.assertRaises(Exception, b.build)
+        b = builder.TopologyBuilder()
+        b.add_vertex(0)
+        b.add_vertex(0)
+        self.assertRaises(Exception, b.build)
+
+    def test_indexes(self):
+        """ The builder leaves the topology in the same state as the constructors """
+        import builder
+        import random
+        import topology
+        rnd = random.Random(0)
+        b = builder.TopologyBuilder()
+        t = topology.Topology()
+        vertices = [topology.Vertex(t) for i in range(6)]
+        for i,v in enumerate(vertices):
+            b.add_vertex(i if i != 3 else None)
+            v.block.index = i if i != 3 else None
+        for i in range(30):
+            e = topology.Edge(t)
+            e.posBand.altitude, e.negBand.altitude, e.negBand.rank = i+1, -(i+1), i
+            b.add_edge(i+1, None, -(i+1), i)
+            for kind,add in [(topology.Source,b.add_source),(topology.Sink,b.add_sink)]:
+                for v in rnd.sample(range(6),2):
+                    order = rnd.choice([None,i])
+                    add(v,i,order)
+                    kind(t,vertices[v],e).snap.order = order
+        built = b.build()
+
+        def state(t):
+            vertex = dict([(v,i) for i,v in enumerate(t.vertices)])
+            edge = dict([(e,i) for i,e in enumerate(t.edges)])
+            def ids(c):
+                return (type(c).__name__,vertex[c.vertex],edge[c.edge],c.snap.order)
+            indexes = [t._block_index,t._pos_band_index,t._neg_band_index,t._pos_used_band_index,
+                       t._neg_used_band_index,t._pos_band_ranks,t._neg_band_ranks]
+            return ([index.keys() for index in indexes],
+                    [[ids(c) for c in v.sources+v.sinks] for v in t.vertices],
+                    [[ids(c) for c in e.sources+e.sinks] for e in t.edges],
+                    [(e._source_indices,e._sink_indices) for e in t.edges],
+                    [[[ids(s.connection) for s in v.block._snap_index(emitter).values()]
+                      for emitter in [True,False]] for v in t.vertices],
+                    sorted([ids(c) for c in t._source_pairs.values()+t._sink_pairs.values()]),
+                    sorted([ids(c) for c in list(t._sources)+list(t._sinks)]))
+        assert(state(built) == state(t))
+        assert(any(isinstance(c,dict) for c in built._vertex_sources.values()))
+
+    def test_subclasses(self):
+        import builder
+        import snapshot
+        import topology
+        class Named(topology.Vertex):
+            __slots__ = ('name','location')
+        class Routed(topology.Source):
+            __slots__ = ('routingKeys',)
+        b = builder.TopologyBuilder(vertex=Named,source=Routed)
+        v0 = b.add_vertex(0,name="v0")
+        e0 = b.add_edge(1)
+        b.add_source(v0,e0,0,routingKeys=["key"])
+        t = topology.Topology()
+        log = topology.ChangeLog(t)
+        s = t.snapshot()
+        b.build(t)
+        assert(isinstance(t.vertices[0],Named) and t.vertices[0].name == "v0")
+        assert(t.vertices[0].location is None)
+        assert(t.vertices[0].sources[0].routingKeys == ["key"])
+        # Listeners are told about every object that was added
+        assert([change.kind for change in log.drain()] ==
+               ["vertex_added","index","edge_added","altitude","connection_added","order"])
+        assert(s.blocks == {})
+        self.assertRaises(Exception, builder.TopologyBuilder, vertex=topology.Edge)
+
+
+class Test_Parser(unittest.TestCase):
+    def describe(self,t):
+        return (sorted(t.blocks.keys()),
+                sorted([(a,b.rank) for a,b in t.bands.items()]),
+                sorted(t.snaps.keys()))
+
+    def test_stream(self):
+        import parser
+        import xml.etree.ElementTree as ET
+        for name in ["a","b","c","d","e","f"]:
+            filename = "data/v5_%s.xml"%name
+            with open(filename) as f:
+                streamed = parser.parseStream(f)
+            assert(self.describe(streamed) == self.describe(parser.parseTree(ET.parse(filename))))
+        # Other documents are rejected rather than read as an empty topology
+        for filename in ["data/amsl.xml","data/ros1.xml","data/rosbee.xml"]:
+            self.assertRaises(Exception,parser.parseFile,filename)
+        self.assertRaises(Exception,parser.parseString,"<topology version='diarc:v4'/>")
+
+    def test_serialize(self):
+        import parser
+        import topology
+        t = parser.parseFile("data/v5_c.xml")
+        assert(self.describe(parser.parseString(parser.serialize(t))) == self.describe(t))
+
+        # Values which are not set are left out
+        t = topology.Topology()
+        v0,v1 = topology.Vertex(t),topology.Vertex(t)
+        v0.block.index = 0
+        e0 = topology.Edge(t)
+        e0.posBand.altitude = 1
+        topology.Source(t,v0,e0).snap.order = 0
+        topology.Sink(t,v1,e0)
+        t = parser.parseString(parser.serialize(t))
+        assert(len(t.vertices) == 2 and t.blocks.keys() == [0])
+        assert(t.edges[0].posBand.rank is None and t.edges[0].negBand.altitude is None)
+        assert(sorted([c.snap.order for v in t.vertices for c in v.sources+v.sinks]) == [None,0])
+
+    def test_ros(self):
+        """ A topic published by one node and subscribed by another is one edge """
+        import sys
+        import xml.etree.ElementTree as ET
+        from StringIO import StringIO
+        from ros import ros_parser
+        tree = ET.ElementTree(ET.fromstring("""<ros version="ros:v2">
+            <node name="talker" location="" pid="">
+                <topics>
+                    <publishes name="/chatter" type="std_msgs/String" bw="0" freq="0" />
+                </topics>
+            </node>
+            <node name="listener" location="" pid="">
+                <topics>
+                    <subscribes name="/chatter" type="std_msgs/String" bw="0" freq="0" />
+                </topics>
+            </node>
+        </ros>"""))
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            t = ros_parser.parseTree(tree)
+            amsl = ros_parser.parseFile("data/amsl.xml")
+        finally:
+            sys.stdout = stdout
+        assert(len(t.edges) == 1)
+        topic = t.edges[0]
+        assert([c.vertex.name for c in topic.sources] == ["talker"])
+        assert([c.vertex.name for c in topic.sinks] == ["listener"])
+        assert(len(amsl.edges) == len(set([(e.name,e.msgType) for e in amsl.edges])) == 7)
+
+
+class Test_Binary(unittest.TestCase):
+    describe = Test_Parser.__dict__["describe"]
+
+    def test(self):
+        import binary
+        import parser
+        for name in ["a","b","c","d","e","f"]:
+            t = parser.parseFile("data/v5_%s.xml"%name)
+            loaded = binary.parseString(binary.serialize(t))
+            assert(self.describe(loaded) == self.describe(t))
+            # The binary format round trips through xml as well
+            assert(parser.serialize(parser.parseString(parser.serialize(loaded))) == parser.serialize(t))
+
+    def test_strings(self):
+        import binary
+        import topology
+        class Named(topology.Vertex):
+            __slots__ = ('name',)
+        class Topic(topology.Edge):
+            __slots__ = ('name',)
+        class Routed(topology.Source):
+            __slots__ = ('routingKeys',)
+        t = topology.Topology()
+        v0,v1 = Named(t),Named(t)
+        v0.name = v1.name = u"n\xf6de"
+        v0.block.index = 3
+        e0 = Topic(t)
+        e0.name = "topic"
+        e0.negBand.altitude = -2
+        c = Routed(t,v0,e0)
+        c.routingKeys = ["topic","key"]
+        topology.Sink(t,v1,e0).snap.order = 5
+        tables = binary.Tables(binary.serialize(t))
+        # Names are stored once
+        assert(sorted(tables.strings) == sorted([u"n\xf6de","topic","key"]))
+        assert(tables.vertex_index == [3,None])
+        assert(tables.vertex_names == [u"n\xf6de"]*2)
+        assert(tables.edge_bands == [(None,None,-2,None)] and tables.edge_names == ["topic"])
+        assert(tables.sources == [(0,0,None)] and tables.source_keys == [["topic","key"]])
+        assert(tables.sinks == [(1,0,5)] and tables.sink_keys == [[]])
+
+        data = binary.serialize(t)
+        loaded = binary.parseString(data)
+        assert(sorted([v.name for v in loaded.vertices]) == [u"n\xf6de"]*2)
+        assert(loaded.edges[0].name == "topic")
+        assert(list(loaded._sources)[0].routingKeys == ["topic","key"])
+        assert(list(loaded._sinks)[0].routingKeys is None)
+        self.assertRaises(Exception,binary.parseString,"DIARCXML"+data[8:])
+        self.assertRaises(Exception,binary.parseString,data[:8]+"\x02\x00\x00\x00"+data[12:])
+
+    def test_names(self):
+        """ Names loaded from ros xml survive a round trip through the binary format """
+        import sys
+        from StringIO import StringIO
+        from diarc import binary
+        from ros import ros_parser
+        from ros import ros_topology
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            t = ros_parser.parseFile("data/rosbee.xml")
+        finally:
+            sys.stdout = stdout
+        def names(t):
+            return (sorted([(v.block.index,v.name) for v in t.vertices]),
+                    sorted([(e.posBand.altitude,e.name) for e in t.edges]),
+                    sorted([(c.vertex.name,c.edge.name,c.snap.order) for c in list(t._sources)+list(t._sinks)]))
+        data = binary.serialize(t)
+        loaded = binary.parseString(data,ros_topology.RosSystemGraph(),
+                                    vertex=ros_topology.Node,edge=ros_topology.Topic,
+                                    source=ros_topology.Publisher,sink=ros_topology.Subscriber)
+        assert(names(loaded) == names(t))
+        assert(sorted(loaded.nodes.keys()) == sorted(t.nodes.keys()))
+        assert(names(binary.parseString(data)) == names(t))
+
+        import tempfile
+        import os
+        fd,filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            binary.serializeFile(t,filename)
+            mapped = binary.MappedTopology(filename)
+            assert(names(mapped.materialize()) == names(t))
+            mapped.close()
+        finally:
+            os.remove(filename)
+
+    def test_mapped(self):
+        import binary
+        import parser
+        import tempfile
+        import os
+        t = parser.parseFile("data/v5_e.xml")
+        fd,filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            binary.serializeFile(t,filename)
+            mapped = binary.MappedTopology(filename)
+            assert(mapped.vertex_count == len(t.vertices) and mapped.edge_count == len(t.edges))
+            assert(mapped.source_count == len(t._sources) and mapped.sink_count == len(t._sinks))
+            assert(mapped.block_extent() == (min(t.blocks.keys()),max(t.blocks.keys())))
+            assert(mapped.altitude_extent() == (min(t.bands.keys()),max(t.bands.keys())))
+            # Nothing is created until it is asked for
+            assert(len(mapped.topology.vertices) == 0)
+
+            indices = t.blocks.keys()
+            blocks = mapped.blocks(indices[1],indices[3])
+            assert([block.index for block in blocks] == indices[1:3])
+            assert(len(mapped.topology.vertices) == 2)
+            for block in blocks:
+                original = t.blocks[block.index].vertex
+                assert(sorted([c.snap.order for c in block.vertex.sources]) ==
+                       sorted([c.snap.order for c in original.sources]))
+                assert(sorted([c.edge.posBand.altitude for c in block.vertex.sinks]) ==
+                       sorted([c.edge.posBand.altitude for c in original.sinks]))
+            assert(mapped.blocks(indices[1],indices[3]) == blocks)
+
+            assert(self.describe(mapped.materialize()) == self.describe(t))
+            assert(all(v.name is None for v in mapped.topology.vertices))
+            mapped.close()
+
+            # The file is closed again when it cannot be opened
+            opened = list()
+            def recording_open(*args):
+                opened.append(open(*args))
+                return opened[-1]
+            binary.open = recording_open
+            try:
+                for data in ["DIARCXML"+binary.serialize(t)[8:],binary.serialize(t)[:40],""]:
+                    with open(filename,"wb") as f:
+                        f.write(data)
+                    self.assertRaises(Exception,binary.MappedTopology,filename)
+            finally:
+                del binary.open
+            assert(len(opened) == 3 and all([f.closed for f in opened]))
+        finally:
+            os.remove(filename)
+
+
+class Test_Batch(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        v0.block.index = 0
+        v1.block.index = 1
+        e0.posBand.altitude = 1
+        e0.posBand.rank = 0
+        src = topology.Source(t,v0,e0)
+        src.snap.order = 0
+
+        # Values may collide until the end of the batch
+        with t.batch():
+            v0.block.index = 1
+            v1.block.index = 0
+        assert(t.blocks[0] is v1.block and t.blocks[1] is v0.block)
+        assert(v1.block.rightBlock is v0.block)
+
+        # Collisions left at the end of the batch are rolled back
+        def collide():
+            with t.batch():
+                v0.block.index = 5
+                e0.posBand.altitude = 2
+                src.snap.order = 3
+                with t.batch():
+                    v1.block.index = 5
+        self.assertRaises(Exception, collide)
+        assert(v0.block.index == 1 and v1.block.index == 0)
+        assert(e0.posBand.altitude == 1)
+        assert(src.snap.order == 0)
+        assert(t.blocks.keys() == [0,1])
+        assert(t.bands.keys() == [1])
+
+        # So are changes made before an exception escapes the batch
+        def fail():
+            with t.batch():
+                e0.posBand.rank = None
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        assert(e0.posBand.rank == 0)
+        self.assertRaises(Exception, setattr, v0.block, 'index', 0)
+
+
+class Test_Changes(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        log = topology.ChangeLog(t)
+        v0 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        src = topology.Source(t,v0,e0)
+        v0.block.index = 3
+        e0.posBand.altitude = 1
+        src.snap.order = 0
+        changes = log.drain()
+        assert([c.kind for c in changes] == ["vertex_added","edge_added","connection_added","index","altitude","order"])
+        assert(changes[2].new == (v0,e0))
+        assert(changes[3].obj is v0.block and changes[3].old is None and changes[3].new == 3)
+        assert(log.drain() == [])
+
+        # Changes in a batch are delivered when it ends, and dropped if rolled back
+        with t.batch():
+            v0.block.index = 4
+            assert(log.drain() == [])
+        assert([(c.kind,c.old,c.new) for c in log.drain()] == [("index",3,4)])
+        def fail():
+            with t.batch():
+                v0.block.index = 5
+                topology.Vertex(t)
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        assert([c.kind for c in log.drain()] == ["vertex_added"])
+
+        v0.release()
+        changes = log.drain()
+        assert([c.kind for c in changes] == ["connection_released","vertex_released"])
+        assert(changes[1].old.index == 4)
+        log.close()
+        topology.Vertex(t)
+        assert(log.drain() == [])
+
+
+class Test_Snapshot(unittest.TestCase):
+    def test(self):
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        v1 = topology.Vertex(t)
+        e0 = topology.Edge(t)
+        v0.block.index = 0
+        v1.block.index = 1
+        e0.posBand.altitude = 1
+        src = topology.Source(t,v0,e0)
+        src.snap.order = 0
+        snk = topology.Sink(t,v1,e0)
+        snk.snap.order = 0
+        s = t.snapshot()
+        snaps = sorted(t.snaps.keys())
+        b0, b1 = v0.block, v1.block
+
+        with t.batch():
+            v0.block.index = 1
+            v1.block.index = 0
+        e0.posBand.altitude = 2
+        src.release()
+        v2 = topology.Vertex(t)
+        v2.block.index = 2
+        v1.release()
+
+        assert(s.blocks == {0: b0, 1: b1})
+        assert(s.index(b0) == 0 and b0.index == 1)
+        assert(s.bands.keys() == [1])
+        assert(sorted(s.snaps.keys()) == snaps)
+        assert(s.sources(v0) == [src] and s.sources(e0) == [src])
+        assert(s.sinks(v1) == [snk])
+        assert(s.endpoints(src) == (v0,e0))
+        assert(s.block(v1) is b1 and s.vertex(b1) is v1)
+        assert(s.order(s.snap(src)) == 0)
+        assert(v2 not in s.vertices)
+
+        # Reading the snapshot waits for writers to the topology
+        import threading
+        events = list()
+        def read():
+            s.blocks
+            events.append("read")
+        with t.writing():
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join(0.1)
+            assert(events == [])
+        reader.join()
+        assert(events == ["read"])
+        s.close()
+        self.assertRaises(Exception, getattr, s, "blocks")
+
+
+class Test_Diff(unittest.TestCase):
+    def build(self,indices,altitudes,sources,sinks):
+        import topology
+        t = topology.Topology()
+        vertices = dict()
+        for index in indices:
+            vertices[index] = topology.Vertex(t)
+            vertices[index].block.index = index
+        edges = dict()
+        for altitude in altitudes:
+            edges[altitude] = topology.Edge(t)
+            edges[altitude].posBand.altitude = altitude
+            edges[altitude].posBand.rank = altitude
+        for kind,connections in [(topology.Source,sources),(topology.Sink,sinks)]:
+            for index,altitude,order in connections:
+                kind(t,vertices[index],edges[altitude]).snap.order = order
+        return t
+
+    def describe(self,t):
+        return (sorted(t.blocks.keys()),
+                sorted([(a,b.rank) for a,b in t.bands.items()]),
+                sorted([(c.block.index,c.edge.posBand.altitude,c.snap.order,type(c).__name__)
+                        for v in t.vertices for c in v.sources+v.sinks]))
+
+    def test(self):
+        import diff
+        live = self.build([0,1,2],[1,2],[(0,1,0),(1,2,0)],[(1,1,0),(2,2,0)])
+        fresh = self.build([0,1,3],[1,2],[(0,1,0),(0,2,1)],[(1,1,0),(3,2,0)])
+        fresh.bands[2].rank = 3
+        kept = live.blocks[0]
+
+        changes = diff.diff(live,fresh)
+        kinds = sorted([c.kind for c in changes])
+        assert(kinds == ["connection_added","connection_added","connection_released",
+                         "connection_released","rank","vertex_added","vertex_released"])
+        changes.apply()
+        assert(self.describe(live) == self.describe(fresh))
+        assert(live.blocks[0] is kept)
+        assert(len(diff.diff(live,fresh)) == 0)
+        # Changesets only apply to the topology they were taken from
+        self.assertRaises(Exception, changes.apply)
+
+
+class Test_Layout(unittest.TestCase):
+    def test(self):
+        import topology
+        import layout
+        t = topology.Topology()
+        # A chain of vertices, placed out of order
+        indices = [4,0,7,2,9,5,1,8,3,6]
+        vertices = list()
+        for index in indices:
+            vertices.append(topology.Vertex(t))
+            vertices[-1].block.index = index*2
+        for v0,v1 in zip(vertices[:-1],vertices[1:]):
+            e = topology.Edge(t)
+            topology.Source(t,v0,e)
+            topology.Sink(t,v1,e)
+        before = layout.total_span(t)
+        crossings = layout.crossings(t)
+        for method in ["barycenter","median"]:
+            assert(len(layout.block_order(t,method)) == len(vertices))
+        order = layout.arrange_blocks(t)
+        assert(layout.total_span(t) == len(vertices)-1 < before)
+        assert(layout.crossings(t) == 0 < crossings)
+        assert(sorted(t.blocks.keys()) == [index*2 for index in range(len(vertices))])
+        assert(t.blocks.values() == order)
+
+    def test_crossings(self):
+        import topology
+        import layout
+        t = topology.Topology()
+        vertices = [topology.Vertex(t) for i in range(4)]
+        for i,v in enumerate(vertices):
+            v.block.index = i
+        # Two edges of the same span, the first stacked below the second. The
+        # link from block 1 to the second edge crosses the first edge.
+        for src,snk in [(0,2),(1,3)]:
+            e = topology.Edge(t)
+            topology.Source(t,vertices[src],e)
+            topology.Sink(t,vertices[snk],e)
+        assert(layout.crossings(t) == 1)
+        order = layout.arrange_blocks(t)
+        assert(layout.crossings(t) == 0 and layout.total_span(t) == 2)
+        assert(set([order[0].vertex,order[1].vertex]) in [set([vertices[0],vertices[2]]),set([vertices[1],vertices[3]])])
+
+        # The sweep agrees with checking every snap link against every band
+        import random
+        rnd = random.Random(0)
+        for trial in range(50):
+            n = rnd.randint(2,10)
+            edges = [rnd.sample(range(n),rnd.randint(2,min(n,4))) for i in range(rnd.randint(1,10))]
+            vertex_edges = [[e for e,members in enumerate(edges) if v in members] for v in range(n)]
+            order = range(n)
+            rnd.shuffle(order)
+            position = dict([(v,i) for i,v in enumerate(order)])
+            lo = [min([position[v] for v in members]) for members in edges]
+            hi = [max([position[v] for v in members]) for members in edges]
+            key = [(hi[e]-lo[e],e) for e in range(len(edges))]
+            count = len([(f,v,e) for f in range(len(edges)) for v in edges[f] for e in range(len(edges))
+                         if key[e] < key[f] and v not in edges[e] and lo[e] < position[v] < hi[e]])
+            assert(layout._crossings(order,edges,vertex_edges) == count)
+
+    def test_altitudes(self):
+        import topology
+        import layout
+        t = topology.Topology()
+        vertices = [topology.Vertex(t) for i in range(4)]
+        for i,v in enumerate(vertices):
+            v.block.index = i
+        # Edges from vertex 0 to 3, 1 to 2 and 3 to 0, at spread out altitudes
+        edges = list()
+        for altitude,(src,snk) in zip([3,7,9],[(0,3),(1,2),(3,0)]):
+            e = topology.Edge(t)
+            e.posBand.altitude = altitude
+            e.posBand.rank = altitude
+            e.negBand.altitude = -altitude
+            topology.Source(t,vertices[src],e)
+            topology.Sink(t,vertices[snk],e)
+            edges.append(e)
+        unplaced = topology.Edge(t)
+        unplaced.posBand.rank = 1
+
+        pos,neg = layout.assign_altitudes(t)
+        # The nested band sits below the band around it, and the unused band on top
+        assert(pos == [edges[1].posBand,edges[0].posBand,edges[2].posBand])
+        assert([b.altitude for b in pos] == [1,2,3] and [b.rank for b in pos] == [1,2,3])
+        assert(neg[0] is edges[2].negBand and [b.altitude for b in neg] == [-1,-2,-3])
+        assert(unplaced.posBand.rank == 4)
+
+
+class Test_Compaction(unittest.TestCase):
+    def test(self):
+        import topology
+        import compaction
+        t = topology.Topology()
+        v0,v1,v2 = [topology.Vertex(t) for i in range(3)]
+        e0,e1 = [topology.Edge(t) for i in range(2)]
+        v0.block.index = 3
+        v1.block.index = 8
+        v2.block.index = 10
+        e0.posBand.altitude = 4
+        e0.posBand.rank = 6
+        e1.posBand.altitude = 9
+        e1.negBand.altitude = -7
+        src = topology.Source(t,v0,e0)
+        src.snap.order = 2
+        snk = topology.Sink(t,v1,e0)
+        snk.snap.order = 0
+        topology.Source(t,v2,e1).snap.order = 5
+        schedule = compaction.CompactionSchedule(t,releases=2)
+        log = topology.ChangeLog(t)
+        assert(schedule.run() is None)
+        # Releasing the vertex releases its connection too
+        v1.release()
+        assert(schedule.due())
+        v1 = topology.Vertex(t)
+        v1.block.index = 1
+
+        remap = schedule.run()
+        assert(sorted(t.blocks.keys()) == [0,1,2])
+        assert([v1.block.index,v0.block.index,v2.block.index] == [0,1,2])
+        assert(sorted(t.bands.keys()) == [-1,1,2] and e0.posBand.rank == 1)
+        assert(remap.blocks == {1:0,3:1,10:2})
+        assert(remap.bands == {4:1,9:2,-7:-1})
+        assert(remap.snaps == {"3e2":"1e0","10e5":"2e0"})
+        assert(log.drain()[-1] == topology.Change("compacted",t,None,remap))
+        assert(not compaction.compact(t))
+
+
+class Test_Reorder(unittest.TestCase):
+    def setUp(self):
+        import topology
+        import view
+        import base_adapter
+        class Adapter(base_adapter.BaseAdapter):
+            def _update_view(self):
+                pass
+        self.t = t = topology.Topology()
+        self.adapter = Adapter(t,view.View())
+        self.vertices = [topology.Vertex(t) for i in range(4)]
+        self.edges = [topology.Edge(t) for i in range(3)]
+        for i,v in enumerate(self.vertices):
+            v.block.index = i
+        for i,e in enumerate(self.edges):
+            e.posBand.altitude = i+1
+            e.negBand.altitude = -(i+1)
+            topology.Source(t,self.vertices[0],e).snap.order = i
+            topology.Sink(t,self.vertices[3],e).snap.order = i
+
+    def order(self,index):
+        return [obj for key,obj in sorted(index.items())]
+
+    def test_blocks(self):
+        import topology
+        v = self.vertices
+        # Without room between blocks 2 and 3, the blocks are spread out first
+        assert(self.adapter.reorder_blocks(0,2,3))
+        assert(self.t.blocks.values() == [v[1].block,v[2].block,v[0].block,v[3].block])
+        # Afterwards a move only changes the moved block
+        log = topology.ChangeLog(self.t)
+        assert(self.adapter.reorder_blocks(v[3].block.index,None,v[1].block.index))
+        assert(self.t.blocks.values() == [v[3].block,v[1].block,v[2].block,v[0].block])
+        assert([c.kind for c in log.drain()] == ["index"])
+        assert(not self.adapter.reorder_blocks(v[1].block.index,v[3].block.index,v[2].block.index))
+        # Dropping a block next to itself leaves everything as it was
+        indexes = [b.index for b in self.t.blocks.values()]
+        assert(not self.adapter.reorder_blocks(indexes[1],indexes[1],indexes[2]))
+        assert(not self.adapter.reorder_blocks(indexes[1],indexes[0],indexes[1]))
+        assert([b.index for b in self.t.blocks.values()] == indexes)
+        assert(log.drain() == [])
+
+    def test_bands(self):
+        import topology
+        e = self.edges
+        assert(self.adapter.reorder_bands(1,2,3))
+        assert(self.order(self.t._pos_band_index) == [e[1].posBand,e[0].posBand,e[2].posBand])
+        log = topology.ChangeLog(self.t)
+        assert(self.adapter.reorder_bands(e[2].posBand.altitude,None,e[1].posBand.altitude))
+        assert(self.order(self.t._pos_band_index) == [e[2].posBand,e[1].posBand,e[0].posBand])
+        assert(self.adapter.reorder_bands(e[0].negBand.altitude,None,e[2].negBand.altitude))
+        assert(e[0].negBand.altitude < e[2].negBand.altitude < e[1].negBand.altitude < 0)
+        assert([c.kind for c in log.drain()] == ["altitude","altitude"])
+        assert(not self.adapter.reorder_bands(e[1].posBand.altitude,e[1].posBand.altitude,e[0].posBand.altitude))
+
+    def test_snaps(self):
+        import topology
+        block = self.vertices[0].block
+        snaps = self.order(block._emitter_index)
+        assert(self.adapter.reorder_snaps(0,"emitter",2,None,0))
+        log = topology.ChangeLog(self.t)
+        assert(self.adapter.reorder_snaps(0,"emitter",snaps[0].order,snaps[1].order,None))
+        assert(self.order(block._emitter_index) == [snaps[2],snaps[1],snaps[0]])
+        assert([c.kind for c in log.drain()] == ["order"])
+        assert(not self.adapter.reorder_snaps(0,"emitter",snaps[1].order,snaps[2].order,snaps[1].order))
+        assert(log.drain() == [])
+
+    def test_after_schedule(self):
+        import topology
+        import compaction
+        v = self.vertices
+        schedule = compaction.CompactionSchedule(self.t,releases=1,stride=compaction.STRIDE)
+        topology.Vertex(self.t).release()
+        assert(schedule.run())
+        # The scheduled compaction leaves room, so a drag moves only one block
+        log = topology.ChangeLog(self.t)
+        assert(self.adapter.reorder_blocks(v[0].block.index,v[1].block.index,v[2].block.index))
+        assert(self.t.blocks.values() == [v[1].block,v[0].block,v[2].block,v[3].block])
+        assert([c.kind for c in log.drain()] == ["index"])
+
+
+class Test_Locking(unittest.TestCase):
+    def test(self):
+        import threading
+        import topology
+        t = topology.Topology()
+        v0 = topology.Vertex(t)
+        events = list()
+
+        def read():
+            with t.reading():
+                events.append("read")
+
+        # Readers wait for the writer
+        with t.writing():
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join(0.1)
+            assert(events == [])
+            # The writer may read, write and batch
+            with t.reading():
+                with t.batch():
+                    v0.block.index = 0
+            events.append("write")
+        reader.join()
+        assert(events == ["write","read"])
+
+        # Readers may share the lock, but cannot start writing
+        with t.reading():
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join()
+            assert(events[-1] == "read")
+            self.assertRaises(Exception, t.writing().__enter__)
+
+
+class Test_Columnar(unittest.TestCase):
+    def setUp(self):
+        import columnar
+        if columnar.numpy is None:
+            self.skipTest("numpy is not installed")
+
+    def test(self):
+        import parser
+        import columnar
+        t = parser.parseFile('data/v5_e.xml')
+        c = columnar.ColumnarTopology.from_topology(t)
+        assert(sorted(c.blocks.keys()) == sorted(t.blocks.keys()))
+        assert(sorted(c.bands.keys()) == sorted(t.bands.keys()))
+        assert(sorted(c.snaps.keys()) == sorted(t.snaps.keys()))
+        for altitude, band in t.bands.items():
+            assert(c.bands[altitude].isUsed() == band.isUsed())
+            assert([s.snapkey() for s in c.bands[altitude].emitters] == [s.snapkey() for s in band.emitters])
+        for index, block in t.blocks.items():
+            left = c.blocks[index].leftBlock
+            assert(left.index == block.leftBlock.index if left else block.leftBlock is None)
+
+        self.assertRaises(Exception, setattr, c.blocks[0], 'index', 1)
+        c.blocks[0].index = 10
+        assert(c.blocks[10].leftBlock.index == max(t.blocks.keys()))
+        t2 = c.to_topology()
+        assert(sorted(t2.blocks.keys()) == sorted(c.blocks.keys()))
+
+    def test_update_view(self):
+        import parser
+        import columnar
+        import view
+        import base_adapter
+        class RecordingView(view.View):
+            """ records the settings of each item """
+            def __init__(self):
+                super(RecordingView,self).__init__()
+                self.blocks = dict()
+                self.bands = dict()
+                self.snaps = dict()
+            def has_block_item(self, index):
+                return index in self.blocks
+            def add_block_item(self, index):
+                self.blocks[index] = None
+            def remove_block_item(self, index):
+                del self.blocks[index]
+            def set_block_item_settings(self, index, *settings):
+                self.blocks[index] = settings
+            def set_block_item_attributes(self, index, attributes):
+                pass
+            def has_band_item(self, altitude):
+                return altitude in self.bands
+            def add_band_item(self, altitude, rank):
+                self.bands[altitude] = None
+            def remove_band_item(self, altitude):
+                del self.bands[altitude]
+            def set_band_item_settings(self, altitude, *settings):
+                self.bands[altitude] = settings
+            def set_band_item_attributes(self, altitude, attributes):
+                pass
+            def has_snap_item(self, snapkey):
+                return snapkey in self.snaps
+            def add_snap_item(self, snapkey):
+                self.snaps[snapkey] = None
+            def remove_snap_item(self, snapkey):
+                del self.snaps[snapkey]
+            def set_snap_item_settings(self, snapkey, *settings):
+                self.snaps[snapkey] = settings
+            def set_snap_item_attributes(self, snapkey, attributes):
+                pass
+            def update_view(self):
+                pass
+
+        t = parser.parseFile('data/v5_e.xml')
+        c = columnar.ColumnarTopology.from_topology(t)
+        views = list()
+        for model in [t, c]:
+            views.append(RecordingView())
+            base_adapter.BaseAdapter(model, views[-1])._update_view()
+        assert(views[0].blocks == views[1].blocks)
+        assert(views[0].bands == views[1].bands)
+        assert(views[0].snaps == views[1].snaps)
+        assert(len(views[1].bands) > 0)
+
+        # Changing the store through the proxies invalidates the cached queries
+        version = c.version
+        top = max(c.bands.keys())
+        c.bands[top].altitude = top+10
+        assert(c.version > version)
+        assert(list(c.used_bands(True)[0]) == [top+10])
+        c.hide_disconnected_snaps = True
+        assert(all(snap.isUsed() for snap in c.snaps.values()))
+
+
 
 
 